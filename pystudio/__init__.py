@@ -196,11 +196,16 @@ class pystudio:
         set_bath_temperature,\
         do_DACoffset_measurement,\
         assign_saved_DACoffsetTables,\
+        apply_sweep_parameter,\
+        estimate_sweep,\
+        run_sweep,\
+        configure_IV,\
         do_IV_measurement,\
         do_NEP_measurement,\
         do_SQUID_optimization,\
         do_skydip,\
         set_observation_mode,\
+        confirm_dataset_name,\
         start_acquisition,\
         start_observation,\
         end_observation,\
@@ -31,6 +31,14 @@ def asic_qsnumber(self,asicNum):
     qsAsicNum = 2**bitplace
     return qsAsicNum
 
+def ADU_result(ADU):
+    '''
+    the conversions accept a single value or an array of any shape (eg. a full table of 128 TES for N ASICs)
+    return a python number if the input was a single value, so that it can be used for bit operations as before
+    '''
+    if np.ndim(ADU)==0: return ADU.item()
+    return ADU
+
 def Voffset2ADU(self,Voffset):
     '''
     convert the bias offset in Volts to ADU
@@ -40,16 +48,16 @@ def Voffset2ADU(self,Voffset):
     '''
 
     ADUfloat = np.abs(Voffset)/288.58e-6
-    ADU = round(ADUfloat)
-    return ADU
+    ADU = np.rint(ADUfloat).astype(int)
+    return ADU_result(ADU)
 
 def ADU2Voffset(self,ADU):
     '''
     convert the bias offset ADU returned by dispatcher to Volts
     '''
     coeff = 288.58e-6
-    Voffset = coeff*ADU
-    return Voffset
+    Voffset = coeff*np.asarray(ADU)
+    return ADU_result(Voffset)
 
 def amplitude2ADU(self,amplitude):
     '''
@@ -60,38 +68,37 @@ def amplitude2ADU(self,amplitude):
     function=1.15432e-3x + 0.0
     '''
 
-    ADUfloat = amplitude/1.15432e-3
-    ADU = round(ADUfloat)
-    return ADU
+    ADUfloat = np.asarray(amplitude)/1.15432e-3
+    ADU = np.rint(ADUfloat).astype(int)
+    return ADU_result(ADU)
 
 def ADU2amplitude(self,ADU):
     '''
     convert the TES bias sine amplitude from ADU to Volts
     '''
-    amplitude = ADU*1.15432e-3
-    return amplitude
+    amplitude = np.asarray(ADU)*1.15432e-3
+    return ADU_result(amplitude)
 
 def offsetDACvalue2ADU(self,offsetDACvalue):
     '''
     convert the TES offset DAC value to ADU
     see parameterTF.dispatcher
     '''
+    offsetDACvalue = np.asarray(offsetDACvalue,dtype=float)
     ADUfloat = np.abs(offsetDACvalue)/1.4215e-4
-    ADU = round(ADUfloat)
-    if offsetDACvalue<0:
-        return (0xFFFF - ADU) # I don't think this is the standard way to do signed int.  It should be (0x8000 | ADU)
-    return ADU
+    ADU = np.rint(ADUfloat).astype(int)
+    # I don't think this is the standard way to do signed int.  It should be (0x8000 | ADU)
+    ADU = np.where(offsetDACvalue<0, 0xFFFF - ADU, ADU)
+    return ADU_result(ADU)
 
 def ADU2offsetDACvalue(self,ADU):
     '''
     convert an ADU value to the offsetDACvalue
     '''
     coeff = 1.4215e-4
-    if ADU>(0xFFFF//2):
-        offsetDACvalue = -coeff*(0xFFFF-ADU)
-    else:
-        offsetDACvalue = coeff*ADU
-    return offsetDACvalue
+    ADU = np.asarray(ADU)
+    offsetDACvalue = np.where(ADU>(0xFFFF//2), -coeff*(0xFFFF-ADU), coeff*ADU)
+    return ADU_result(offsetDACvalue)
 
 def feedbackDACvalue2ADU(self,feedbackDACvalue):
     '''
@@ -99,18 +106,25 @@ def feedbackDACvalue2ADU(self,feedbackDACvalue):
     see parameterTF.dispatcher
     '''
     coeff = 284.3e-6
+    feedbackDACvalue = np.asarray(feedbackDACvalue,dtype=float)
     ADUfloat = np.abs(feedbackDACvalue/coeff)
-    ADU = round(ADUfloat)
-    if feedbackDACvalue<0:
-        return 0xFFFF - ADU
-    return ADU
+    ADU = np.rint(ADUfloat).astype(int)
+    ADU = np.where(feedbackDACvalue<0, 0xFFFF - ADU, ADU)
+    return ADU_result(ADU)
 
 def ADU2feedbackDACvalue(self,ADU):
     '''
     convert an ADU value to the feedbackDACvalue
     '''
-    feedbackDACvalue = ADU*284.3e-6
-    return feedbackDACvalue
+    feedbackDACvalue = np.asarray(ADU)*284.3e-6
+    return ADU_result(feedbackDACvalue)
+
+def pack_ADU(ADU):
+    '''
+    pack the ADU values as 16-bit big-endian words, and return the list of bytes for the command
+    '''
+    words = (np.asarray(ADU,dtype=int).ravel() & 0xFFFF).astype('>u2')
+    return list(words.tobytes())
 
 def make_frontend_preamble(self,asicNum_list,subsysID1,subsysID2):
     '''
@@ -565,10 +579,7 @@ def make_command_offsetTable(self,asicNum,offsetTable):
     make the command to configure the DAC offsets
     '''
     cmd_bytes_list = self.make_frontend_preamble(asicNum,self.MULTINETQUICMANAGER_SETOFFSETTABLE_ID,0x22)
-    for val in offsetTable:
-        ADU = self.offsetDACvalue2ADU(val)
-        cmd_bytes_list.append( (ADU & 0xFF00) >> 8 )
-        cmd_bytes_list.append( (ADU & 0x00FF)      )
+    cmd_bytes_list += pack_ADU(self.offsetDACvalue2ADU(offsetTable))
     cmd_bytes_list = self.make_frontend_suffix(cmd_bytes_list)
     return self.make_communication_packet(cmd_bytes_list)
 
@@ -585,10 +596,7 @@ def make_command_feedbackTable(self,asicNum,feedbackTable):
     make the command to configure the DAC feedback offsets
     '''
     cmd_bytes_list = self.make_frontend_preamble(asicNum,self.MULTINETQUICMANAGER_SETFEEDBACKTABLE_ID,0x22)
-    for val in feedbackTable:
-        ADU = self.feedbackDACvalue2ADU(val)
-        cmd_bytes_list.append( (ADU & 0xFF00) >> 8 )
-        cmd_bytes_list.append( (ADU & 0x00FF)      )
+    cmd_bytes_list += pack_ADU(self.feedbackDACvalue2ADU(feedbackTable))
     cmd_bytes_list = self.make_frontend_suffix(cmd_bytes_list)
     return self.make_communication_packet(cmd_bytes_list)
 
@@ -28,7 +28,8 @@ parameterList = ['Voffset',
                  'undersampling',
                  'increment',
                  'duration',
-                 'comment']
+                 'comment',
+                 'continuous']
 options = parseargs(sys.argv,expected_args=parameterList)
 
 def cli():
@@ -39,7 +40,8 @@ def cli():
                                            undersampling=options['undersampling'],
                                            increment=options['increment'],
                                            duration=options['duration'],
-                                           comment=options['comment']
+                                           comment=options['comment'],
+                                           continuous=options['continuous']
                                            )
 
     ack = dispatcher.unsubscribe()
@@ -39,7 +39,7 @@ from pystudio import pystudio
 from qubichk.obsmount import obsmount
 from qubichk.hwp import get_hwp_info, send_hwp_command, hwp_wait_for_arrival
 from qubichk.utilities import printmsg, assign_logfile
-from qubichk.imacrt import iMACRT
+from qubichk.imacrt import get_imacrt
 logfile = assign_logfile('pystudio_log.txt')
 
 parameterList = ['el',
@@ -129,11 +129,10 @@ def do_constant_elevation_scanning(mount=None, dispatcher=None,
         # we will switch off the bath temperature PID before each HWP movement: 2026-05-20 17:39:37
         # not a good idea: 2026-05-20 19:20:20
         # see data: 2026-05-20_16.43.49__test_scan_temperature_control_off_during_hwp_movement
-        mgc = iMACRT(device='mgc')
-
-        # hack to flush wrong response
-        for ctr in range(10):
-            pidstate = mgc.get_mgc_pid()
+        # the shared client is also used by dispatcher.set_bath_temperature()
+        # stale replies are discarded by the client, so there is no need to flush
+        mgc = get_imacrt('mgc')
+        pidstate = mgc.get_mgc_pid()
         printmsg('PID state: %s' % pidstate,'iMACRT-MGC',logfile=logfile)
         
         hwp_increment = 1 # start by going in the positive direction
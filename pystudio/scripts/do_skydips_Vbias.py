@@ -14,15 +14,20 @@ do the sky dip sequence at one azimuth, for multiple Vbias
 arguments:
 
   ndips : number of up/down sequence for each Vbias (up and down is one sequence)
+  continuous : keep one acquisition running for all the Vbias values.
+               The Vbias steps are written to a step index file (see pystudio.sequence.step_index)
 
 For example:
 do_skydips_Vbias.py az=90 Tbath=0.320 ndips=2
+do_skydips_Vbias.py az=90 Tbath=0.320 ndips=2 continuous=1
 
 '''
 import sys
 from time import sleep
 from satorchipy.utilities import parseargs
+from satorchipy.datefunctions import utcnow
 from pystudio import pystudio
+from pystudio.sequence import step_index
 from qubichk.obsmount import obsmount
 
 parameterList = ['az',
@@ -34,7 +39,8 @@ parameterList = ['az',
                  'ndips',
                  'Tbath',
                  'title',
-                 'comment']
+                 'comment',
+                 'continuous']
 options = parseargs(sys.argv,expected_args=parameterList)
 
 def cli():
@@ -94,16 +100,32 @@ def cli():
     ack = dispatcher.park_frontend()
     sleep(10)
     
+    index = None
+    if options['continuous']:
+        # the dataset name assigned by QubicStudio (see pystudio.sequence.confirm_dataset_name)
+        dataset_name = dispatcher.start_observation(Voffset=Vmax,
+                                                    Tbath=options['Tbath'],
+                                                    comment=options['comment'],
+                                                    title=title_prefix
+                                                    )
+        index = step_index(dataset_name,['Vbias'])
+        print('step index: %s' % index.filename)
+    
     Vbias = Vmax
+    step_idx = 0
     while Vbias>=Vmin:
 
-        
-        title = '%s__%04.2fV' % (title_prefix,Vbias)
-        ack = dispatcher.start_observation(Voffset=Vbias,
-                                           Tbath=options['Tbath'],
-                                           comment=options['comment'],
-                                           title=title
-                                           )
+        if index is None:
+            title = '%s__%04.2fV' % (title_prefix,Vbias)
+            ack = dispatcher.start_observation(Voffset=Vbias,
+                                               Tbath=options['Tbath'],
+                                               comment=options['comment'],
+                                               title=title
+                                               )
+        else:
+            step_start = utcnow().timestamp()
+            if step_idx>0: ack = dispatcher.set_observation_mode(Voffset=Vbias,Tbath=options['Tbath'])
+            step_settled = utcnow().timestamp()
 
 
         for idx in range(ndips):
@@ -111,21 +133,27 @@ def cli():
             ack = mount.wait_for_arrival(el=elmax)
             if not ack['ok']:
                 print('ERROR! Did not get to elevation: %.1f degrees.  quitting.' % elmax)
+                if index is not None: index.close()
                 return
 
             ack = mount.goto_el(elmin)
             ack = mount.wait_for_arrival(el=elmin)
             if not ack['ok']:
                 print('ERROR! Did not get to elevation: %.1f degrees.  quitting.' % elmin)
+                if index is not None: index.close()
                 return
-            
-        ack = dispatcher.end_observation()
-        ack = dispatcher.park_frontend()
-        sleep(2)
+
+        if index is None:
+            ack = dispatcher.end_observation()
+            ack = dispatcher.park_frontend()
+            sleep(2)
+        else:
+            index.write(step_idx,step_start,step_settled,utcnow().timestamp(),{'Vbias':'%.2f' % Vbias})
         Vbias -= Vstep
+        step_idx += 1
 
         
-        
+    if index is not None: index.close()
     ack = dispatcher.end_observation()
     ack = dispatcher.park_frontend()
     ack = dispatcher.unsubscribe()
@@ -10,17 +10,20 @@ $license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
 
 basic sequences for running observations
 '''
-import os
+import os,time
 from time import sleep
 from datetime import timedelta
 import numpy as np
 from satorchipy.datefunctions import utcnow, str2dt
-from qubichk.imacrt import iMACRT
+from qubichk.imacrt import get_imacrt
 from qubichk.obsmount import obsmount
 from qubichk.utilities import read_DACoffsetTables, shellcommand, verify_directory, get_dataset_list
 from qubichk.entropy_hk import entropy_hk
 from qubicpack.utilities import interpret_rawmask
 
+# the datasets on qubic-central, where the HK of the mount is dumped during an acquisition
+dataset_topdir = '/home/qubic/data'
+
 #####################################
 # defaults
 default_setting = {}
@@ -85,6 +88,16 @@ for group_idx in range(4):
     default_setting['ASIC 1']['offsetTable'][start_idx:end_idx] = squid_group1[group_idx]
     default_setting['ASIC 2']['offsetTable'][start_idx:end_idx] = squid_group2[group_idx]
 
+#####################################
+# timing model for the dry-run estimate of a sweep (seconds)
+# these are updated with the measured values at the end of each sweep
+sweep_timing = {}
+sweep_timing['command'] = 0.3 # send_command() waits 0.1 seconds and then for the acknowledgement
+sweep_timing['start acquisition'] = 2.0
+sweep_timing['stop acquisition'] = 1.0
+sweep_timing['Tbath rate'] = 1.0e-4 # K/s
+sweep_timing['Tbath settle'] = 10.0 # the settling window for set_bath_temperature
+
 
 def get_default_setting(self,parm=None,asic=None,measurement=None):
     '''
@@ -225,9 +238,9 @@ def get_bath_temperature(self):
     '''
     get the current bath temperature
     '''
-    mgc = iMACRT(device='mgc')
-    Tmeas = mgc.get_mgc_measurement()    
-    if not (Tmeas is None or Tmeas=='' or Tmeas<0.3):
+    mgc = get_imacrt('mgc')
+    Tmeas = mgc.get_mgc_measurement(max_age=2*mgc.sampler_interval)
+    if not (Tmeas is None or Tmeas<0.3):
         return Tmeas
 
 
@@ -242,14 +255,17 @@ def get_bath_temperature(self):
     Tmeas = Tbath_dat[1]        
     return Tmeas
 
-def set_bath_temperature(self,Tbath,timeout=120,precision=0.0005):
+def set_bath_temperature(self,Tbath,timeout=120,precision=0.0005,window=10,slope_tolerance=None):
     '''
     set the iMACRT PID for the desired temperature and wait until it reaches the temperature
+    the temperature is followed by the background sampler of the shared iMACRT client.
+    It is settled when the fit over the last window seconds is within precision of Tbath,
+    and the drift rate is within slope_tolerance (K/s, default is precision/window)
     '''
     # get current temperature
-    mgc = iMACRT(device='mgc')
+    mgc = get_imacrt('mgc')
     Tmeas = mgc.get_mgc_measurement()    
-    if Tmeas is None or Tmeas=='':
+    if Tmeas is None:
         self.printmsg('Could not get temperature from MGC3.')
         return None
     else:
@@ -261,22 +277,19 @@ def set_bath_temperature(self,Tbath,timeout=120,precision=0.0005):
     ans = mgc.set_mgc_pid(1)
 
     # wait for temperature
-    Tdelta = np.abs(Tmeas-Tbath)
-    maxdate = utcnow() + timedelta(seconds=timeout)
-    while (Tdelta>precision) and (utcnow()<maxdate):
-        sleep(3)
-        Tmeas = mgc.get_mgc_measurement()
-        Tdelta = np.abs(Tmeas-Tbath)
+    Tbath_ok,Tlast = mgc.wait_for_stable(Tbath,precision,timeout=timeout,window=window,slope_tolerance=slope_tolerance)
+    mgc.disconnect()
+    if Tlast is not None: Tmeas = Tlast
     
-    if Tdelta>precision:
-        self.printmsg('Did not reach desired bath temperature.  Current temperature: %.3f mK' % (1000*Tmeas))
+    if not Tbath_ok:
+        msg = 'Did not reach desired bath temperature.  Current temperature: %.3f mK' % (1000*Tmeas)
+        t_settle = None
+        if mgc.settling is not None: t_settle = mgc.settling.time_to_settle()
+        if t_settle is not None: msg += ', estimated time to settle: %.0f seconds' % t_settle
+        self.printmsg(msg)
         return False
 
-    # give some extra settling time
-    sleep(10)
-    Tmeas = mgc.get_mgc_measurement()
-    mgc.disconnect()
-    self.printmsg('Current bath temperature: %.3f mK' % (1000*Tmeas))
+    self.printmsg('Current bath temperature: %.3f mK, settled after %.1f seconds' % (1000*Tmeas,mgc.settling.settled_time))
     return True
 
 
@@ -318,6 +331,306 @@ def assign_saved_DACoffsetTables(self):
         
     return ack
 
+def sweep_grid(parameters,snake=True):
+    '''
+    make the list of steps for a sweep from a list of (parameter name, list of values)
+    The first parameter is the outer loop, so put the slowest one first (eg. Tbath).
+    With snake=True, the inner loops alternate direction so that consecutive steps change as little as possible.
+    '''
+    steps = [{}]
+    for parm,values in parameters:
+        new_steps = []
+        for idx,step in enumerate(steps):
+            if snake and idx%2==1:
+                vals = list(values)[::-1]
+            else:
+                vals = list(values)
+            for val in vals:
+                new_step = dict(step)
+                new_step[parm] = val
+                new_steps.append(new_step)
+        steps = new_steps
+    return steps
+
+def apply_sweep_parameter(self,asicNum,parm,val):
+    '''
+    send the command to apply one parameter of a sweep step
+    return True if the command was acknowledged
+    '''
+    if parm=='Tbath':
+        return self.set_bath_temperature(val)==True
+    
+    if parm=='Spol':
+        ack = self.send_Spol(asicNum,val)
+    elif parm=='Apol':
+        ack = self.send_Apol(asicNum,val)
+    elif parm=='Aplitude':
+        ack = self.send_Aplitude(asicNum,val)
+    elif parm=='FeedbackRelay':
+        ack = self.send_FeedbackRelay(asicNum,val)
+    elif parm=='Voffset':
+        ack = self.send_TESDAC_CONTINUOUS(asicNum,val)
+    else:
+        self.printmsg('ERROR! Unknown sweep parameter: %s' % parm)
+        return False
+    
+    return ack is not None
+
+def sweep_dataset_name(step,title):
+    '''
+    the dataset name for a sweep step.
+    title is a format string with the parameter names, eg. 'SQUIDs_opt_bias_{Spol}', or a function of the step
+    '''
+    if callable(title): return title(step)
+    return title.format(**step)
+
+def estimate_sweep(self,steps,duration=None,Tstart=None,settle=None,continuous=False):
+    '''
+    estimate the time for a sweep without sending any commands
+    return a dictionary with the estimated time for each step and the total in seconds
+    '''
+    if duration is None: duration = 0
+    if settle is None: settle = {}
+
+    step_times = []
+    previous = {}
+    Tbath = Tstart
+    for step in steps:
+        t_step = 0.0
+        for parm,val in step.items():
+            if parm=='duration': continue
+            if parm in previous.keys() and previous[parm]==val: continue
+            if parm=='Tbath':
+                if Tbath is not None:
+                    t_step += abs(val - Tbath)/sweep_timing['Tbath rate']
+                t_step += sweep_timing['Tbath settle']
+                Tbath = val
+            else:
+                t_step += sweep_timing['command']
+            if parm in settle.keys(): t_step += settle[parm]
+        previous = step
+
+        if 'duration' in step.keys():
+            t_step += step['duration']
+        else:
+            t_step += duration
+        if not continuous:
+            t_step += sweep_timing['start acquisition'] + sweep_timing['stop acquisition']
+        step_times.append(t_step)
+
+    if continuous and len(step_times)>0:
+        step_times[0] += sweep_timing['start acquisition']
+        step_times[-1] += sweep_timing['stop acquisition']
+
+    estimate = {}
+    estimate['steps'] = step_times
+    estimate['total'] = sum(step_times)
+    estimate['finish'] = utcnow() + timedelta(seconds=estimate['total'])
+    return estimate
+
+class step_index:
+    '''
+    sidecar file with the step boundaries of a sweep done with a single continuous acquisition
+    the analysis can split the dataset using this file
+
+    one line per step:  step index, start, settled, end (unix timestamps), and the parameter values.
+    The step data is between settled and end.  Between start and settled, the parameters are changing.
+
+    Arguments:
+
+    dataset_name: the name of the acquisition assigned by QubicStudio (see confirm_dataset_name)
+    parameters: list of parameter names
+    index_dir: the directory for the file.  Default is the dataset directory (see dataset_directory)
+    '''
+
+    def __init__(self,dataset_name,parameters,index_dir=None):
+        if index_dir is None:
+            index_dir = verify_directory(dataset_directory(dataset_name))
+        if index_dir is None:
+            index_dir = verify_directory('/tmp')
+        self.filename = os.sep.join([index_dir,'%s_steps.txt' % dataset_name])
+        self.parameters = parameters
+        self.handle = open(self.filename,'w')
+        self.handle.write('# dataset: %s\n' % dataset_name)
+        self.handle.write('# step start settled end %s\n' % ' '.join(parameters))
+        self.handle.flush()
+        self.nsteps = 0
+        return None
+
+    def write(self,idx,start,settled,end,step):
+        '''
+        write the boundaries of a step.  The file is flushed so that it is complete even if the sweep is interrupted.
+        '''
+        vals = []
+        for parm in self.parameters:
+            if parm in step.keys():
+                vals.append(str(step[parm]))
+            else:
+                vals.append('nan')
+        line = '%i %.3f %.3f %.3f %s\n' % (idx,start,settled,end,' '.join(vals))
+        self.handle.write(line)
+        self.handle.flush()
+        self.nsteps += 1
+        return
+
+    def close(self):
+        '''
+        close the file
+        '''
+        self.handle.close()
+        return
+
+
+def run_sweep(self,
+              steps,
+              asicNum=None,
+              duration=None,
+              title=None,
+              comment=None,
+              setters=None,
+              settle=None,
+              continuous=False,
+              sweep_title=None,
+              dry_run=False):
+    '''
+    run a sequence of acquisitions, changing parameters at each step
+
+    steps: list of dictionaries of parameter values (see sweep_grid).  A step can also give its own 'duration'
+    asicNum: the ASICs to configure
+    duration: the acquisition time in seconds for each step
+    title: the dataset name, formatted with the step parameters (see sweep_dataset_name)
+    comment: the comment for the dataset
+    setters: dictionary of functions to apply a parameter instead of apply_sweep_parameter:  setter(self,asicNum,val)
+    settle: dictionary of extra waiting time in seconds after a parameter is changed.
+            By default, we continue as soon as the command is acknowledged,
+            and Tbath is settled according to the measured temperature (see set_bath_temperature)
+    continuous: keep one acquisition running for the whole sweep, and write the step boundaries to a step_index file
+    sweep_title: the dataset name for the continuous acquisition
+    dry_run: do not send any commands, just print the plan and the estimated time
+
+    Only the parameters which change from the previous step are sent.
+    '''
+    if asicNum is None: asicNum = self.get_default_setting('asicNum')
+    if duration is None: duration = 10
+    if title is None: title = 'sweep'
+    if comment is None: comment = 'sweep sent by pystudio'
+    if setters is None: setters = {}
+    if settle is None: settle = {}
+    if sweep_title is None: sweep_title = 'sweep'
+
+    Tstart = None
+    if len(steps)>0 and 'Tbath' in steps[0].keys():
+        Tstart = self.get_bath_temperature()
+        if Tstart<0.3: Tstart = None
+    estimate = self.estimate_sweep(steps,duration=duration,Tstart=Tstart,settle=settle,continuous=continuous)
+    self.printmsg('sweep of %i steps, estimated time: %s, finishing at %s'
+                  % (len(steps),timedelta(seconds=round(estimate['total'])),estimate['finish'].strftime('%Y-%m-%d %H:%M:%S')))
+
+    retval = {}
+    retval['estimate'] = estimate
+    retval['ok'] = []
+    retval['elapsed'] = []
+    retval['datasets'] = []
+    if dry_run:
+        if continuous: self.printmsg('continuous acquisition: %s' % sweep_title)
+        for idx,step in enumerate(steps):
+            self.printmsg('step %3i: %s %.1f seconds' % (idx,sweep_dataset_name(step,title),estimate['steps'][idx]))
+        return retval
+
+    command_time = 0.0
+    ncommands = 0
+    acq_start_time = 0.0
+    acq_stop_time = 0.0
+    sweep_start = time.monotonic()
+    index = None
+    if continuous:
+        parameters = []
+        for step in steps:
+            for parm in step.keys():
+                if parm not in parameters and parm!='duration': parameters.append(parm)
+        t0 = time.monotonic()
+        ack = self.send_startAcquisition(sweep_title,comment)
+        acq_start = utcnow()
+        acq_start_time += time.monotonic() - t0
+        dataset_name,acq_start = self.confirm_dataset_name(sweep_title,acq_start)
+        index = step_index(dataset_name,parameters)
+        retval['dataset'] = dataset_name
+        retval['index'] = index.filename
+        self.printmsg('continuous acquisition: %s with step index: %s' % (dataset_name,index.filename))
+    previous = {}
+    for idx,step in enumerate(steps):
+        step_start = time.monotonic()
+        step_start_tstamp = utcnow().timestamp()
+        step_ok = True
+        for parm,val in step.items():
+            if parm=='duration': continue
+            if parm in previous.keys() and previous[parm]==val: continue
+            tcmd = time.monotonic()
+            if parm in setters.keys():
+                ok = setters[parm](self,asicNum,val)
+            else:
+                ok = self.apply_sweep_parameter(asicNum,parm,val)
+            if parm!='Tbath':
+                command_time += time.monotonic() - tcmd
+                ncommands += 1
+            if not ok:
+                self.printmsg('ERROR! Could not set %s=%s for step %i' % (parm,val,idx))
+                step_ok = False
+                break
+            if parm in settle.keys(): sleep(settle[parm])
+
+        if not step_ok:
+            # do not skip the command for this parameter in the next step
+            previous = {}
+            retval['ok'].append(False)
+            retval['elapsed'].append(time.monotonic()-step_start)
+            retval['datasets'].append(None)
+            continue
+        previous = step
+
+        if 'duration' in step.keys():
+            step_duration = step['duration']
+        else:
+            step_duration = duration
+        if continuous:
+            settled_tstamp = utcnow().timestamp()
+            sleep(step_duration)
+            index.write(idx,step_start_tstamp,settled_tstamp,utcnow().timestamp(),step)
+        else:
+            dataset_name = sweep_dataset_name(step,title)
+            t0 = time.monotonic()
+            ack = self.send_startAcquisition(dataset_name,comment)
+            acq_start_time += time.monotonic() - t0
+            sleep(step_duration)
+            t0 = time.monotonic()
+            ack = self.send_stopAcquisition()
+            acq_stop_time += time.monotonic() - t0
+
+        retval['ok'].append(True)
+        retval['elapsed'].append(time.monotonic()-step_start)
+        retval['datasets'].append(dataset_name)
+
+    if continuous:
+        t0 = time.monotonic()
+        ack = self.send_stopAcquisition()
+        acq_stop_time += time.monotonic() - t0
+        index.close()
+
+    # update the timing model with the measurements
+    nacq = retval['ok'].count(True)
+    if ncommands>0: sweep_timing['command'] = command_time/ncommands
+    if continuous:
+        sweep_timing['start acquisition'] = acq_start_time
+        sweep_timing['stop acquisition'] = acq_stop_time
+    elif nacq>0:
+        sweep_timing['start acquisition'] = acq_start_time/nacq
+        sweep_timing['stop acquisition'] = acq_stop_time/nacq
+
+    elapsed = time.monotonic() - sweep_start
+    self.printmsg('sweep completed: %i of %i steps in %s (estimated %s)'
+                  % (nacq,len(steps),timedelta(seconds=round(elapsed)),timedelta(seconds=round(estimate['total']))))
+    return retval
+
 def do_IV_measurement(self,
                       asicNum=None,
                       Voffset=None,
@@ -369,21 +682,7 @@ def do_IV_measurement(self,
 
     #####################################
     # configure the bolometers
-
-    # stop all regulations
-    ack = self.send_stopFLL(asicNum)
-
-    # set feedback relay for I-V measurement
-    ack = self.send_FeedbackRelay(asicNum,10)
-
-    # set Aplitude corresponding to 10kOhm feedback relay
-    ack = self.send_Aplitude(asicNum,180)
-
-    # configure sine curve bias
-    ack = self.send_TESDAC_SINUS(asicNum,amplitude,Voffset,undersampling,increment)
-
-    # start all regulations
-    ack = self.send_startFLL(asicNum)
+    ack = self.configure_IV(asicNum,amplitude,Voffset,undersampling,increment)
 
     # start recording data
     # get current temperature
@@ -406,6 +705,39 @@ def do_IV_measurement(self,
     self.printmsg('%s - IV measurement completed' % utcnow().strftime('%Y-%m-%d %H:%M:%S'))
     return
 
+def configure_IV(self,asicNum,amplitude,Voffset,undersampling,increment):
+    '''
+    configure the bolometers for I-V measurement and start the regulations
+    '''
+    # stop all regulations
+    ack = self.send_stopFLL(asicNum)
+
+    # set feedback relay for I-V measurement
+    ack = self.send_FeedbackRelay(asicNum,10)
+
+    # set Aplitude corresponding to 10kOhm feedback relay
+    ack = self.send_Aplitude(asicNum,180)
+
+    # configure sine curve bias
+    ack = self.send_TESDAC_SINUS(asicNum,amplitude,Voffset,undersampling,increment)
+
+    # start all regulations
+    ack = self.send_startFLL(asicNum)
+    return ack
+
+def set_IV_bath_temperature(self,asicNum,Tbath):
+    '''
+    change the bath temperature for the NEP sweep
+    the regulations are stopped during the temperature change, as was done in do_IV_measurement()
+    '''
+    ack = self.send_stopFLL(asicNum)
+    Tbath_ok = self.set_bath_temperature(Tbath)
+    if not Tbath_ok:
+        self.printmsg("Tbath temperature not reached.  I'm not doing the I-V curve measurement at %.3f K" % Tbath)
+        return False
+    ack = self.send_startFLL(asicNum)
+    return ack is not None
+
 def do_NEP_measurement(self,
                        asicNum=None,
                        Voffset=None,
@@ -413,9 +745,13 @@ def do_NEP_measurement(self,
                        undersampling=None,
                        increment=None,
                        duration=None,
-                       comment=None):
+                       comment=None,
+                       Tbath_list=None,
+                       continuous=False,
+                       dry_run=False):
     '''
     do multiple IV measurements at different temperatures for the NEP analysis
+    with continuous=True, all the temperatures are in one dataset with a step index file (see run_sweep)
     '''
     
     #####################################
@@ -427,15 +763,51 @@ def do_NEP_measurement(self,
     if increment is None: increment = self.get_default_setting('increment',measurement='I-V')
     if duration is None: duration = self.get_default_setting('duration',measurement='I-V')
     if comment is None: comment = 'NEP sequence sent by pystudio'
+    if Tbath_list is None: Tbath_list = [0.420,0.380,0.360,0.340,0.330,0.320,0.310]
+
+    #####################################
+    # make sure the bias does not go out of acceptable range
+    Vmax = Voffset + 0.5*amplitude
+    if (Vmax>9):
+        self.printmsg('STOP:  Maximum bias voltage will be greater than 9 Volts: %.2f V' % Vmax)
+        return None
+
+    Vmin = Voffset - 0.5*amplitude
+    if (Vmin<1.0):
+        self.printmsg('STOP:  Minimum bias voltage will be less than 1 Volt: %.2f V' % Vmin)
+        return None
 
-    Tbath_list = [0.420,0.380,0.360,0.340,0.330,0.320,0.310]
-    for Tbath in Tbath_list:
-        self.do_IV_measurement(asicNum,Voffset,amplitude,undersampling,increment,Tbath,duration,comment)
+    steps = sweep_grid([('Tbath',Tbath_list)])
+    title = lambda step: 'IV_%.0fmK' % (1000*step['Tbath'])
+    if not dry_run: ack = self.configure_IV(asicNum,amplitude,Voffset,undersampling,increment)
+    sweep = self.run_sweep(steps,
+                           asicNum=asicNum,
+                           duration=duration,
+                           title=title,
+                           comment=comment,
+                           setters={'Tbath':set_IV_bath_temperature},
+                           continuous=continuous,
+                           sweep_title='NEP',
+                           dry_run=dry_run)
+    if dry_run: return sweep
 
+    # stop the FLL
+    ack = self.send_stopFLL(asicNum)
+    
     self.printmsg('%s - NEP measurement completed' % utcnow().strftime('%Y-%m-%d %H:%M:%S'))
-    return
+    return sweep
 
 
+def set_squid_bias(self,asicNum,Spol):
+    '''
+    set the SQUID bias for the SQUID optimization sweep
+    go to index 7, and then to the desired one (not sure why)
+    '''
+    ack = self.send_Spol(asicNum,7)
+    if ack is None: return False
+    ack = self.send_Spol(asicNum,Spol)
+    return ack is not None
+
 def do_SQUID_optimization(self,
                           asicNum=None,
                           Voffset=None,
@@ -446,9 +818,13 @@ def do_SQUID_optimization(self,
                           duration=None,
                           aplitude=None,
                           Apol=None,
-                          comment=None):
+                          comment=None,
+                          continuous=False,
+                          dry_run=False):
     '''
     run the sequence to measure the SQUID optimum bias
+    with continuous=True, all the Spol values are in one dataset with a step index file (see run_sweep)
+    with dry_run=True, nothing is sent and the estimated time is returned
     '''
 
     #####################################
@@ -464,6 +840,19 @@ def do_SQUID_optimization(self,
     if comment is None: comment = 'SQUID optimization measurement sent by pystudio'
     if Tbath is None: Tbath = 0.420
 
+    steps = sweep_grid([('Spol',range(16))])
+    title = 'SQUIDs_opt_bias_aplitude_%i_{Spol}' % aplitude
+    sweep_title = 'SQUIDs_opt_bias_aplitude_%i' % aplitude
+    if dry_run:
+        return self.run_sweep(steps,
+                              asicNum=asicNum,
+                              duration=duration,
+                              title=title,
+                              setters={'Spol':set_squid_bias},
+                              continuous=continuous,
+                              sweep_title=sweep_title,
+                              dry_run=True)
+
     #####################################
     # save the current Spol values to re-assign them after the end of the measurement
     spol_start = self.get_spol()
@@ -504,35 +893,18 @@ def do_SQUID_optimization(self,
     # configure sine curve bias
     ack = self.send_TESDAC_SINUS(asicNum,amplitude,Voffset,undersampling,increment)
 
-    # get current temperature
-    mgc = iMACRT(device='mgc')
-    Tmeas = mgc.get_mgc_measurement()
-    if Tmeas is None:
-        T_str = ''
-    else:
-        T_str = '%.0fmK' % (1000*Tmeas)
-
-    
     # loop through the Spol values
-    for bias_index in range(16):
-        # go to index 7, and then to the desired one (not sure why)
-        ack = self.send_Spol(asicNum,7)
-        sleep(1)
-        # set the Spol value
-        ack = self.send_Spol(asicNum,bias_index)
-        sleep(1)
-        
-        dataset_name = 'SQUIDs_opt_bias_aplitude_%i_%i' % (aplitude,bias_index)
-        ack = self.send_startAcquisition(dataset_name,comment)
-
-        # wait for measurement
-        sleep(duration)
-
-        # stop the acquisition
-        ack = self.send_stopAcquisition()
-
+    sweep = self.run_sweep(steps,
+                           asicNum=asicNum,
+                           duration=duration,
+                           title=title,
+                           comment=comment,
+                           setters={'Spol':set_squid_bias},
+                           continuous=continuous,
+                           sweep_title=sweep_title)
 
     # switch off the temperature feedback
+    mgc = get_imacrt('mgc')
     mgc.set_mgc_pid(0)
     mgc.disconnect()
 
@@ -548,7 +920,7 @@ def do_SQUID_optimization(self,
         sleep(1)
     
     self.printmsg('%s - SQUID optimization measurement completed' % utcnow().strftime('%Y-%m-%d %H:%M:%S'))
-    return
+    return sweep
 
 
 def set_observation_mode(self,Voffset=None,Tbath=None,FLL=None):
@@ -600,18 +972,22 @@ def set_observation_mode(self,Voffset=None,Tbath=None,FLL=None):
 
     return
 
-def start_acquisition(self,title=None,comment=None):
+def dataset_directory(dataset_name):
     '''
-    start the data acquisition
+    the directory of a dataset on qubic-central, where the HK of the mount is dumped
+    the dataset name begins with the date, for example: 2026-10-19_10.15.20__observation
+    '''
+    day_str = dataset_name.split('_')[0]
+    return os.sep.join([dataset_topdir,day_str,dataset_name])
+
+def confirm_dataset_name(self,title,acq_start):
+    '''
+    get the dataset name assigned by QubicStudio after the start of an acquisition
+    The name begins with the date, which can differ by a second or more from our start time.
+    The dataset should be the most recent one on QubicStudio.
+
+    return the dataset name and its start time.  If it is not found, the name is made with our start time
     '''
-    #####################################
-    # defaults
-    if title is None: title = 'observation'
-    if comment is None: comment = 'observation sent by pystudio'
-    
-    # start recording data
-    ack = self.send_startAcquisition(title,comment)
-    acq_start = utcnow()
     dataset_name = '%s__%s' % (acq_start.strftime('%Y-%m-%d_%H.%M.%S'),title)
 
     ######################################################################################
@@ -630,7 +1006,7 @@ def start_acquisition(self,title=None,comment=None):
     # no match, or not close, continue with the assigned dataset name
     sleep(1)
     dset_list = get_dataset_list()
-    if dataset_name not in dset_list:
+    if dataset_name not in dset_list and len(dset_list)>0:
         qs_dset = dset_list[0]
         qs_dset_date = str2dt(qs_dset.split('__')[0],timezone='UTC')
         if qs_dset_date is not None:
@@ -638,22 +1014,39 @@ def start_acquisition(self,title=None,comment=None):
             if delta_secs<10:
                 dataset_name = qs_dset
                 acq_start = qs_dset_date
+            else:
+                self.printmsg('WARNING! could not confirm the dataset name.  Using: %s' % dataset_name)
+    return dataset_name,acq_start
+
+def start_acquisition(self,title=None,comment=None):
+    '''
+    start the data acquisition
+    return the dataset name
+    '''
+    #####################################
+    # defaults
+    if title is None: title = 'observation'
+    if comment is None: comment = 'observation sent by pystudio'
     
+    # start recording data
+    ack = self.send_startAcquisition(title,comment)
+    acq_start = utcnow()
+    dataset_name,acq_start = self.confirm_dataset_name(title,acq_start)
     
     # start dumping the azel data
     mount = obsmount()
-    day_str = acq_start.strftime('%Y-%m-%d')
-    dump_dir = os.sep.join(['/home/qubic/data',day_str,dataset_name,'Hks'])
+    dump_dir = os.sep.join([dataset_directory(dataset_name),'Hks'])
     cmd = 'DUMP=%s' % dump_dir
     ack = mount.send_request_to_rebroadcaster(cmd)
     mount.disconnect()
    
     self.printmsg('%s - %s started' % (utcnow().strftime('%Y-%m-%d %H:%M:%S'),title))
-    return
+    return dataset_name
 
 def start_observation(self,Voffset=None,Tbath=None,title=None,comment=None,FLL=True):
     '''
     setup the frontend for observing and start the acquisition
+    return the dataset name
     '''
     #####################################
     # defaults
@@ -669,9 +1062,9 @@ def start_observation(self,Voffset=None,Tbath=None,title=None,comment=None,FLL=T
     # pause a few seconds before starting acquisition
     self.printmsg('waiting 5 seconds to settle before starting acquisition')
     sleep(5)
-    ack = self.start_acquisition(title=title,comment=comment)
+    dataset_name = self.start_acquisition(title=title,comment=comment)
     
-    return
+    return dataset_name
 
 def end_observation(self):
     '''
@@ -709,7 +1102,7 @@ def park_frontend(self):
     ack = self.send_TESDAC_SINUS(asicNum,amplitude,Voffset,undersampling,increment)
 
     # switch off the temperature feedback loop
-    mgc = iMACRT(device='mgc')
+    mgc = get_imacrt('mgc')
     ans = mgc.set_mgc_pid(0)
     mgc.disconnect()
     
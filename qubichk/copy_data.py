@@ -15,12 +15,14 @@ and access to the calsource files via nfs.
 
 This script was replaced by archive-data.sh Wed 15 Jul 2020 10:40:46 CEST
 '''
-import sys,os,time
+import sys,os,io,time,shlex,subprocess,tempfile
 from glob import glob
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import datetime as dt
 import numpy as np
 from astropy.io import fits
 from qubichk.utilities import shellcommand
+from qubichk.transfer_manifest import transfer_manifest, file_checksums
 
 cc_datadir  = '/sps/qubic/Data/Calib-TD'
 #qs_datadir  = '/qs/Qubic Studio/backup'
@@ -29,6 +31,14 @@ cs_datadir  = '/calsource/qubic'
 jup_datadir = '/qubic/Data/Calib-TD'
 central_datadir = '/archive'
 
+max_streams = 4 # the number of ssh sessions at the same time
+batch_bytes = 2*1024**3 # the maximum size of one transfer session
+batch_nfiles = 2000 # the maximum number of files in one transfer session
+check_interval = 86400 # the time in seconds between complete listings of the archive
+nverify = 50 # the number of files on the archive verified with the checksum at each run
+calsource_chunk_size = 16*1024*1024 # the number of bytes of a calsource dat file parsed at once
+calsource_dtype = np.dtype([('timestamp','>f8'),('amplitude','>i2')]) # the rows of the FITS binary table
+
 def archive_command(server,archive_cmd):
     '''
     run a command via ssh on the archive server (either cc or apcjupyter)
@@ -79,6 +89,38 @@ def files_on_calsource():
 
     return cs_filelist, cs_filelist_relative
 
+def files_in_tree(datadir,extensions):
+    '''
+    find all the files with the given extensions anywhere below datadir (like find -type f -name)
+    return the list of full filenames, and the list of filenames relative to datadir
+    '''
+    filelist = []
+    for root,dirs,files in os.walk(datadir):
+        for F in files:
+            if os.path.splitext(F)[1] in extensions:
+                filelist.append(os.path.join(root,F))
+    filelist.sort()
+    return filelist,make_relative_filelist(datadir,filelist)
+
+def files_on_source(server):
+    '''
+    find the data files to copy to the archive, on QubicStudio and on the calsource
+    For qubic-central, this is every FITS file under QubicStudio and every FITS and dat file under the calsource,
+    in any subdirectory.  For the other archives, only the dataset files and the calsource files in the top directory.
+    return the list of full filenames, their source directory, and the relative filenames on the archive
+    '''
+    if server=='central':
+        qs_filelist, qs_filelist_relative = files_in_tree(qs_datadir,['.fits'])
+        cs_filelist, cs_filelist_relative = files_in_tree(cs_datadir,['.fits','.dat'])
+        cs_filelist_relative = ['calsource/'+f for f in cs_filelist_relative]
+    else:
+        qs_filelist, qs_filelist_relative = files_on_QubicStudio()
+        cs_filelist, cs_filelist_relative = files_on_calsource()
+    filelist = qs_filelist + cs_filelist
+    srcdirs = [qs_datadir]*len(qs_filelist) + [cs_datadir]*len(cs_filelist)
+    relnames = qs_filelist_relative + cs_filelist_relative
+    return filelist,srcdirs,relnames
+
 def files_on_central():
     '''
     find the files archived on qubic-central
@@ -110,16 +152,275 @@ def files_on_archive(server):
     cmd = 'find %s -type f \\( -name "*.fits" -o -name "*.dat" \\)' % datadir
     out,err = archive_command(server,cmd)
     if err:
-        print(err.decode())
+        print(err)
 
-    filelist = out.decode().split('\n')
+    filelist = out.split('\n')
     filelist_relative = make_relative_filelist(datadir,filelist)
     return filelist, filelist_relative
         
 
-def copy2archive(server):
+def archive_argv(server,archive_cmd):
+    '''
+    the argument list to run a command on the archive server, without going through the local shell
+    '''
+    if server == 'central':
+        return ['sh','-c',archive_cmd]
+    return ['ssh',server,archive_cmd]
+
+def source_file_info(server=None,skip=None,max_workers=16):
+    '''
+    find the data files on QubicStudio and the calsource, with their size and modification time
+    return a dictionary of relative filename on the archive -> (source directory, filename in the source directory, size, mtime)
+    the files are on Samba and nfs mounts, so the stat is done in parallel
+    server: the archive, which decides which files are copied (see files_on_source)
+    skip: relative filenames which are not checked (the files already copied)
+    '''
+    filelist,srcdirs,relnames = files_on_source(server)
+    if skip:
+        keep = [idx for idx,relname in enumerate(relnames) if relname not in skip]
+        filelist = [filelist[idx] for idx in keep]
+        srcdirs = [srcdirs[idx] for idx in keep]
+        relnames = [relnames[idx] for idx in keep]
+
+    def stat(F):
+        try:
+            st = os.stat(F)
+        except OSError:
+            return None
+        return st.st_size,int(st.st_mtime)
+
+    info = {}
+    if len(filelist)==0: return info
+    with ThreadPoolExecutor(max_workers=min(max_workers,len(filelist))) as executor:
+        for idx,result in enumerate(executor.map(stat,filelist)):
+            if result is None: continue
+            srcdir = srcdirs[idx]
+            info[relnames[idx]] = (srcdir,os.path.relpath(filelist[idx],srcdir),result[0],result[1])
+    return info
+
+def archive_file_info(server,datadir,nstreams=max_streams):
+    '''
+    find the data files on the archive with their size and modification time
+    the top level directories are divided between nstreams ssh sessions which run at the same time
+    return a dictionary of relative filename -> (size, mtime)
+    '''
+    cmd = 'find %s -mindepth 1 -maxdepth 1 -type d' % shlex.quote(datadir)
+    proc = subprocess.run(archive_argv(server,cmd),capture_output=True)
+    if proc.returncode!=0:
+        print(proc.stderr.decode().strip())
+        return None
+    topdirs = [d for d in proc.stdout.decode().split('\n') if d]
+    topdirs.sort()
+
+    # the files in the top directory are listed by one more session
+    find_args = '-type f \\( -name "*.fits" -o -name "*.dat" \\) -printf "%s %T@ %p\\n"'
+    cmds = ['find %s -maxdepth 1 %s' % (shlex.quote(datadir),find_args)]
+    for idx in range(nstreams):
+        group = topdirs[idx::nstreams]
+        if len(group)==0: continue
+        cmds.append('find %s %s' % (' '.join([shlex.quote(d) for d in group]),find_args))
+
+    def listing(cmd):
+        proc = subprocess.run(archive_argv(server,cmd),capture_output=True)
+        err = proc.stderr.decode().strip()
+        if err: print(err)
+        return proc.stdout.decode(errors='replace')
+
+    info = {}
+    prefix = datadir.rstrip('/') + '/'
+    with ThreadPoolExecutor(max_workers=len(cmds)) as executor:
+        for out in executor.map(listing,cmds):
+            for line in out.split('\n'):
+                cols = line.split(' ',2)
+                if len(cols)<3: continue
+                try:
+                    size = int(cols[0])
+                    mtime = int(float(cols[1]))
+                except:
+                    continue
+                relname = cols[2].replace(prefix,'',1)
+                info[relname] = (size,mtime)
+    return info
+
+def files_to_sync(src_info,archive_info):
+    '''
+    compare the source files with the files on the archive
+    a file is copied if it is not on the archive, or if the size is different, or if the source is more recent
+    return the list of relative filenames to copy
+    '''
+    files2copy = []
+    for relname in sorted(src_info.keys()):
+        srcdir,srcname,size,mtime = src_info[relname]
+        if relname not in archive_info:
+            files2copy.append(relname)
+            continue
+        archive_size,archive_mtime = archive_info[relname]
+        if archive_size!=size or archive_mtime<mtime:
+            files2copy.append(relname)
+    return files2copy
+
+def make_batches(src_info,files2copy,archive_datadir,max_bytes=batch_bytes,max_files=batch_nfiles):
     '''
-    copy data files to CC-IN2P3 or to apcjupyter
+    group the files by source directory and destination directory, and divide them into transfer sessions
+    return a list of batches:  (source directory, destination directory, list of filenames, number of bytes, list of relative filenames)
+    '''
+    groups = {}
+    for relname in files2copy:
+        srcdir,srcname,size,mtime = src_info[relname]
+        # the part of the relative filename which is not in the source name is the destination subdirectory (calsource)
+        destdir = archive_datadir
+        subdir = relname[:len(relname)-len(srcname)].strip('/')
+        if subdir: destdir = '%s/%s' % (archive_datadir,subdir)
+        key = (srcdir,destdir)
+        if key not in groups.keys(): groups[key] = []
+        groups[key].append((srcname,size,relname))
+
+    batches = []
+    for key in sorted(groups.keys()):
+        srcdir,destdir = key
+        names = []
+        relnames = []
+        nbytes = 0
+        for srcname,size,relname in sorted(groups[key]):
+            if names and (nbytes+size>max_bytes or len(names)>=max_files):
+                batches.append((srcdir,destdir,names,nbytes,relnames))
+                names = []
+                relnames = []
+                nbytes = 0
+            names.append(srcname)
+            relnames.append(relname)
+            nbytes += size
+        if names: batches.append((srcdir,destdir,names,nbytes,relnames))
+    return batches
+
+def transfer_batch(server,srcdir,destdir,names):
+    '''
+    copy files in one session:  a tar stream through ssh
+    the directories are made by tar, and the modification times are kept
+    return True if successful, and the error message
+    '''
+    listfile = tempfile.NamedTemporaryFile(mode='wb',prefix='copy2archive_',suffix='.lst',delete=False)
+    listfile.write(b'\0'.join([name.encode() for name in names])+b'\0')
+    listfile.close()
+
+    q_destdir = shlex.quote(destdir)
+    archive_cmd = 'mkdir --parents %s && tar -C %s -xpf -' % (q_destdir,q_destdir)
+    try:
+        tar = subprocess.Popen(['tar','-C',srcdir,'--null','-T',listfile.name,'-cf','-'],
+                               stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        rx = subprocess.Popen(archive_argv(server,archive_cmd),
+                              stdin=tar.stdout,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        tar.stdout.close() # so that tar gets SIGPIPE if the ssh session fails
+        rx_out,rx_err = rx.communicate()
+        tar_err = tar.stderr.read()
+        tar.wait()
+    finally:
+        os.remove(listfile.name)
+
+    err = (tar_err.decode(errors='replace') + rx_err.decode(errors='replace')).strip()
+    ok = tar.returncode==0 and rx.returncode==0
+    return ok,err
+
+def archive_checksums(server,filenames,nstreams=max_streams,chunk=200):
+    '''
+    compute the MD5 checksums of files on the archive with md5sum, in nstreams ssh sessions at the same time
+    return a dictionary of filename -> checksum.  A file which can't be read is not in the dictionary
+    '''
+    chunks = [filenames[idx:idx+chunk] for idx in range(0,len(filenames),chunk)]
+
+    def md5sum(names):
+        cmd = 'md5sum %s' % ' '.join([shlex.quote(name) for name in names])
+        proc = subprocess.run(archive_argv(server,cmd),capture_output=True)
+        return proc.stdout.decode(errors='replace')
+
+    retval = {}
+    if len(chunks)==0: return retval
+    with ThreadPoolExecutor(max_workers=min(nstreams,len(chunks))) as executor:
+        for out in executor.map(md5sum,chunks):
+            for line in out.split('\n'):
+                cols = line.split('  ',1)
+                if len(cols)<2: continue
+                retval[cols[1]] = cols[0]
+    return retval
+
+def verify_archive(server,manifest,nfiles=nverify,nstreams=max_streams):
+    '''
+    compare the checksums of files on the archive with the manifest, starting with the files not verified for the longest time
+    a file with the wrong checksum is removed from the manifest so that it is copied again
+    a file without a checksum from the archive (e.g. the ssh session failed) is left for next time
+    return the number of files verified, and the list of bad files
+    '''
+    entries = manifest.to_verify(server,nfiles)
+    if len(entries)==0: return 0,[]
+
+    # files recorded from a listing of the archive don't have a checksum yet
+    missing = [source for relname,checksum,source,destination in entries if checksum is None]
+    local_checksums = file_checksums(missing)
+    new_checksums = {}
+    for relname,checksum,source,destination in entries:
+        if checksum is None and local_checksums[source] is not None:
+            new_checksums[relname] = local_checksums[source]
+    manifest.set_checksums(server,new_checksums)
+
+    remote = archive_checksums(server,[destination for relname,checksum,source,destination in entries],nstreams)
+    verified = []
+    bad = []
+    gone = []
+    unverified = 0
+    for relname,checksum,source,destination in entries:
+        if checksum is None: checksum = new_checksums.get(relname)
+        if checksum is None:
+            # the source is gone, there's nothing to compare.  It is marked as verified so it goes to the end of the queue
+            gone.append(relname)
+            continue
+        if destination not in remote.keys():
+            unverified += 1
+            continue
+        if remote[destination]==checksum:
+            verified.append(relname)
+        else:
+            print('ERROR! Bad copy on %s: %s' % (server,destination))
+            bad.append(relname)
+    if unverified>0:
+        print('WARNING! No checksum from %s for %i files.  They will be verified next time' % (server,unverified))
+    manifest.set_verified(server,verified+gone)
+    manifest.forget(server,bad)
+    return len(verified),bad
+
+def print_sync_stats(stats):
+    '''
+    print the statistics of a copy2archive run
+    '''
+    if stats['archive listed']:
+        print('source files: %i, archive files: %i, listed in %.1f seconds'
+              % (stats['source files'],stats['archive files'],stats['listing time']))
+    else:
+        print('new source files: %i, files in the manifest: %i, listed in %.1f seconds'
+              % (stats['source files'],stats['archive files'],stats['listing time']))
+    print('files to copy: %i (%.1f MB) in %i sessions'
+          % (stats['files to copy'],stats['bytes to copy']/1024**2,stats['batches']))
+    if stats['files verified']>0 or stats['bad copies']>0:
+        print('files verified: %i, bad copies: %i' % (stats['files verified'],stats['bad copies']))
+    if stats['batches']==0: return
+    print('files copied: %i (%.1f MB) in %.1f seconds: %.2f MB/s'
+          % (stats['files copied'],stats['bytes copied']/1024**2,stats['transfer time'],stats['throughput']/1024**2))
+    if stats['batches failed']>0:
+        print('ERROR! %i sessions failed.  The files will be copied again next time' % stats['batches failed'])
+    return
+
+def copy2archive(server,nstreams=max_streams,dryrun=False,verbosity=1,manifest=None):
+    '''
+    copy data files to CC-IN2P3, apcjupyter, or the archive on qubic-central
+
+    The files already copied are in the transfer manifest (see transfer_manifest.py),
+    so usually only the new source files are looked at.  Once a day (check_interval), all the
+    source files and the archive are listed at the same time, and compared by size and modification time.
+    Each time, the checksums of a few files on the archive are compared with the manifest.
+
+    The new files are copied in batches, with nstreams sessions at the same time.
+    If a session fails, or the copy is interrupted, the incomplete files have the wrong size and are copied again next time.
+
+    return a dictionary of statistics, and the list of files copied
     '''
     archive_datadir = None
     if server=='cc':
@@ -127,75 +428,107 @@ def copy2archive(server):
     if server=='apcjupyter':
         archive_datadir = jup_datadir
     if server=='central':
-        return copy2central()
+        archive_datadir = central_datadir
         
     if archive_datadir is None:
-        print('Invalid archive.  Choose either "apcjupyter" or "cc"')
-        return
+        print('Invalid archive.  Choose either "apcjupyter" or "cc" or "central"')
+        return None,None
 
-    
-    # files on Qubic Studio
-    src_list, qs_filelist_relative = files_on_QubicStudio()
-    
-    # files on the calsource
-    cs_filelist, cs_filelist_relative = files_on_calsource()
-    src_list += cs_filelist
-    
-    # files on archive
-    archive_filelist, archive_filelist_relative = files_on_archive(server)
+    if manifest is None: manifest = transfer_manifest()
+
+    stats = {}
+    for key in ['source files','archive files','archive listed','files to copy','bytes to copy','batches','batches failed',
+                'files copied','bytes copied','files verified','bad copies','listing time','transfer time','throughput']:
+        stats[key] = 0
+
+    # bad copies are removed from the manifest, so they are copied again now
+    if not dryrun:
+        stats['files verified'],bad = verify_archive(server,manifest,nstreams=nstreams)
+        stats['bad copies'] = len(bad)
+
+    known = manifest.known(server)
+    full_check = time.time() - manifest.last_check(server) > check_interval
+    t0 = time.time()
+    if full_check:
+        # list the files on QubicStudio, the calsource, and the archive at the same time
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            src_future = executor.submit(source_file_info,server)
+            archive_future = executor.submit(archive_file_info,server,archive_datadir,nstreams)
+            src_info = src_future.result()
+            archive_info = archive_future.result()
+        if archive_info is None:
+            print('ERROR! Could not list the files on the archive: %s' % server)
+            return stats,[]
+    else:
+        # only the new files
+        src_info = source_file_info(server,skip=known)
+        archive_info = known
+    stats['listing time'] = time.time() - t0
+    stats['archive listed'] = full_check
+    stats['source files'] = len(src_info)
+    stats['archive files'] = len(archive_info)
+
+    if full_check and not dryrun:
+        # files removed from the archive, or changed, are copied again
+        gone = [relname for relname in known.keys() if relname not in archive_info or archive_info[relname][0]!=known[relname][0]]
+        manifest.forget(server,gone)
+        # files on the archive which are not in the manifest are added, without checksum
+        entries = []
+        for relname in src_info.keys():
+            if relname in known or relname not in archive_info: continue
+            srcdir,srcname,size,mtime = src_info[relname]
+            if archive_info[relname][0]!=size or archive_info[relname][1]<mtime: continue
+            entries.append((relname,size,mtime,None,'%s/%s' % (srcdir,srcname),'%s/%s' % (archive_datadir,relname)))
+        manifest.record(server,entries,copied=0)
+        manifest.set_check(server)
 
     # now check what is new
-    destfiles2copy = []
-    srcfiles2copy = []
-    for idx,f in enumerate(qs_filelist_relative+cs_filelist_relative):
-        if f not in archive_filelist_relative:
-            destfiles2copy.append(f)
-            srcfiles2copy.append(src_list[idx])
-
-    if not destfiles2copy:
-        return
-
-    # we need to create the destination directories before copying the file
-    for idx,f in enumerate(destfiles2copy):
-
-        dest_fullpath = '%s/%s' % (archive_datadir,f)
-        print('file destination:\n   %s' % dest_fullpath)
-        d = os.path.dirname(dest_fullpath)
-        print('directory to be made:\n   %s' % d)
-        escaped_d = d.replace(' ','\\ ')
-        cmd = 'mkdir --parents %s' % escaped_d
-        out,err = archive_command(server,cmd)
-        if err:
-            print(err)
-            return
-        if out:
-            print(out)
-
-        escaped_destination = dest_fullpath.replace(' ','\\ ')
-        src_file = srcfiles2copy[idx]
-        cmd = 'scp -p "%s" %s:"%s"' % (src_file,server,escaped_destination)
-        #print('copy command:\n   %s' % cmd)
-        out,err = shellcommand(cmd)
-        if err:
-            print(err)
-            return
-        if out:
-            print(out)
-    return
+    files2copy = files_to_sync(src_info,archive_info)
+    batches = make_batches(src_info,files2copy,archive_datadir)
+    stats['files to copy'] = len(files2copy)
+    stats['bytes to copy'] = sum([batch[3] for batch in batches])
+    stats['batches'] = len(batches)
+    if verbosity>1:
+        for srcdir,destdir,names,nbytes,relnames in batches:
+            print('%s -> %s:%s: %i files, %.1f MB' % (srcdir,server,destdir,len(names),nbytes/1024**2))
+    if dryrun or len(batches)==0:
+        if verbosity>0: print_sync_stats(stats)
+        return stats,[]
+
+    copied = []
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=nstreams) as executor:
+        results = executor.map(lambda batch: transfer_batch(server,batch[0],batch[1],batch[2]),batches)
+        for batch,(ok,err) in zip(batches,results):
+            srcdir,destdir,names,nbytes,relnames = batch
+            if err: print(err)
+            if not ok:
+                stats['batches failed'] += 1
+                continue
+            stats['files copied'] += len(names)
+            stats['bytes copied'] += nbytes
+            for name in names:
+                copied.append('%s/%s' % (destdir,name))
+
+            # the checksums are calculated from the source files
+            sources = ['%s/%s' % (srcdir,name) for name in names]
+            checksums = file_checksums(sources)
+            entries = []
+            for name,relname,source in zip(names,relnames,sources):
+                size,mtime = src_info[relname][2:]
+                entries.append((relname,size,mtime,checksums[source],source,'%s/%s' % (destdir,name)))
+            manifest.record(server,entries)
+    stats['transfer time'] = time.time() - t0
+    if stats['transfer time']>0: stats['throughput'] = stats['bytes copied']/stats['transfer time']
+
+    if verbosity>0: print_sync_stats(stats)
+    return stats,copied
 
 def copy2central():
     '''
     copy files to qubic-central archive
     '''
-
-    # QubicStudio fits files
-    cmd = 'cd "%s";find . -type f -name "*.fits" -exec cp -puv --parents {} %s \;' % (qs_datadir,central_datadir)
-    shellcommand(cmd)
-
-    # calsource dat and fits files
-    cmd = 'cd %s;find . -type f \( -name "*.fits" -o -name "*.dat" \) -exec cp -puv --parents {} %s/calsource \;' % (cs_datadir,central_datadir)
-    shellcommand(cmd)
-    return
+    return copy2archive('central')
 
 def copy2cc():
     '''
@@ -278,24 +611,188 @@ def read_calsource_dat(filename):
     
     return  t,v
 
-def calsource2fits(filename):
-    
-    starttime = dt.datetime.utcnow()
-    sys.stdout.write('%s ... ' % filename)
-    sys.stdout.flush()
-    t,v = read_calsource_dat(filename)
-    if t is None: return
-    endtime = dt.datetime.utcnow()
-    delta = (endtime-starttime).total_seconds()
-    sys.stdout.write(' read file in %.1f seconds' % delta)
-    sys.stdout.flush()
-    
-    starttime = dt.datetime.utcnow()
-    fitsname = write_calsource_fits(t,v)
-    if fitsname is None: return
-    endtime = dt.datetime.utcnow()
-    delta = (endtime-starttime).total_seconds()
-    sys.stdout.write(' saved file in %.1f seconds\n' % delta)
-    sys.stdout.flush()
+def parse_calsource_chunk(dat):
+    '''
+    parse complete lines of a calsource dat file:  timestamp amplitude
+    all the lines are given to loadtxt at once.  If there is a bad line, the lines are parsed one by one
+    return the timestamps and the amplitudes
+    '''
+    try:
+        arr = np.loadtxt(io.BytesIO(dat),ndmin=2)
+        if arr.shape[1]==2: return arr[:,0],arr[:,1]
+    except ValueError:
+        pass
+
+    t = []
+    v = []
+    for line in dat.split(b'\n'):
+        cols = line.split()
+        if len(cols)!=2: continue
+        try:
+            tstamp = float(cols[0])
+            val = float(cols[1])
+        except:
+            continue
+        t.append(tstamp)
+        v.append(val)
+    return np.array(t),np.array(v)
+
+def calsource_fits_headers(startTime,nrows):
+    '''
+    the primary header and the binary table header of a calsource FITS file, as written by write_calsource_fits()
+    '''
+    prihdr=fits.Header()
+    prihdr['INSTRUME'] = 'QUBIC'
+    prihdr['EXTNAME']  = 'CALSOURCE'
+    prihdr['DATE-OBS'] = startTime.strftime('%Y-%m-%d %H:%M:%S UT')
+    prihdu = fits.PrimaryHDU(header=prihdr)
+
+    cols = [fits.Column(name='timestamp',format='D'),fits.Column(name='amplitude',format='I')]
+    hdu1 = fits.BinTableHDU.from_columns(cols,nrows=0)
+    hdu1.header['NAXIS2'] = nrows
+    hdu1.header['INSTRUME'] = 'QUBIC'
+    hdu1.header['EXTNAME'] = 'CALSOURCE'
+    hdu1.header['DATE-OBS'] = startTime.strftime('%Y-%m-%d %H:%M:%S UT')
+    return prihdu.header,hdu1.header
+
+def convert_calsource(filename,outfile=None,chunk_size=calsource_chunk_size,verbosity=1):
+    '''
+    convert a calsource dat file to FITS without reading the whole file into memory
+
+    The dat file is parsed in chunks, and the rows are written to the FITS binary table as they are parsed.
+    The number of rows is written in the table header at the end.
+    The FITS file is written with a temporary name, and renamed when it is complete.
+
+    return the name of the FITS file (or None if there is no data), and a dictionary with
+    the number of rows, the number of bytes read, and the time
+    '''
+    info = {'filename':filename,'rows':0,'bytes':0,'seconds':0}
+    if not os.path.isfile(filename):
+        print('file not found: %s' % filename)
+        return None,info
+
+    t0 = time.time()
+    fsize = os.path.getsize(filename)
+    h = open(filename,'rb')
+    out = None
+    partial = b''
+    nrows = 0
+    while True:
+        dat = h.read(chunk_size)
+        if not dat:
+            # the last line might be incomplete if the acquisition was interrupted
+            dat = partial
+            partial = b''
+            if not dat.strip(): break
+            chunk = dat
+        else:
+            dat = partial + dat
+            end = dat.rfind(b'\n')
+            if end<0:
+                partial = dat
+                continue
+            chunk = dat[:end]
+            partial = dat[end+1:]
+
+        t,v = parse_calsource_chunk(chunk)
+        if len(t)==0: continue
+
+        if out is None:
+            startTime = dt.datetime.utcfromtimestamp(t[0])
+            if outfile is None: outfile = startTime.strftime('calsource_%Y%m%dT%H%M%S.fits')
+            if os.path.isfile(outfile) and verbosity>0:
+                print('file exists!  will overwrite: %s' % outfile)
+            tmpname = '%s.part' % outfile
+            out = open(tmpname,'wb')
+            prihdr,tblhdr = calsource_fits_headers(startTime,0)
+            out.write(prihdr.tostring().encode())
+            tblhdr_offset = out.tell()
+            out.write(tblhdr.tostring().encode())
+
+        rows = np.empty(len(t),dtype=calsource_dtype)
+        rows['timestamp'] = t
+        rows['amplitude'] = v
+        out.write(rows.tobytes())
+        nrows += len(rows)
+
+        if verbosity>1:
+            sys.stdout.write('\r%s: %3.0f%% %i rows' % (filename,100*h.tell()/max(fsize,1),nrows))
+            sys.stdout.flush()
+    h.close()
 
+    info['rows'] = nrows
+    info['bytes'] = fsize
+    info['seconds'] = time.time() - t0
+    if out is None:
+        print('\nunable to read data from file: %s' % filename)
+        return None,info
+
+    # pad the data to a multiple of 2880 bytes, and write the final number of rows in the table header
+    datasize = nrows*calsource_dtype.itemsize
+    if datasize % 2880: out.write(bytes(2880 - datasize % 2880))
+    prihdr,tblhdr = calsource_fits_headers(startTime,nrows)
+    out.seek(tblhdr_offset)
+    out.write(tblhdr.tostring().encode())
+    out.close()
+    os.replace(tmpname,outfile)
+    info['seconds'] = time.time() - t0
+
+    if verbosity>0:
+        if verbosity>1: sys.stdout.write('\n')
+        print_conversion(info,outfile)
+    return outfile,info
+
+def print_conversion(info,fitsname):
+    '''
+    print the result of a calsource conversion
+    '''
+    rate = 0
+    if info['seconds']>0: rate = info['bytes']/info['seconds']/1024**2
+    print('%s -> %s: %i rows, %.1f MB in %.1f seconds (%.1f MB/s)'
+          % (info['filename'],fitsname,info['rows'],info['bytes']/1024**2,info['seconds'],rate))
     return
+
+def calsource2fits(filename,verbosity=1):
+    '''
+    convert a calsource dat file to FITS
+    '''
+    fitsname,info = convert_calsource(filename,verbosity=verbosity)
+    return fitsname
+
+def calsource2fits_files(filenames,nprocs=None,verbosity=1):
+    '''
+    convert calsource dat files to FITS, with nprocs files at the same time (default: the number of CPUs)
+    return a dictionary of dat filename -> FITS filename
+    '''
+    retval = {}
+    if len(filenames)==0: return retval
+    if nprocs is None: nprocs = os.cpu_count()
+    nprocs = max(1,min(nprocs,len(filenames)))
+
+    t0 = time.time()
+    nbytes = 0
+    nrows = 0
+    with ProcessPoolExecutor(max_workers=nprocs) as executor:
+        futures = {}
+        for F in filenames:
+            futures[executor.submit(convert_calsource,F,None,calsource_chunk_size,0)] = F
+        for idx,future in enumerate(as_completed(futures)):
+            F = futures[future]
+            try:
+                fitsname,info = future.result()
+            except Exception as err:
+                print('ERROR! Could not convert %s: %s' % (F,err))
+                retval[F] = None
+                continue
+            retval[F] = fitsname
+            nbytes += info['bytes']
+            nrows += info['rows']
+            if verbosity>0:
+                sys.stdout.write('[%i/%i] ' % (idx+1,len(filenames)))
+                print_conversion(info,fitsname)
+
+    delta = time.time() - t0
+    if verbosity>0 and delta>0:
+        print('converted %i files: %i rows, %.1f MB in %.1f seconds (%.1f MB/s)'
+              % (len(filenames),nrows,nbytes/1024**2,delta,nbytes/delta/1024**2))
+    return retval
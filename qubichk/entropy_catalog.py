@@ -0,0 +1,297 @@
+'''
+$Id: entropy_catalog.py
+$auth: Steve Torchinsky <satorchi@apc.in2p3.fr>
+$created: Mon 19 Oct 2026 23:02:17 CEST
+$license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
+
+          This is free software: you are free to change and
+          redistribute it.  There is NO WARRANTY, to the extent
+          permitted by law.
+
+catalog of the temperature log files written by Entropy (the AVS47 controllers)
+
+Entropy writes a new directory for each log session in /entropy/logs, shared by Samba,
+with one file per channel, for example:
+  2026-10-19 101520 AVS47 AVS47_1 Ch 2 300mK-4HS.log
+
+The catalog finds the most recent session directory and the channel of each file.
+The log directory is polled (inotify does not work on a Samba mount), at most every poll_interval seconds.
+
+The data of each log file is kept in memory.  When the file is read again, only the lines appended
+since the last read are parsed.
+'''
+import os,re,time,threading
+import numpy as np
+
+entropy_dir = '/entropy/logs'
+channel_pattern = re.compile('.* AVS47 (AVS47[-_][12]) Ch ([0-7]) ?(.*)')
+
+
+def parse_entropy_filename(filename):
+    '''
+    return the controller, channel, and label from the name of an Entropy log file
+    controller and channel are None if it is not an AVS47 channel
+    '''
+    basename = re.sub('\.log$','',os.path.basename(filename))
+    match = channel_pattern.match(basename)
+    if match is None: return None,None,basename
+    avs = match.group(1).replace('-','_')
+    controller = int(avs[-1])
+    channel = int(match.group(2))
+    label = match.group(3)
+    if label=='': label = '%s ch%i' % (avs,channel)
+    return controller,channel,label
+
+
+class entropy_logfile:
+    '''
+    the data from an Entropy log file, updated with the lines appended since the last read
+
+    Arguments:
+
+    filename: the full path to the log file
+    '''
+
+    def __init__(self,filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.reset()
+        return None
+
+    def reset(self):
+        '''
+        forget everything read so far
+        '''
+        self.offset = 0
+        self.partial = b''
+        self.tstart = -1
+        self.npts = 0
+        self.t = np.zeros(1024)
+        self.v = np.zeros(1024)
+        self.ncols_last = 0
+        return
+
+    def append(self,t,v):
+        '''
+        add the new values, with room to grow so that the arrays are not copied every time
+        '''
+        n = len(t)
+        if n==0: return
+        if self.npts + n > len(self.t):
+            size = max(2*len(self.t),self.npts + n)
+            self.t = np.resize(self.t,size)
+            self.v = np.resize(self.v,size)
+        self.t[self.npts:self.npts+n] = t
+        self.v[self.npts:self.npts+n] = v
+        self.npts += n
+        return
+
+    def update(self):
+        '''
+        read the lines appended to the file since the last read
+        return True if there is new data
+        '''
+        try:
+            fsize = os.path.getsize(self.filename)
+        except:
+            return False
+        if fsize<self.offset:
+            # the file was replaced
+            self.reset()
+        if fsize==self.offset: return False
+
+        h = open(self.filename,'rb')
+        h.seek(self.offset)
+        dat = h.read(fsize - self.offset)
+        h.close()
+        self.offset += len(dat)
+
+        # keep the last line for next time if it is not complete
+        dat = self.partial + dat
+        end = dat.rfind(b'\n')
+        self.partial = dat[end+1:]
+        if end<0: return False
+        lines = dat[:end].decode('iso-8859-1').split('\n')
+
+        t = []
+        val = []
+        for line in lines:
+            if line.find('#')!=0:
+                cols = line.split()
+                try:
+                    tt = float(cols[0])*1e-3
+                    yy = float(cols[1])
+                except:
+                    continue
+                t.append(tt)
+                val.append(yy)
+                self.ncols_last = len(cols)
+            elif line.find('#Log session timestamp:')==0:
+                # get start time from header
+                tstart_str = line.replace('#Log session timestamp:','')
+                try:
+                    self.tstart = float(tstart_str)*1e-3
+                except:
+                    self.tstart = -1
+
+        self.append(t,val)
+        return len(t)>0
+
+    def read(self):
+        '''
+        return the timestamps, the values, and the session start time
+        if the session start time is not known, the times are relative to the start of the session
+        '''
+        with self.lock:
+            self.update()
+            t = self.t[:self.npts].copy()
+            v = self.v[:self.npts].copy()
+            tstart = self.tstart
+        if tstart>0: t += tstart
+        return t,v,tstart
+
+    def latest(self):
+        '''
+        return the timestamp, value, and number of columns of the most recent measurement
+        return None if there is no data
+        '''
+        with self.lock:
+            self.update()
+            if self.npts==0: return None
+            tstamp = self.t[self.npts-1]
+            if self.tstart>0: tstamp += self.tstart
+            return tstamp,self.v[self.npts-1],self.ncols_last
+
+
+class entropy_catalog:
+    '''
+    catalog of the log files in the most recent Entropy log session
+
+    Arguments:
+
+    topdir: the Entropy log directory
+    poll_interval: the minimum time in seconds between checks for a new log session
+    '''
+
+    def __init__(self,topdir=None,poll_interval=10):
+        if topdir is None: topdir = entropy_dir
+        self.topdir = topdir
+        self.poll_interval = poll_interval
+        self.lock = threading.RLock()
+        self.last_poll = 0
+        self.tempdir = None
+        self.tempdir_mtime = None
+        self.entries = []
+        self.logfiles = {}
+        return None
+
+    def poll(self,force=False):
+        '''
+        find the most recent log session directory, and scan it if it has changed
+        '''
+        with self.lock:
+            now = time.time()
+            if not force and now - self.last_poll < self.poll_interval: return
+            self.last_poll = now
+
+            if not os.path.exists(self.topdir):
+                self.tempdir = None
+                self.tempdir_mtime = None
+                self.entries = []
+                self.logfiles = {}
+                return
+
+            latest = None
+            latest_mtime = None
+            for r,d,f in os.walk(self.topdir):
+                if r==self.topdir: continue
+                try:
+                    mtime = os.path.getmtime(r)
+                except:
+                    continue
+                if latest_mtime is None or mtime>=latest_mtime:
+                    latest = r
+                    latest_mtime = mtime
+
+            if latest==self.tempdir and latest_mtime==self.tempdir_mtime: return
+            if latest!=self.tempdir: self.logfiles = {}
+            self.tempdir = latest
+            self.tempdir_mtime = latest_mtime
+            self.scan()
+        return
+
+    def scan(self):
+        '''
+        make the list of files in the log session directory
+        '''
+        self.entries = []
+        if self.tempdir is None: return
+        for basename in sorted(os.listdir(self.tempdir)):
+            filename = '%s%s%s' % (self.tempdir,os.sep,basename)
+            if not os.path.isfile(filename): continue
+            controller,channel,label = parse_entropy_filename(filename)
+            entry = {}
+            entry['filename'] = filename
+            entry['controller'] = controller
+            entry['channel'] = channel
+            entry['label'] = label
+            self.entries.append(entry)
+        return
+
+    def latest_dir(self):
+        '''
+        the directory of the most recent log session, or None if the Entropy logs are not available
+        '''
+        self.poll()
+        return self.tempdir
+
+    def files(self):
+        '''
+        the list of log files with their controller, channel, and label
+        '''
+        self.poll()
+        with self.lock:
+            return list(self.entries)
+
+    def find(self,controller=None,channel=None):
+        '''
+        find the log file for a channel.  If controller is None, use the first controller with this channel
+        '''
+        for entry in self.files():
+            if entry['channel'] is None: continue
+            if controller is not None and entry['controller']!=controller: continue
+            if channel is not None and entry['channel']!=channel: continue
+            return entry
+        return None
+
+    def logfile(self,filename):
+        '''
+        the entropy_logfile object for the file, which keeps the data already read
+        '''
+        with self.lock:
+            if filename not in self.logfiles:
+                self.logfiles[filename] = entropy_logfile(filename)
+            return self.logfiles[filename]
+
+    def read(self,filename):
+        '''
+        return the timestamps, the values, and the session start time from a log file
+        '''
+        if filename is None or not os.path.isfile(filename):
+            print('file not found: %s' % filename)
+            return None,None,None
+        return self.logfile(filename).read()
+
+    def session_start(self,filename):
+        '''
+        the log session start time of a file
+        '''
+        t,v,tstart = self.read(filename)
+        return tstart
+
+    def latest(self,filename):
+        '''
+        the most recent measurement in a log file (see entropy_logfile.latest)
+        '''
+        if filename is None or not os.path.isfile(filename): return None
+        return self.logfile(filename).latest()
@@ -0,0 +1,407 @@
+'''
+$Id: hk_alarms.py
+$auth: Steve Torchinsky <satorchi@apc.in2p3.fr>
+$created: Tue 20 Oct 2026 08:41:36 CEST
+$license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
+
+          This is free software: you are free to change and
+          redistribute it.  There is NO WARRANTY, to the extent
+          permitted by law.
+
+alarms evaluated on the live housekeeping broadcast
+
+Each housekeeping record received from hk_broadcast is checked against a list of rules.
+The alarm is sent by Telegram to the alarm recipients as soon as the record is received.
+
+The rules are read from the file hk_alarms.conf (see utilities.get_fullpath) with one rule per line:
+
+  <channel> above <limit> [clear=<value>]
+  <channel> below <limit> [clear=<value>]
+  <channel> rate <limit per minute> [samples=<N>] [clear=<value>]
+  <channel> stale <seconds>
+
+<channel> is the name in the HK record, for example AVS47_1_ch2, TEMPERATURE01, PRESSURE1, HEATER1_Amp
+The clear value gives the hysteresis: the alarm is cleared when the value is back past the clear value.
+The default clear value is the limit.
+"rate" is the slope of a straight line fit over the last N samples.
+"stale" is when the value has not changed for the given time.
+
+The samples with no data are not used: -1 (written by hk_broadcast when a sensor does not answer),
+the dummy values of the initial record, and zero or less for temperatures and pressures.
+
+An alarm is sent once when it is raised, and once when it is cleared.
+If it is still active, a reminder is sent every reminder_interval seconds.
+'''
+import os,time,threading,queue
+import numpy as np
+from satorchipy.datefunctions import utcnow, utcfromtimestamp
+from qubichw.pid_control import sliding_regression
+from qubichk.utilities import get_fullpath
+from qubichk.send_telegram import send_telegram, get_alarm_recipients
+
+# used if there is no configuration file
+default_rules = ['PRESSURE1 above 1e-4 clear=5e-5',
+                 'AVS47_1_ch2 above 0.5 clear=0.45',
+                 'AVS47_1_ch2 stale 600']
+
+# hk_broadcast puts -1 in the record when there is no data for a channel
+no_data_value = -1
+# temperatures and pressures can only be positive, so zero or less is no data
+positive_channels = ['TEMPERATURE','AVS47','PRESSURE']
+
+
+class alarm_rule:
+    '''
+    one rule for one channel
+
+    Arguments:
+
+    channel: the name of the channel in the HK record
+    kind: 'above', 'below', 'rate', or 'stale'
+    limit: the alarm threshold (units per minute for rate, seconds for stale)
+    clear: the value where the alarm is cleared (hysteresis)
+    samples: the number of samples for the rate
+    '''
+
+    def __init__(self,channel,kind,limit,clear=None,samples=30):
+        self.channel = channel
+        self.kind = kind
+        self.limit = limit
+        if clear is None: clear = limit
+        self.clear = clear
+        self.active = False
+        self.raised = None
+        self.last_notified = None
+        self.regression = None
+        if kind=='rate': self.regression = sliding_regression(samples)
+        self.last_value = None
+        self.last_change = None
+        return None
+
+    def __str__(self):
+        '''
+        the rule as it is written in the configuration file
+        '''
+        if self.kind=='stale':
+            return '%s stale %g' % (self.channel,self.limit)
+        line = '%s %s %g' % (self.channel,self.kind,self.limit)
+        if self.clear!=self.limit: line += ' clear=%g' % self.clear
+        if self.kind=='rate': line += ' samples=%i' % self.regression.npts
+        return line
+
+    def measure(self,tstamp,val):
+        '''
+        return the quantity compared to the limit, or None if it is not available yet
+        '''
+        if self.kind=='rate':
+            self.regression.add(tstamp,val)
+            if not self.regression.is_full(): return None
+            slope = self.regression.slope()
+            if slope is None: return None
+            return 60*slope
+
+        if self.kind=='stale':
+            if self.last_value is None or val!=self.last_value:
+                self.last_value = val
+                self.last_change = tstamp
+            return tstamp - self.last_change
+
+        return val
+
+    def update(self,tstamp,val):
+        '''
+        evaluate the rule with a new sample
+        return 'raised', 'cleared', or None, and the measured quantity
+        '''
+        measured = self.measure(tstamp,val)
+        if measured is None: return None,None
+
+        if self.kind=='below':
+            raise_it = measured < self.limit
+            clear_it = measured > self.clear
+        elif self.kind=='rate':
+            raise_it = abs(measured) > self.limit
+            clear_it = abs(measured) < self.clear
+        elif self.kind=='stale':
+            raise_it = measured > self.limit
+            clear_it = measured==0
+        else:
+            raise_it = measured > self.limit
+            clear_it = measured < self.clear
+
+        if not self.active and raise_it:
+            self.active = True
+            self.raised = tstamp
+            return 'raised',measured
+        if self.active and clear_it:
+            self.active = False
+            return 'cleared',measured
+        return None,measured
+
+    def describe(self,measured):
+        '''
+        a message describing the alarm
+        '''
+        if self.kind=='rate':
+            return '%s changing at %.4g per minute (limit %.4g)' % (self.channel,measured,self.limit)
+        if self.kind=='stale':
+            return '%s has not changed for %.0f seconds' % (self.channel,measured)
+        return '%s = %.4g (%s %.4g)' % (self.channel,measured,self.kind,self.limit)
+
+
+def parse_rule(line):
+    '''
+    read a rule from a line of the configuration file
+    return None if the line is not a rule
+    '''
+    line = line.split('#')[0].strip()
+    cols = line.split()
+    if len(cols)<3: return None
+    channel = cols[0]
+    kind = cols[1].lower()
+    if kind not in ['above','below','rate','stale']:
+        print('ERROR! Unknown alarm rule: %s' % line)
+        return None
+    try:
+        limit = float(cols[2])
+        options = {}
+        for col in cols[3:]:
+            key,val = col.split('=')
+            options[key.lower()] = val
+        clear = None
+        if 'clear' in options.keys(): clear = float(options['clear'])
+        samples = 30
+        if 'samples' in options.keys(): samples = int(options['samples'])
+    except:
+        print('ERROR! Could not read alarm rule: %s' % line)
+        return None
+    return alarm_rule(channel,kind,limit,clear=clear,samples=samples)
+
+def read_alarm_rules(filename=None):
+    '''
+    read the alarm rules from the configuration file
+    '''
+    if filename is None: filename = get_fullpath('hk_alarms.conf')
+    if filename is None or not os.path.isfile(filename):
+        lines = default_rules
+    else:
+        h = open(filename,'r')
+        lines = h.read().split('\n')
+        h.close()
+
+    rules = []
+    for line in lines:
+        rule = parse_rule(line)
+        if rule is not None: rules.append(rule)
+    return rules
+
+
+class hk_alarms:
+    '''
+    evaluate the alarm rules on each housekeeping record and send the alarms by Telegram
+
+    Arguments:
+
+    rules: list of alarm_rule.  The default is to read them from hk_alarms.conf
+    record_zero: the initial HK record with the dummy values (see hk_broadcast.define_hk_record)
+    stream_timeout: time in seconds without housekeeping data before sending an alarm
+    reminder_interval: time in seconds between reminders for an alarm which is still active
+    verbosity: level of verboseness for printing to screen
+    '''
+
+    def __init__(self,rules=None,record_zero=None,stream_timeout=60,reminder_interval=3600,verbosity=1):
+        if rules is None: rules = read_alarm_rules()
+        self.rules = {}
+        for rule in rules:
+            if rule.channel not in self.rules.keys(): self.rules[rule.channel] = []
+            self.rules[rule.channel].append(rule)
+        self.stream_timeout = stream_timeout
+        self.reminder_interval = reminder_interval
+        self.verbosity_threshold = verbosity
+        self.last_record = None
+        self.stream_alarm = False
+        self.dummy_values = None
+        self.channel_index = None
+        if record_zero is not None: self.set_record_format(record_zero)
+
+        # messages are sent by a separate thread so the receiver is never blocked by Telegram
+        self.outbox = queue.Queue()
+        self.sender = threading.Thread(target=self.send_loop,name='hk_alarms_sender',daemon=True)
+        self.sender.start()
+
+        # the receiver blocks while waiting for data, so the stream is checked by another thread
+        self.watchdog = threading.Thread(target=self.watchdog_loop,name='hk_alarms_watchdog',daemon=True)
+        self.watchdog.start()
+        return None
+
+    def log(self,msg,verbosity=0):
+        '''
+        print a statement if we are sufficiently verbose, and write it to the log file
+        '''
+        fullmsg = '%s|hk_alarms|%s' % (utcnow().strftime('%Y-%m-%d %H:%M:%S'),msg)
+        try:
+            h = open('hk_alarms.log','a')
+            h.write(fullmsg+'\n')
+            h.close()
+        except:
+            pass
+        if verbosity>self.verbosity_threshold: return
+        print(fullmsg)
+        return
+
+    def set_record_format(self,record_zero=None):
+        '''
+        the initial record has a dummy value for each channel, meaning "no data"
+        '''
+        if record_zero is None:
+            from qubichk.hk_broadcast import hk_broadcast
+            record_zero = hk_broadcast(verbosity=0).define_hk_record()
+        names = record_zero.dtype.names
+        self.dummy_values = {}
+        self.channel_index = []
+        for channel in self.rules.keys():
+            if channel not in names:
+                self.log('WARNING! Alarm rule for unknown channel: %s' % channel)
+                continue
+            self.channel_index.append(channel)
+            self.dummy_values[channel] = float(record_zero[channel][0])
+        return
+
+    def is_data(self,channel,val):
+        '''
+        check if the value is a measurement, and not one of the values meaning "no data":
+        the dummy values of the initial record, -1 (see hk_broadcast), and zero or less for temperatures and pressures
+        '''
+        if not np.isfinite(val): return False
+        if val==no_data_value: return False
+        if self.dummy_values is not None and channel in self.dummy_values.keys() and val==self.dummy_values[channel]:
+            return False
+        for prefix in positive_channels:
+            if channel.startswith(prefix) and val<=0: return False
+        return True
+
+    def process(self,record):
+        '''
+        evaluate the rules on a new record
+        only the channels with rules are looked at, and each rule is O(1)
+        '''
+        if self.channel_index is None: self.set_record_format()
+        # DATE is in seconds (see hk_broadcast.current_timestamp)
+        tstamp = float(record['DATE'][0])
+        self.last_record = time.time()
+        if self.stream_alarm:
+            self.stream_alarm = False
+            self.notify('CLEARED: housekeeping data is being received again')
+
+        messages = []
+        for channel in self.channel_index:
+            val = float(record[channel][0])
+            if not self.is_data(channel,val): continue
+            messages += self.evaluate(channel,tstamp,val)
+        if messages: self.notify('\n'.join(messages))
+        return messages
+
+    def evaluate(self,channel,tstamp,val):
+        '''
+        evaluate the rules of one channel with a new sample (tstamp in seconds)
+        return the list of messages
+        '''
+        messages = []
+        for rule in self.rules[channel]:
+            status,measured = rule.update(tstamp,val)
+            if status=='raised':
+                rule.last_notified = tstamp
+                messages.append('ALARM! %s' % rule.describe(measured))
+            elif status=='cleared':
+                messages.append('CLEARED: %s' % rule.describe(measured))
+            elif rule.active and tstamp - rule.last_notified > self.reminder_interval:
+                rule.last_notified = tstamp
+                messages.append('STILL ACTIVE since %s: %s'
+                                % (utcfromtimestamp(rule.raised).strftime('%Y-%m-%d %H:%M:%S'),rule.describe(measured)))
+        return messages
+
+    def replay(self,channel,tstamps,values):
+        '''
+        run the rules of a channel on recorded data, for example from the HK files, without sending anything
+        this is used to check the rules against known data
+
+        return a list of (tstamp, message)
+        '''
+        if channel not in self.rules.keys():
+            print('ERROR! No alarm rule for channel: %s' % channel)
+            return []
+        retval = []
+        for tstamp,val in zip(tstamps,values):
+            if not self.is_data(channel,val): continue
+            for msg in self.evaluate(channel,float(tstamp),float(val)):
+                retval.append((float(tstamp),msg))
+        return retval
+
+    def check_stream(self):
+        '''
+        check that we are still receiving housekeeping data
+        '''
+        if self.last_record is None or self.stream_alarm: return
+        delta = time.time() - self.last_record
+        if delta > self.stream_timeout:
+            self.stream_alarm = True
+            self.notify('ALARM! No housekeeping data received for %.0f seconds' % delta)
+        return
+
+    def watchdog_loop(self):
+        '''
+        check the stream every second
+        '''
+        while True:
+            time.sleep(1)
+            self.check_stream()
+        return
+
+    def notify(self,msg):
+        '''
+        queue a message for the alarm recipients
+        '''
+        self.log(msg)
+        self.outbox.put(msg)
+        return
+
+    def send_loop(self):
+        '''
+        send the queued messages by Telegram
+        '''
+        while True:
+            msg = self.outbox.get()
+            recipients = get_alarm_recipients()
+            if recipients is None:
+                self.log('ERROR! No alarm recipients',verbosity=1)
+                continue
+            if isinstance(recipients,int): recipients = [recipients]
+            fullmsg = 'QUBIC housekeeping\n%s' % msg
+            for chatid in recipients:
+                try:
+                    send_telegram(fullmsg,chatid=chatid)
+                except:
+                    self.log('ERROR! Could not send alarm to %s' % chatid,verbosity=1)
+        return
+
+    def listen(self,rcvbuf=None):
+        '''
+        receive the housekeeping broadcast and evaluate the alarms
+        use this if the alarms are not evaluated by the HK client (see hk_broadcast.hk_client)
+        '''
+        from qubichk.hk_broadcast import hk_broadcast
+        from qubichk.udp_receiver import udp_receiver
+        bc = hk_broadcast(verbosity=self.verbosity_threshold)
+        self.set_record_format(bc.define_hk_record())
+        # the DATE is after STX and QUBIC_ID which are 1 byte each
+        client = udp_receiver('hk_alarms',bc.LISTENER,bc.BROADCAST_PORT,bc.record.nbytes,
+                              tstamp_offset=2,
+                              rcvbuf=rcvbuf,
+                              verbosity=self.verbosity_threshold)
+        for channel in self.channel_index:
+            for rule in self.rules[channel]:
+                self.log('rule: %s' % rule,verbosity=1)
+        while True:
+            data, addr = client.recv()
+            self.process(bc.unpack_data(data))
+        return
@@ -21,6 +21,8 @@ from qubichk.entropy_hk import entropy_hk
 from qubichk.temperature_hk import temperature_hk
 from qubichk.pfeiffer import Pfeiffer
 from qubichk.utilities import shellcommand, get_known_hosts, get_myip
+from qubichk.udp_receiver import udp_receiver
+from qubichk.hk_freshness import freshness_index
 from qubichk.obsmount import obsmount
 from qubichk.usbthermometer_hk import usbthermometer_hk
 from qubichk.dome import get_dome_status
@@ -59,6 +61,7 @@ class hk_broadcast :
         self.hk_pressure = None
         self.hk_azel = None
         self.cryostat_temp = None
+        self.freshness = None
         self.verbosity_threshold = verbosity
         return None
 
@@ -432,22 +435,34 @@ class hk_broadcast :
         return self.record
 
         
-    def hk_client(self):
-        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # UDP
-        client.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        client.bind((self.LISTENER, self.BROADCAST_PORT))
+    def hk_client(self,rcvbuf=None,alarms=False):
+        '''receive the housekeeping broadcast and write to log files
+        packet loss and latency statistics are written to hk_rxstats.txt
+        if alarms is True, each record is checked against the alarm rules (see hk_alarms)
+        '''
+        alarm_engine = None
+        if alarms:
+            # imported here so the server does not need the Telegram modules
+            from qubichk.hk_alarms import hk_alarms
+            alarm_engine = hk_alarms(record_zero=self.define_hk_record(),verbosity=self.verbosity_threshold)
+            
+        # the DATE is after STX and QUBIC_ID which are 1 byte each
+        client = udp_receiver('hk',self.LISTENER,self.BROADCAST_PORT,self.record.nbytes,
+                              tstamp_offset=2,
+                              rcvbuf=rcvbuf,
+                              verbosity=self.verbosity_threshold)
         if self.LISTENER=='':
             listener = 'all'
         else:
             listener = self.LISTENER
             
         self.log('client listening on %s' % listener)
-        nbytes=self.record.nbytes
         local_counter=0
         while True:
-            data, addr = client.recvfrom(nbytes)
+            data, addr = client.recv()
             self.unpack_data(data)
             self.log_record()
+            if alarm_engine is not None: alarm_engine.process(self.record)
             timestamp_date = utcfromtimestamp(1e-3*self.record.DATE[0]).strftime('%Y-%m-%d %H:%M:%S UT')
             msg='client %08i: received timestamp: %s' % (local_counter,timestamp_date)
             self.log(msg)
@@ -543,6 +558,21 @@ class hk_broadcast :
         h=open(filename,'a')
         h.write(line)
         h.close()
+        self.update_freshness(filename,tstamp,data,data2)
+        return True
+
+    def update_freshness(self,filename,tstamp,data,data2=None):
+        '''update the index of latest values (see hk_freshness.py)
+        the index file is in the same directory as the HK files
+        '''
+        try:
+            if self.freshness is None:
+                hk_dir = os.path.dirname(os.path.abspath(filename))
+                self.freshness = freshness_index(hk_dir,writable=True)
+            self.freshness.update(os.path.basename(filename),tstamp,data,data2)
+        except:
+            self.log('ERROR! Could not update the HK freshness index',verbosity=3)
+            return False
         return True
 
     def log_record(self):
@@ -0,0 +1,236 @@
+'''
+$Id: hk_fits.py
+$auth: Steve Torchinsky <satorchi@apc.in2p3.fr>
+$created: Tue 20 Oct 2026 17:48:03 CEST
+$license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
+
+          This is free software: you are free to change and
+          redistribute it.  There is NO WARRANTY, to the extent
+          permitted by law.
+
+write and read the housekeeping FITS files made by make_hk_fits.py and merge_hk.py
+
+The file has one HDU for each housekeeping item.  The primary header has the labels (keywords HK01, HK02, ...).
+
+The writer adds one channel at a time, and the rows are written in blocks as they come,
+so only one channel is in memory.  The binary table has one row per sample with columns DATE and the label.
+The number of rows is written in the table header when the channel is finished.
+
+With compression, each channel is a lossless tile compressed image of N rows by 2 columns (DATE, value),
+with tiles of block_rows rows.  astropy does not have tile compression for binary tables.
+
+The reader gets one channel, and with a time range, only the rows in the range.
+It also reads the older files with one row of vector columns.
+'''
+import os
+import numpy as np
+from astropy.io import fits
+
+block_rows = 65536 # the number of rows written at once, and the tile size with compression
+hk_dtype = np.dtype([('DATE','>f8'),('VALUE','>f8')])
+
+
+class hk_fits_writer:
+    '''
+    write a housekeeping FITS file one channel at a time
+
+    Arguments:
+
+    filename: the FITS file
+    prihdr: the primary header.  It must already have all the keywords: only the values can be changed at the end (see close)
+    compress: use tile compression
+    block_rows: the number of rows in each block
+    '''
+
+    def __init__(self,filename,prihdr,compress=False,block_rows=block_rows):
+        self.filename = filename
+        self.compress = compress
+        self.block_rows = block_rows
+        self.nchannels = 0
+        self.prihdr = prihdr.copy()
+        prihdu = fits.PrimaryHDU(header=self.prihdr)
+        self.prihdr_string = prihdu.header.tostring()
+        h = open(filename,'wb')
+        h.write(self.prihdr_string.encode())
+        h.close()
+        return None
+
+    def write_channel(self,label,unit,blocks):
+        '''
+        add a channel
+
+        label: the name of the housekeeping item
+        unit: the unit of the values
+        blocks: an iterable of (timestamps,values) in time order.  Each block can be any size
+        return the number of rows
+        '''
+        if self.compress: return self.write_compressed_channel(label,unit,blocks)
+
+        cols = [fits.Column(name='DATE',format='D',unit='seconds'),
+                fits.Column(name=label,format='D',unit=unit)]
+        hdr = fits.BinTableHDU.from_columns(cols,nrows=0).header
+        hdr['EXTNAME'] = label
+
+        h = open(self.filename,'r+b')
+        h.seek(0,os.SEEK_END)
+        hdr_offset = h.tell()
+        h.write(hdr.tostring().encode())
+
+        nrows = 0
+        rows = np.empty(self.block_rows,dtype=hk_dtype)
+        for t,v in blocks:
+            for idx in range(0,len(t),self.block_rows):
+                n = min(self.block_rows,len(t)-idx)
+                rows['DATE'][:n] = t[idx:idx+n]
+                rows['VALUE'][:n] = v[idx:idx+n]
+                h.write(rows[:n].tobytes())
+                nrows += n
+
+        datasize = nrows*hk_dtype.itemsize
+        if datasize % 2880: h.write(bytes(2880 - datasize % 2880))
+        hdr['NAXIS2'] = nrows
+        h.seek(hdr_offset)
+        h.write(hdr.tostring().encode())
+        h.close()
+        self.nchannels += 1
+        return nrows
+
+    def write_compressed_channel(self,label,unit,blocks):
+        '''
+        add a channel as a tile compressed image
+        the compression is done on the whole channel, so the channel is put together in memory
+        '''
+        parts = [np.column_stack((np.asarray(t,dtype=float),np.asarray(v,dtype=float))) for t,v in blocks]
+        if len(parts)==0:
+            dat = np.zeros((0,2))
+        else:
+            dat = np.concatenate(parts)
+        hdr = fits.Header()
+        hdr['EXTNAME'] = label
+        hdr['HKLABEL'] = (label,'the housekeeping item')
+        hdr['BUNIT'] = (unit,'the unit of the values')
+        hdr['COL1'] = ('DATE','first column: seconds')
+        hdr['COL2'] = (label,'second column')
+        if len(dat)==0:
+            hdu = fits.ImageHDU(header=hdr)
+        else:
+            tile_rows = min(self.block_rows,len(dat))
+            hdu = fits.CompImageHDU(dat,header=hdr,compression_type='GZIP_2',
+                                    tile_shape=(tile_rows,2),quantize_level=0)
+        hdul = fits.open(self.filename,mode='append')
+        hdul.append(hdu)
+        hdul.close()
+        self.nchannels += 1
+        return len(dat)
+
+    def close(self,updates=None):
+        '''
+        finish the file.  The values of primary header keywords can be changed
+
+        updates: dictionary of keyword -> value (or (value,comment))
+        the new primary header must have the same size as the one written at the start
+        '''
+        if not updates: return True
+        for key in updates.keys():
+            self.prihdr[key] = updates[key]
+        prihdr_string = fits.PrimaryHDU(header=self.prihdr).header.tostring()
+        if len(prihdr_string)!=len(self.prihdr_string):
+            print('ERROR! Could not update the primary header of %s' % self.filename)
+            return False
+        h = open(self.filename,'r+b')
+        h.write(prihdr_string.encode())
+        h.close()
+        return True
+
+
+def hk_blocks(t,v,nrows=block_rows):
+    '''
+    cut the timestamp and value arrays into blocks for hk_fits_writer.write_channel()
+    '''
+    for idx in range(0,len(t),nrows):
+        yield t[idx:idx+nrows],v[idx:idx+nrows]
+
+def hk_fits_labels(hdul):
+    '''
+    return a dictionary of label -> HDU index from the primary header
+    '''
+    labels = {}
+    prihdr = hdul[0].header
+    for idx in range(1,len(hdul)):
+        key = 'HK%02i' % idx
+        if key in prihdr.keys(): labels[prihdr[key]] = idx
+    return labels
+
+def search_column(getter,npts,tstamp,side='left'):
+    '''
+    find the row where tstamp would be inserted, by bisection (like numpy.searchsorted)
+    getter(idx) returns the timestamp of row idx.  Only log2(npts) rows are read
+    '''
+    lo = 0
+    hi = npts
+    while lo<hi:
+        mid = (lo + hi)//2
+        tmid = getter(mid)
+        if tmid<tstamp or (side=='right' and tmid==tstamp):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def read_hk_fits_channel(filename,label,tmin=None,tmax=None):
+    '''
+    read one channel from a housekeeping FITS file, between the timestamps tmin and tmax
+    the other channels are not read
+
+    return the timestamps, the values, and the unit.  Return None,None,None if the channel is not in the file
+    '''
+    hdul = fits.open(filename,memmap=True)
+    labels = hk_fits_labels(hdul)
+    if label not in labels.keys():
+        print('channel not found: %s' % label)
+        hdul.close()
+        return None,None,None
+    hdu = hdul[labels[label]]
+
+    if isinstance(hdu,fits.CompImageHDU):
+        # tile compressed image:  only the tiles with the requested rows are decompressed
+        unit = hdu.header.get('BUNIT','')
+        npts = hdu.shape[0]
+        section = hdu.section
+        getter = lambda idx: section[idx,0]
+    elif isinstance(hdu,fits.BinTableHDU):
+        unit = hdu.columns[1].unit
+        dat = hdu.data
+        if len(dat)==1 and dat.columns[0].dim is not None:
+            # older files:  one row with all the samples.  Each column is in one piece on disk
+            t = np.asarray(dat.field(0)[0]).ravel()
+            v = np.asarray(dat.field(1)[0]).ravel()
+            getter = None
+            npts = len(t)
+        else:
+            npts = len(dat)
+            tcol = dat.field(0)
+            getter = lambda idx: tcol[idx]
+    else:
+        hdul.close()
+        return np.zeros(0),np.zeros(0),hdu.header.get('BUNIT','')
+
+    if getter is None:
+        lo = 0 if tmin is None else np.searchsorted(t,tmin,side='left')
+        hi = npts if tmax is None else np.searchsorted(t,tmax,side='right')
+        t = t[lo:hi].copy()
+        v = v[lo:hi].copy()
+        hdul.close()
+        return t,v,unit
+
+    lo = 0 if tmin is None else search_column(getter,npts,tmin)
+    hi = npts if tmax is None else search_column(getter,npts,tmax,side='right')
+    if isinstance(hdu,fits.CompImageHDU):
+        dat = np.asarray(section[lo:hi,:])
+        t = dat[:,0].copy()
+        v = dat[:,1].copy()
+    else:
+        t = np.array(tcol[lo:hi],dtype=float)
+        v = np.array(hdu.data.field(1)[lo:hi],dtype=float)
+    hdul.close()
+    return t,v,unit
@@ -0,0 +1,284 @@
+'''
+$Id: hk_freshness.py
+$auth: Steve Torchinsky <satorchi@apc.in2p3.fr>
+$created: Mon 19 Oct 2026 21:06:38 CEST
+$license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
+
+          This is free software: you are free to change and
+          redistribute it.  There is NO WARRANTY, to the extent
+          permitted by law.
+
+index of the most recent housekeeping values
+
+The HK logger (hk_broadcast.log_hk) updates a small memory-mapped table every time it writes to a file:
+for each channel, the last timestamp, value, and status.  The channel name is the basename of the HK file.
+Readers (hk_verify.check_temps, show_hk, the Telegram bot) get the latest value of a channel
+without opening and reading the end of the HK file.
+
+File layout: a 16 byte header (magic, number of slots, number of slots used) followed by the slots.
+The file has a fixed size and is never truncated, so a reader can map it while the logger is writing.
+
+If there is no index, or the channel is not in the index, use scan_hk_files()
+which reads the end of the files concurrently.
+'''
+import os,mmap,fcntl
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+default_hk_dir = '/home/qubic/data/temperature/broadcast'
+index_basename = 'hk_freshness.idx'
+index_magic = b'HKFRESH1'
+nslots_default = 512
+header_dtype = np.dtype([('magic','S8'),('nslots','<u4'),('count','<u4')])
+slot_dtype = np.dtype([('name','S40'),('tstamp','<f8'),('value','<f8'),('status','S16')])
+
+
+class freshness_index:
+    '''
+    memory-mapped table of channel name -> latest timestamp, value, and status
+
+    Arguments:
+
+    hk_dir: the directory with the HK files.  The index file is in the same directory
+    writable: open for writing.  The index file is created if necessary
+    nslots: the number of channels in a new index file
+    '''
+
+    def __init__(self,hk_dir=None,writable=False,nslots=nslots_default):
+        if hk_dir is None: hk_dir = default_hk_dir
+        self.hk_dir = os.path.abspath(hk_dir)
+        self.filename = '%s%s%s' % (self.hk_dir,os.sep,index_basename)
+        self.writable = writable
+        self.header = None
+        self.table = None
+        self.slots = {}
+        self.count = 0
+
+        if writable and not os.path.isfile(self.filename):
+            self.create(nslots)
+        if not os.path.isfile(self.filename): return None
+
+        if writable:
+            self.fd = os.open(self.filename,os.O_RDWR)
+            self.mm = mmap.mmap(self.fd,0,access=mmap.ACCESS_WRITE)
+        else:
+            self.fd = os.open(self.filename,os.O_RDONLY)
+            self.mm = mmap.mmap(self.fd,0,access=mmap.ACCESS_READ)
+
+        header = np.frombuffer(self.mm,dtype=header_dtype,count=1)
+        if header['magic'][0]!=index_magic:
+            print('ERROR! Not a HK freshness index: %s' % self.filename)
+            self.close()
+            return None
+        nslots = int(header['nslots'][0])
+        self.header = header
+        self.table = np.frombuffer(self.mm,dtype=slot_dtype,count=nslots,offset=header_dtype.itemsize)
+        self.refresh()
+        return None
+
+    def create(self,nslots):
+        '''
+        create a new index file.  It is written to a temporary file and linked, so a reader never sees a partial file
+        '''
+        header = np.zeros(1,dtype=header_dtype)
+        header['magic'] = index_magic
+        header['nslots'] = nslots
+        table = np.zeros(nslots,dtype=slot_dtype)
+        table['tstamp'] = np.nan
+        table['value'] = np.nan
+        tmpname = '%s.%i.tmp' % (self.filename,os.getpid())
+        h = open(tmpname,'wb')
+        h.write(header.tobytes())
+        h.write(table.tobytes())
+        h.close()
+        try:
+            os.link(tmpname,self.filename)
+        except FileExistsError:
+            pass # another logger created it first
+        os.remove(tmpname)
+        return
+
+    def is_open(self):
+        '''
+        check if the index file is mapped
+        '''
+        return self.table is not None
+
+    def refresh(self):
+        '''
+        update the channel name -> slot lookup if another process has added channels
+        '''
+        if not self.is_open(): return
+        count = int(self.header['count'][0])
+        if count==self.count: return
+        for idx in range(self.count,count):
+            name = self.table['name'][idx].decode()
+            self.slots[name] = idx
+        self.count = count
+        return
+
+    def slot(self,name):
+        '''
+        find the slot for the channel
+        '''
+        if name not in self.slots: self.refresh()
+        if name in self.slots: return self.slots[name]
+        return None
+
+    def add_channel(self,name):
+        '''
+        assign a new slot to the channel.  There can be more than one logger process, so the file is locked
+        '''
+        fcntl.flock(self.fd,fcntl.LOCK_EX)
+        try:
+            self.refresh()
+            if name in self.slots: return self.slots[name]
+            idx = self.count
+            if idx>=len(self.table):
+                print('ERROR! HK freshness index is full: %s' % self.filename)
+                return None
+            self.table['name'][idx] = name.encode()[:slot_dtype['name'].itemsize]
+            self.header['count'][0] = idx + 1
+            self.refresh()
+        finally:
+            fcntl.flock(self.fd,fcntl.LOCK_UN)
+        return idx
+
+    def update(self,name,tstamp,value=None,status=None):
+        '''
+        record the latest timestamp, value, and status for the channel
+        '''
+        if not self.is_open() or not self.writable: return False
+        idx = self.slot(name)
+        if idx is None: idx = self.add_channel(name)
+        if idx is None: return False
+
+        if value is None: value = np.nan
+        if status is None:
+            status = b''
+        else:
+            status = str(status).encode()[:slot_dtype['status'].itemsize]
+        self.table['value'][idx] = value
+        self.table['status'][idx] = status
+        # the timestamp is written last so the value is there when a reader sees the new timestamp
+        self.table['tstamp'][idx] = tstamp
+        return True
+
+    def read(self,name):
+        '''
+        return the latest timestamp, value, and status for the channel
+        the same as the columns read from the end of the HK file by show_hk.read_lastline()
+        return None if the channel is not in the index
+        '''
+        idx = self.slot(name)
+        if idx is None: return None
+        row = self.table[idx]
+        tstamp = float(row['tstamp'])
+        if np.isnan(tstamp): return None
+        status = row['status'].decode()
+        if status=='':
+            status = None
+        else:
+            try:
+                status = float(status)
+            except:
+                pass
+        return [tstamp,float(row['value']),status]
+
+    def read_timestamp(self,name):
+        '''
+        return the latest timestamp for the channel, or None if the channel is not in the index
+        '''
+        idx = self.slot(name)
+        if idx is None: return None
+        tstamp = float(self.table['tstamp'][idx])
+        if np.isnan(tstamp): return None
+        return tstamp
+
+    def read_all(self):
+        '''
+        return a dictionary of the latest timestamp for all the channels
+        '''
+        self.refresh()
+        retval = {}
+        if not self.is_open(): return retval
+        tstamps = self.table['tstamp'][:self.count].copy()
+        for name in self.slots.keys():
+            tstamp = tstamps[self.slots[name]]
+            if np.isnan(tstamp): continue
+            retval[name] = float(tstamp)
+        return retval
+
+    def close(self):
+        '''
+        unmap the index file
+        '''
+        self.header = None
+        self.table = None
+        self.slots = {}
+        self.count = 0
+        try:
+            self.mm.close()
+        except:
+            pass
+        try:
+            os.close(self.fd)
+        except:
+            pass
+        return
+
+def get_freshness_index(hk_dir=None):
+    '''
+    open the freshness index for reading
+    return None if there is no index
+    '''
+    try:
+        index = freshness_index(hk_dir)
+    except:
+        return None
+    if not index.is_open(): return None
+    return index
+
+def read_tail(filename,nbytes=1024):
+    '''
+    read the last line of a HK file with os.pread
+    return the timestamp and the rest of the columns, or None if it could not be read
+    '''
+    try:
+        fd = os.open(filename,os.O_RDONLY)
+    except:
+        return None
+    try:
+        fsize = os.fstat(fd).st_size
+        offset = max(0,fsize-nbytes)
+        x = os.pread(fd,fsize-offset,offset)
+    except:
+        return None
+    finally:
+        os.close(fd)
+
+    lines = x.decode(errors='replace').split('\n')
+    if len(lines)<2:
+        lastline = lines[0]
+    else:
+        lastline = lines[-2]
+    cols = lastline.split()
+    try:
+        tstamp = float(cols[0])
+    except:
+        return None
+    return [tstamp] + cols[1:]
+
+def scan_hk_files(filenames,nbytes=1024,max_workers=16):
+    '''
+    read the last line of each file concurrently
+    return a dictionary of filename -> result of read_tail()
+    '''
+    retval = {}
+    if len(filenames)==0: return retval
+    nworkers = min(max_workers,len(filenames))
+    with ThreadPoolExecutor(max_workers=nworkers) as executor:
+        results = executor.map(lambda F: read_tail(F,nbytes),filenames)
+        for F,result in zip(filenames,results):
+            retval[F] = result
+    return retval
@@ -0,0 +1,243 @@
+'''
+$Id: hk_plot.py
+$auth: Steve Torchinsky <satorchi@apc.in2p3.fr>
+$created: Mon 19 Oct 2026 22:14:51 CEST
+$license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
+
+          This is free software: you are free to change and
+          redistribute it.  There is NO WARRANTY, to the extent
+          permitted by law.
+
+plot housekeeping time series for the Telegram bot
+
+The time series are decimated to the number of pixels in the plot.
+In each pixel column we keep the minimum and the maximum, so spikes and dropouts are still seen.
+The lines are drawn with a LineCollection, and the plot is rendered to PNG directly with the Agg backend
+(no pyplot), so it can be done in a worker thread.
+
+Rendered plots are kept in a cache so that a repeated request is answered immediately.
+'''
+import io,time,threading
+from collections import OrderedDict
+import datetime as dt
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+import matplotlib.dates as mdates
+from satorchipy.datefunctions import utcfromtimestamp
+
+default_figsize = (20.48,7.68)
+default_dpi = 100
+gap_pixels = 3 # a gap in the data larger than this number of pixels is not joined by a line
+
+
+def as_timestamps(t):
+    '''
+    convert a list of dates to an array of timestamps.  An array of timestamps is returned as is
+    '''
+    if t is None: return None
+    if isinstance(t,(dt.datetime,float,int)): return as_timestamps([t])[0]
+    if len(t)>0 and isinstance(t[0],dt.datetime):
+        tstamps = []
+        for date in t:
+            if date.tzinfo is None: date = date.replace(tzinfo=dt.timezone.utc)
+            tstamps.append(date.timestamp())
+        return np.array(tstamps)
+    return np.asarray(t,dtype=float)
+
+def decimate_minmax(t,v,npixels,tmin=None,tmax=None):
+    '''
+    keep the first, last, minimum and maximum value in each pixel column
+    the result has at most 4*npixels points, in time order
+
+    t: timestamps in increasing order
+    v: values
+    npixels: the number of pixel columns
+    tmin,tmax: the time range of the plot.  The default is the range of t
+    '''
+    t = np.asarray(t,dtype=float)
+    v = np.asarray(v,dtype=float)
+    ok = np.isfinite(t) & np.isfinite(v)
+    if not ok.all():
+        t = t[ok]
+        v = v[ok]
+    if tmin is not None or tmax is not None:
+        if tmin is None: tmin = t[0]
+        if tmax is None: tmax = t[-1]
+        inrange = (t>=tmin) & (t<=tmax)
+        t = t[inrange]
+        v = v[inrange]
+    if len(t)<=4*npixels: return t,v
+
+    if tmin is None: tmin = t[0]
+    if tmax is None: tmax = t[-1]
+    if tmax<=tmin: return t[[0,-1]],v[[0,-1]]
+
+    pixel = ((t - tmin)*(npixels/(tmax - tmin))).astype(int)
+    starts = np.flatnonzero(np.concatenate(([True],pixel[1:]!=pixel[:-1])))
+    ends = np.concatenate((starts[1:],[len(t)])) - 1
+    seg = np.repeat(np.arange(len(starts)),ends - starts + 1)
+
+    vmin = np.minimum.reduceat(v,starts)
+    vmax = np.maximum.reduceat(v,starts)
+    idx_min = np.flatnonzero(v==vmin[seg])
+    idx_min = idx_min[np.unique(seg[idx_min],return_index=True)[1]]
+    idx_max = np.flatnonzero(v==vmax[seg])
+    idx_max = idx_max[np.unique(seg[idx_max],return_index=True)[1]]
+
+    keep = np.unique(np.concatenate((starts,ends,idx_min,idx_max)))
+    return t[keep],v[keep]
+
+def make_segments(x,y,gap):
+    '''
+    split the line where there is a gap in x larger than the given value
+    return the list of segments with more than one point, and the isolated points
+    '''
+    breaks = np.flatnonzero(np.diff(x)>gap) + 1
+    segments = []
+    isolated = []
+    for xs,ys in zip(np.split(x,breaks),np.split(y,breaks)):
+        if len(xs)==1:
+            isolated.append((xs[0],ys[0]))
+            continue
+        segments.append(np.column_stack((xs,ys)))
+    return segments,isolated
+
+def render_plot(series,
+                title='',
+                ylabel='',
+                xlabel='date',
+                dmin=None,
+                dmax=None,
+                ymin=None,
+                ymax=None,
+                logscale=False,
+                labelsize=20,
+                figsize=default_figsize,
+                dpi=default_dpi,
+                legend=True):
+    '''
+    plot time series and return the PNG image
+
+    series: list of (timestamps,values,label)
+    dmin,dmax: the time range.  Dates or timestamps.  The default is the range of the data
+    ymin,ymax: the y range.  The default is the range of the data
+    '''
+    series = [(as_timestamps(t),np.asarray(v,dtype=float),label) for t,v,label in series if t is not None and len(t)>0]
+    tmin = as_timestamps(dmin)
+    tmax = as_timestamps(dmax)
+    if tmin is None and len(series)>0: tmin = min([np.nanmin(t) for t,v,label in series])
+    if tmax is None and len(series)>0: tmax = max([np.nanmax(t) for t,v,label in series])
+    if tmin is not None and tmax is not None and tmax<=tmin: tmax = tmin + 1
+
+    fig = Figure(figsize=figsize,dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1,1,1)
+
+    npixels = int(figsize[0]*dpi)
+    if tmin is not None:
+        pixel_width = (tmax - tmin)/npixels
+        # matplotlib dates are days.  The offset is calculated from the first date to be independent of the matplotlib epoch
+        x0 = mdates.date2num(utcfromtimestamp(tmin))
+
+    vmin_list = []
+    vmax_list = []
+    for idx,(t,v,label) in enumerate(series):
+        color = 'C%i' % (idx % 10)
+        td,vd = decimate_minmax(t,v,npixels,tmin,tmax)
+        if len(td)==0: continue
+        vmin_list.append(vd.min())
+        vmax_list.append(vd.max())
+
+        # don't join the points across a gap, but the sampling rate could be slower than the pixel width
+        if len(t)>1:
+            sampling = np.median(np.diff(t[:1000]))
+        else:
+            sampling = 0
+        gap = max(gap_pixels*pixel_width,5*sampling)
+        x = x0 + (td - tmin)/86400
+        segments,isolated = make_segments(x,vd,gap/86400)
+        if len(segments)>0:
+            lines = LineCollection(segments,colors=color,linewidths=1.5,label=label)
+            ax.add_collection(lines)
+            label = None
+        if len(isolated)>0:
+            xi,yi = zip(*isolated)
+            ax.plot(xi,yi,ls='none',marker='D',markersize=3,color=color,label=label)
+
+    if tmin is not None:
+        ax.set_xlim(x0,x0 + (tmax - tmin)/86400)
+    if len(vmin_list)>0:
+        if ymin is None: ymin = min(vmin_list)
+        if ymax is None: ymax = max(vmax_list)
+    if ymin is not None and ymax is not None:
+        if ymax<=ymin:
+            margin = max(abs(ymin)*0.01,1e-9)
+            ymin -= margin
+            ymax += margin
+        ax.set_ylim(ymin,ymax)
+    if logscale: ax.set_yscale('log')
+
+    ax.xaxis_date()
+    ax.set_xlabel(xlabel,fontsize=labelsize)
+    ax.set_ylabel(ylabel,fontsize=labelsize)
+    ax.tick_params(labelsize=labelsize)
+    ax.grid()
+    fig.suptitle(title,fontsize=labelsize)
+    if legend and len(series)>0: ax.legend(fontsize=labelsize)
+
+    img = io.BytesIO()
+    fig.savefig(img,format='png',dpi=dpi,bbox_inches='tight')
+    return img.getvalue()
+
+
+class figure_cache:
+    '''
+    cache of the most recently rendered plots
+
+    A plot with a time range in the past does not change, and stays in the cache until it is pushed out by newer plots.
+    A plot which goes up to now expires after max_age seconds since there is new data.
+
+    Arguments:
+
+    maxsize: the number of plots to keep
+    max_age: the time in seconds to keep a plot which goes up to now
+    '''
+
+    def __init__(self,maxsize=16,max_age=60):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self.plots = OrderedDict()
+        self.lock = threading.Lock()
+        return None
+
+    def get(self,key):
+        '''
+        return the PNG image, or None if it is not in the cache
+        '''
+        with self.lock:
+            if key not in self.plots: return None
+            png,expires = self.plots[key]
+            if expires is not None and time.time()>expires:
+                del(self.plots[key])
+                return None
+            self.plots.move_to_end(key)
+            return png
+
+    def put(self,key,png,dmax=None):
+        '''
+        add a plot to the cache
+        dmax is the end of the time range of the plot.  None means up to now
+        '''
+        tmax = as_timestamps(dmax)
+        if tmax is None or tmax>time.time():
+            expires = time.time() + self.max_age
+        else:
+            expires = None
+        with self.lock:
+            self.plots[key] = (png,expires)
+            self.plots.move_to_end(key)
+            while len(self.plots)>self.maxsize:
+                self.plots.popitem(last=False)
+        return
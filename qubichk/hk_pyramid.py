@@ -0,0 +1,410 @@
+'''
+$Id: hk_pyramid.py
+$auth: Steve Torchinsky <satorchi@apc.in2p3.fr>
+$created: Tue 20 Oct 2026 10:17:42 CEST
+$license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
+
+          This is free software: you are free to change and
+          redistribute it.  There is NO WARRANTY, to the extent
+          permitted by law.
+
+multi-resolution summary of the housekeeping history
+
+For each HK file (one per channel) we keep the minimum, mean, maximum, and number of samples
+in bins of 10 seconds, 1 minute, 10 minutes, and 1 hour.  A plot of a whole cooldown
+reads a few thousand bins instead of millions of samples.
+
+The summary is updated incrementally by update(): only the lines appended to the HK file since
+the last update are read.  The 10 second bins are made from the samples, and each level is made
+from the completed bins of the level below.  The last bin of each level is not complete
+and it is kept in the state file until it is closed.
+
+Files in the pyramid directory (default: the subdirectory "pyramid" of the HK directory):
+  <channel>_<step>s.dat   completed bins, binary records of level_dtype
+  <channel>.state         position in the HK file, number of bins in each level, and the open bins
+
+query() chooses the coarsest level with bins not larger than the requested resolution.
+'''
+import os,fcntl
+import numpy as np
+from qubichk.hk_freshness import default_hk_dir
+
+levels = [10,60,600,3600] # bin size in seconds.  Each level is a multiple of the one before
+level_dtype = np.dtype([('tstart','<f8'),('min','<f8'),('mean','<f8'),('max','<f8'),('count','<u4')])
+chunk_size = 16*1024*1024 # maximum number of bytes read from a HK file at once
+
+def aggregate(tstart,vmin,vsum,vmax,count,step):
+    '''
+    combine the bins (or samples) into bins of the given step
+    the input is in time order
+    return the start time, min, sum, max, and count of each new bin
+    '''
+    keys = np.floor(tstart/step)*step
+    starts = np.flatnonzero(np.concatenate(([True],keys[1:]!=keys[:-1])))
+    return (keys[starts],
+            np.minimum.reduceat(vmin,starts),
+            np.add.reduceat(vsum,starts),
+            np.maximum.reduceat(vmax,starts),
+            np.add.reduceat(count,starts))
+
+def parse_hk_lines(dat):
+    '''
+    return the timestamps and values from lines of a HK file
+    '''
+    tstamps = []
+    vals = []
+    for line in dat.decode(errors='replace').split('\n'):
+        cols = line.split()
+        if len(cols)<2: continue
+        try:
+            tstamp = float(cols[0])
+            val = float(cols[1])
+        except:
+            continue
+        tstamps.append(tstamp)
+        vals.append(val)
+    tstamps = np.array(tstamps)
+    vals = np.array(vals)
+    ok = np.isfinite(tstamps) & np.isfinite(vals)
+    return tstamps[ok],vals[ok]
+
+
+class channel_state:
+    '''
+    the state of the summary of one HK file
+
+    Arguments:
+
+    filename: the state file
+    '''
+
+    def __init__(self,filename):
+        self.filename = filename
+        self.reset()
+        self.read()
+        return None
+
+    def reset(self):
+        '''
+        start from the beginning of the HK file
+        '''
+        self.offset = 0
+        self.nbins = {}
+        self.open_bin = {}
+        for step in levels:
+            self.nbins[step] = 0
+            self.open_bin[step] = None
+        return
+
+    def read(self):
+        '''
+        read the state file.  The format is
+          offset <bytes>
+          <step> <number of bins> [<tstart> <min> <sum> <max> <count>]
+        '''
+        if not os.path.isfile(self.filename): return False
+        h = open(self.filename,'r')
+        lines = h.read().split('\n')
+        h.close()
+        try:
+            self.offset = int(lines[0].split()[1])
+            for line in lines[1:]:
+                cols = line.split()
+                if len(cols)<2: continue
+                step = int(cols[0])
+                if step not in levels: continue
+                self.nbins[step] = int(cols[1])
+                if len(cols)==7:
+                    vals = [float(col) for col in cols[2:6]]
+                    self.open_bin[step] = vals + [int(cols[6])]
+        except:
+            print('ERROR! Could not read the HK pyramid state: %s' % self.filename)
+            self.reset()
+            return False
+        return True
+
+    def write(self):
+        '''
+        write the state file.  It is written to a temporary file and renamed, so a reader never sees a partial file
+        '''
+        lines = ['offset %i' % self.offset]
+        for step in levels:
+            line = '%i %i' % (step,self.nbins[step])
+            if self.open_bin[step] is not None:
+                line += ' %.6f %.17g %.17g %.17g %i' % tuple(self.open_bin[step])
+            lines.append(line)
+        tmpname = '%s.tmp' % self.filename
+        h = open(tmpname,'w')
+        h.write('\n'.join(lines)+'\n')
+        h.close()
+        os.replace(tmpname,self.filename)
+        return
+
+
+class hk_pyramid:
+    '''
+    multi-resolution summary of the HK files
+
+    Arguments:
+
+    hk_dir: the directory with the HK files
+    pyramid_dir: the directory for the summary files.  Default is the subdirectory "pyramid" of hk_dir
+    '''
+
+    def __init__(self,hk_dir=None,pyramid_dir=None):
+        if hk_dir is None: hk_dir = default_hk_dir
+        self.hk_dir = os.path.abspath(hk_dir)
+        if pyramid_dir is None: pyramid_dir = '%s%spyramid' % (self.hk_dir,os.sep)
+        self.pyramid_dir = pyramid_dir
+        return None
+
+    def channel_name(self,basename):
+        '''
+        the channel name is the name of the HK file without .txt
+        '''
+        basename = os.path.basename(basename)
+        if basename.endswith('.txt'): basename = basename[:-4]
+        return basename
+
+    def level_filename(self,channel,step):
+        '''
+        the file with the completed bins of a level
+        '''
+        return '%s%s%s_%is.dat' % (self.pyramid_dir,os.sep,self.channel_name(channel),step)
+
+    def state_filename(self,channel):
+        '''
+        the state file for a channel
+        '''
+        return '%s%s%s.state' % (self.pyramid_dir,os.sep,self.channel_name(channel))
+
+    def channels(self):
+        '''
+        the list of HK files which can be summarized
+        '''
+        if not os.path.isdir(self.hk_dir): return []
+        channels = []
+        for basename in sorted(os.listdir(self.hk_dir)):
+            if not basename.endswith('.txt'): continue
+            if basename.find('LABEL')>=0 or basename.find('botId')>=0: continue
+            channels.append(self.channel_name(basename))
+        return channels
+
+    def append_bins(self,channel,step,state,tstart,vmin,vsum,vmax,count):
+        '''
+        add completed bins to the level file
+        the file is truncated to the number of bins in the state, in case a previous update was interrupted
+        '''
+        filename = self.level_filename(channel,step)
+        bins = np.zeros(len(tstart),dtype=level_dtype)
+        bins['tstart'] = tstart
+        bins['min'] = vmin
+        bins['mean'] = vsum/count
+        bins['max'] = vmax
+        bins['count'] = count
+        h = open(filename,'ab')
+        h.truncate(state.nbins[step]*level_dtype.itemsize)
+        h.write(bins.tobytes())
+        h.close()
+        state.nbins[step] += len(bins)
+        return
+
+    def update_channel(self,channel):
+        '''
+        add the data appended to the HK file since the last update
+        return the number of new samples
+        '''
+        channel = self.channel_name(channel)
+        hk_file = '%s%s%s.txt' % (self.hk_dir,os.sep,channel)
+        if not os.path.isfile(hk_file): return 0
+        state = channel_state(self.state_filename(channel))
+
+        fsize = os.path.getsize(hk_file)
+        if fsize<state.offset:
+            # the HK file was started again (see clean-hk.sh)
+            state.reset()
+            for step in levels:
+                filename = self.level_filename(channel,step)
+                if os.path.isfile(filename): os.remove(filename)
+
+        nsamples = 0
+        h = open(hk_file,'rb')
+        while state.offset<fsize:
+            h.seek(state.offset)
+            dat = h.read(min(chunk_size,fsize - state.offset))
+            # only complete lines.  The rest is read next time
+            end = dat.rfind(b'\n')
+            if end<0: break
+            state.offset += end + 1
+            t,v = parse_hk_lines(dat[:end])
+            nsamples += len(t)
+            self.add_samples(channel,state,t,v)
+        h.close()
+        state.write()
+        return nsamples
+
+    def add_samples(self,channel,state,t,v):
+        '''
+        put the samples in the 10 second bins, and the completed bins in the next level, and so on
+        '''
+        if len(t)==0: return
+        if (np.diff(t)<0).any():
+            order = np.argsort(t,kind='stable')
+            t = t[order]
+            v = v[order]
+
+        # samples older than the current bin can't be added anymore
+        if state.open_bin[levels[0]] is not None:
+            late = t<state.open_bin[levels[0]][0]
+            if late.any():
+                t = t[~late]
+                v = v[~late]
+        if len(t)==0: return
+
+        tstart = t
+        vmin = v
+        vsum = v
+        vmax = v
+        count = np.ones(len(t),dtype=np.int64)
+        for step in levels:
+            if len(tstart)==0: break
+            if state.open_bin[step] is not None:
+                ob = state.open_bin[step]
+                tstart = np.concatenate(([ob[0]],tstart))
+                vmin = np.concatenate(([ob[1]],vmin))
+                vsum = np.concatenate(([ob[2]],vsum))
+                vmax = np.concatenate(([ob[3]],vmax))
+                count = np.concatenate(([ob[4]],count))
+            tstart,vmin,vsum,vmax,count = aggregate(tstart,vmin,vsum,vmax,count,step)
+
+            # the last bin stays open
+            state.open_bin[step] = [tstart[-1],vmin[-1],vsum[-1],vmax[-1],int(count[-1])]
+            tstart,vmin,vsum,vmax,count = tstart[:-1],vmin[:-1],vsum[:-1],vmax[:-1],count[:-1]
+            if len(tstart)>0: self.append_bins(channel,step,state,tstart,vmin,vsum,vmax,count)
+        return
+
+    def update(self,channels=None):
+        '''
+        update the summary of all the HK files
+        the pyramid directory is locked so that two updates don't run at the same time
+        return a dictionary of channel -> number of new samples
+        '''
+        if channels is None: channels = self.channels()
+        os.makedirs(self.pyramid_dir,exist_ok=True)
+        lock = open('%s%s.lock' % (self.pyramid_dir,os.sep),'w')
+        try:
+            fcntl.flock(lock,fcntl.LOCK_EX|fcntl.LOCK_NB)
+        except BlockingIOError:
+            print('HK pyramid update already running')
+            lock.close()
+            return {}
+
+        retval = {}
+        try:
+            for channel in channels:
+                try:
+                    retval[channel] = self.update_channel(channel)
+                except:
+                    print('ERROR! Could not update the HK pyramid for %s' % channel)
+        finally:
+            fcntl.flock(lock,fcntl.LOCK_UN)
+            lock.close()
+        return retval
+
+    def pick_level(self,resolution=None):
+        '''
+        the coarsest level with bins not larger than the resolution in seconds
+        return None if the resolution is finer than the smallest bin: use the HK file
+        '''
+        if resolution is None: return levels[-1]
+        ok = [step for step in levels if step<=resolution]
+        if len(ok)==0: return None
+        return ok[-1]
+
+    def read_level(self,channel,step,nbins,tmin=None,tmax=None):
+        '''
+        read the completed bins of a level which overlap the time range
+        '''
+        filename = self.level_filename(channel,step)
+        if nbins==0 or not os.path.isfile(filename): return np.zeros(0,dtype=level_dtype)
+        nbins = min(nbins,os.path.getsize(filename)//level_dtype.itemsize)
+        if nbins==0: return np.zeros(0,dtype=level_dtype)
+        bins = np.memmap(filename,dtype=level_dtype,mode='r',shape=(nbins,))
+        tstart = bins['tstart']
+        lo = 0
+        hi = nbins
+        if tmin is not None: lo = np.searchsorted(tstart,tmin - step,side='right')
+        if tmax is not None: hi = np.searchsorted(tstart,tmax,side='right')
+        retval = np.array(bins[lo:hi])
+        del(bins)
+        return retval
+
+    def query(self,channel,tmin=None,tmax=None,resolution=None):
+        '''
+        return the bins of the coarsest level not larger than the resolution, between the timestamps tmin and tmax
+        the most recent data, which is not yet in a completed bin of this level, is taken from the finer levels
+
+        return the bins as an array of level_dtype, and the step of the level
+        return None,None if the resolution is finer than the smallest bin, or there is no summary for the channel
+        '''
+        step = self.pick_level(resolution)
+        if step is None: return None,None
+        statefile = self.state_filename(channel)
+        if not os.path.isfile(statefile): return None,None
+        state = channel_state(statefile)
+
+        # tnext is where the next level starts: either tmin, or the end of the last bin of the coarser level
+        parts = []
+        tnext = tmin
+        aligned = False
+        for level in reversed(levels[:levels.index(step)+1]):
+            bins = self.read_level(channel,level,state.nbins[level],tnext,tmax)
+            if aligned: bins = bins[bins['tstart']>=tnext]
+            if len(bins)==0: continue
+            parts.append(bins)
+            tnext = bins['tstart'][-1] + level
+            aligned = True
+
+        # the open bin of the smallest level has the most recent samples
+        ob = state.open_bin[levels[0]]
+        if ob is not None:
+            use_it = tmax is None or ob[0]<=tmax
+            if aligned:
+                use_it = use_it and ob[0]>=tnext
+            elif tnext is not None:
+                use_it = use_it and ob[0]>tnext - levels[0]
+            if use_it:
+                lastbin = np.zeros(1,dtype=level_dtype)
+                lastbin['tstart'] = ob[0]
+                lastbin['min'] = ob[1]
+                lastbin['mean'] = ob[2]/ob[4]
+                lastbin['max'] = ob[3]
+                lastbin['count'] = ob[4]
+                parts.append(lastbin)
+
+        if len(parts)==0: return np.zeros(0,dtype=level_dtype),step
+        return np.concatenate(parts),step
+
+    def extent(self,channel):
+        '''
+        the first and last timestamp in the summary of a channel
+        return None,None if there is no summary
+        '''
+        statefile = self.state_filename(channel)
+        if not os.path.isfile(statefile): return None,None
+        state = channel_state(statefile)
+        ob = state.open_bin[levels[0]]
+        if ob is None: return None,None
+        tlast = ob[0] + levels[0]
+        for step in reversed(levels):
+            bins = self.read_level(channel,step,min(1,state.nbins[step]))
+            if len(bins)>0: return bins['tstart'][0],tlast
+        return ob[0],tlast
+
+def get_hk_pyramid(hk_dir=None):
+    '''
+    return the HK pyramid, or None if it has not been made
+    '''
+    pyramid = hk_pyramid(hk_dir)
+    if not os.path.isdir(pyramid.pyramid_dir): return None
+    return pyramid
@@ -12,7 +12,7 @@ $license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
 functions to check if QUBIC housekeeping is running
 '''
 
-import re,os,sys,time
+import re,os,sys,time,threading
 from glob import glob
 import datetime as dt
 
@@ -22,7 +22,8 @@ from qubichk.send_telegram import send_telegram, get_alarm_recipients
 from qubichk.ups import get_ups_info
 from qubichk.hwp import get_hwp_info
 from qubichw.energenie import energenie
-from qubichk.utilities import shellcommand, ping
+from qubichk.utilities import shellcommand, ping_machines
+from qubichk.hk_freshness import get_freshness_index, scan_hk_files
 
 alarm_recipients = get_alarm_recipients()
 
@@ -40,13 +41,58 @@ machines = ['PiGPS',
 #            'cam26'] # 2021-11-30 19:30:48 no cam26
 #            'cam27'] # 2021-11-30 10:02:07 cam27 was never re-installed in Salta
 
+# maximum time in seconds for each check in hk_ok().  All the checks run at the same time.
+check_timeout = {}
+check_timeout['ups'] = 30
+check_timeout['power'] = 60 # the Energenie query retries up to 3 times with a 3 second pause
+check_timeout['network'] = 30
+check_timeout['mounts'] = 10
+check_timeout['diskspace'] = 30
+check_timeout['calsource'] = 30
+check_timeout['hwp'] = 30
+check_timeout['servers'] = 10
+check_timeout['temps'] = 20
+check_timeout['compressor'] = 60
+
+
+class powerbar_pool:
+    '''
+    Energenie power bars shared by the checks
+    Each power bar is initialized and its socket states are read only once,
+    even if several checks ask for it at the same time.
+    '''
 
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.powerbar_lock = {}
+        self.powerbar = {}
+        self.states = {}
+        return None
+
+    def get(self,pb_id):
+        '''
+        return the energenie object and its socket states.  The states are None if the powerbar is not ok.
+        '''
+        with self.lock:
+            if pb_id not in self.powerbar_lock.keys():
+                self.powerbar_lock[pb_id] = threading.Lock()
+            pb_lock = self.powerbar_lock[pb_id]
+                
+        with pb_lock:
+            if pb_id not in self.powerbar.keys():
+                powerbar = energenie(pb_id)
+                states = None
+                if powerbar.ok: states = powerbar.get_socket_states()
+                self.powerbar[pb_id] = powerbar
+                self.states[pb_id] = states
+        return self.powerbar[pb_id],self.states[pb_id]
 
     
 
-def check_network(verbosity=1):
+def check_network(verbosity=1,powerbars=None):
     '''
     ping the machines on the network
+    the machines are checked at the same time
     '''
     retval = {}
     retval['ok'] = True
@@ -54,21 +100,30 @@ def check_network(verbosity=1):
     retval['message'] = ''
     errmsg_list = []
     msg_list = []
+    if powerbars is None: powerbars = powerbar_pool()
     if verbosity>0: print('\n============ checking network access ============')
 
+    results = ping_machines(machines,verbosity=0)
+    for machine in machines:
+        retval[machine] = results[machine]
+
     for machine in machines:
-        retval[machine] = ping(machine,verbosity=verbosity)
+        if verbosity>0:
+            print(retval[machine]['message'],end='')
+            if retval[machine]['ok']:
+                print('OK')
+            else:
+                print(retval[machine]['error_message'])
         msg_list.append(retval[machine]['message'])
         if not retval[machine]['ok']:
             msg = '%s %s' % (machine,retval[machine]['error_message'])
             if machine=='modulator':
-                powerbar = energenie('cf')
-                if not powerbar.ok:
+                powerbar,states = powerbars.get('cf')
+                if states is None:
                     msg += ' %s' % powerbar.error_message
                     retval['ok'] = False
                     errmsg_list.append(powerbar.error_message)                    
                 else:
-                    states = powerbar.get_socket_states()                
                     if states['ok']:
                         modulator_state = states[powerbar.devicesocket['modulator']]
                         if not modulator_state:
@@ -78,13 +133,12 @@ def check_network(verbosity=1):
                         retval['ok'] = False
                         errmsg_list.append('carbon fibre state is UNKNOWN')
             elif machine.find('horn')>=0:
-                powerbar = energenie('electronics rack')
-                if not powerbar.ok:
+                powerbar,states = powerbars.get('electronics rack')
+                if states is None:
                     msg += ' %s' % powerbar.error_message
                     retval['ok'] = False
                     errmsg_list.append(powerbar.error_message)
                 else:
-                    states = powerbar.get_socket_states()
                     if states['ok']:
                         horn_state = states[powerbar.devicesocket['horn']]
                         if not horn_state:
@@ -101,7 +155,7 @@ def check_network(verbosity=1):
     retval['message'] = '\n'.join(msg_list)
     return retval
 
-def check_power(verbosity=1):
+def check_power(verbosity=1,powerbars=None):
     '''
     check if the components attached to the Energenie power bar are switched on
     '''
@@ -113,15 +167,16 @@ def check_power(verbosity=1):
     msg_list = []
     if verbosity>0: print('\n============ checking for power connections ============')
 
+    if powerbars is None: powerbars = powerbar_pool()
     powerbar_names = ['electronics rack','cryostat']
     for pb_id in powerbar_names:
-        powerbar = energenie(pb_id)
+        powerbar,states = powerbars.get(pb_id)
         
-        if not powerbar.ok:
+        if states is None:
             retval['ok'] = False
             errmsg_list.append(powerbar.error_message)
+            states = {'ok': False}
         else:
-            states = powerbar.get_socket_states()
             retval['ok'] = retval['ok'] and states['ok']
             if not states['ok']:
                 errmsg_list.append('%s powerbar socket states are UNKNOWN' % pb_id)
@@ -366,50 +421,54 @@ def check_temps(verbosity=1):
                 'RO.txt',
                 '*weather.txt']
 
-    hk_files = []
+    # the files on disk are always found with glob.  The latest timestamps are taken from the index
+    # maintained by the HK logger (see hk_freshness.py), and the files not in the index are read directly
+    latest = {}
+    index = get_freshness_index(hk_dir)
+    if index is not None:
+        index_tstamps = index.read_all()
+        index.close()
+    else:
+        index_tstamps = {}
+    scan_files = []
     for pattern in patterns:
         glob_pattern =  '%s/%s' % (hk_dir,pattern)
-        hk_files.extend(glob(glob_pattern))
+        for F in glob(glob_pattern):
+            name = os.path.basename(F)
+            if name in index_tstamps.keys():
+                latest[name] = index_tstamps[name]
+            else:
+                scan_files.append(F)
+    for F,result in scan_hk_files(scan_files).items():
+        if result is None:
+            latest[os.path.basename(F)] = None
+        else:
+            latest[os.path.basename(F)] = result[0]
 
-    hk_files.sort()
+    hk_files = sorted(latest.keys())
     if len(hk_files)<nfiles:
         retval['ok'] = False
         msg = 'missing HK data files.  Found %i out of %i.' % (len(hk_files),nfiles)
         if verbosity>0: print('\nERROR! %s' % msg)
         retval['error_message'] += msg
 
-    for F in hk_files:
+    tstamp_now = utcnow().timestamp()
+    for name in hk_files:
         info = {}
-        info['name'] = os.path.basename(F)
+        info['name'] = name
         info['ok'] = True
-        h = open(F,'rb')
-        h.seek(0,os.SEEK_END)
-        fsize = h.tell()
-        if fsize<1024:
-            h.seek(0,os.SEEK_SET)
-        else:
-            h.seek(-1024,os.SEEK_END)
-        x = h.read()
-        h.close()
-        lines = x.decode().split('\n')
-        if len(lines)<2:
-            lastline = lines[0]
-        else:
-            lastline = lines[-2]
-        try:
-            tstamp = float(lastline.split()[0])
-        except:
+        tstamp = latest[name]
+        if tstamp is None:
             info['ok'] = False
             retval['ok'] = False
             info['error_message'] = 'unable to read timestamp'
             msg = '\nunable to read timestamp for %s' % info['name']
             if verbosity>0: print('\nERROR! %s' % msg,end='')
             retval['error_message'] += msg
-            retval[F] = info
+            retval[name] = info
             continue
 
-        now = utcnow()
-        tstamp_now = now.timestamp()
+        info['tstamp'] = tstamp
         delta = tstamp_now - tstamp
         if delta > delta_max:
             info['ok'] = False
@@ -538,27 +597,83 @@ def check_hwp(verbosity=1):
         
     return retval
 
+def run_check(check,verbosity=1,powerbars=None,results=None,key=None):
+    '''
+    run one of the checks, and catch any error so that it does not stop the other checks
+    if results is given, the result is also put in results[key] (for running in a thread)
+    '''
+    tstart = time.monotonic()
+    try:
+        if powerbars is None:
+            result = check(verbosity=verbosity)
+        else:
+            result = check(verbosity=verbosity,powerbars=powerbars)
+    except Exception as err:
+        msg = 'ERROR! %s failed: %s' % (check.__name__,err)
+        result = {'ok': False, 'error_message': msg, 'message': msg}
+    result['elapsed'] = time.monotonic() - tstart
+    if results is not None: results[key] = result
+    return result
+
 def hk_ok(verbosity=1):
     '''
     check that housekeeping is okay
+
+    the checks are run at the same time, each with its own timeout (see check_timeout)
+    so the total time is the time of the slowest check.
+    The result is a dictionary with the result of each check, and the overall ok and messages.
     '''
     retval = {}
     ok = True
     message = ''
 
-    retval['ups'] = check_ups(verbosity=verbosity)
-    retval['power'] = check_power(verbosity=verbosity)
-    retval['network'] = check_network(verbosity=verbosity)
-    retval['mounts'] = check_mounts(verbosity=verbosity)
-    retval['diskspace'] = check_diskspace(verbosity=verbosity)
-    retval['calsource'] = check_gps(verbosity=verbosity)
-    retval['hwp'] = check_hwp(verbosity=verbosity)
-    retval['servers'] = check_servers(verbosity=verbosity)
-    retval['temps'] = check_temps(verbosity=verbosity)
-    retval['compressor'] = check_compressors(verbosity=verbosity)
+    checks = {}
+    checks['ups'] = check_ups
+    checks['power'] = check_power
+    checks['network'] = check_network
+    checks['mounts'] = check_mounts
+    checks['diskspace'] = check_diskspace
+    checks['calsource'] = check_gps
+    checks['hwp'] = check_hwp
+    checks['servers'] = check_servers
+    checks['temps'] = check_temps
+    checks['compressor'] = check_compressors
+
+    # the checks which use the Energenie powerbars share them
+    powerbars = powerbar_pool()
+    shared = ['power','network']
+
+    tstart = time.monotonic()
+    # daemon threads, so that a check which hangs does not stop the program from exiting
+    results = {}
+    threads = {}
+    for key in checks.keys():
+        kwargs = {'verbosity': 0, 'results': results, 'key': key}
+        if key in shared: kwargs['powerbars'] = powerbars
+        threads[key] = threading.Thread(target=run_check,args=(checks[key],),kwargs=kwargs,daemon=True)
+        threads[key].start()
+
+    # collect the results in the usual order, and print them as if they were done one after the other
+    timeouts = []
+    for key in checks.keys():
+        remaining = max(0,tstart + check_timeout[key] - time.monotonic())
+        threads[key].join(timeout=remaining)
+        if key in results.keys():
+            retval[key] = results[key]
+        else:
+            msg = 'no result after %i seconds' % check_timeout[key]
+            retval[key] = {'ok': False, 'error_message': msg, 'message': '%s ... %s' % (key,msg), 'elapsed': None}
+            timeouts.append(key)
+        if verbosity>0:
+            print('\n============ %s ============' % key)
+            print(retval[key]['message'])
+
+    # the checks which timed out are abandoned
+    retval['timeouts'] = timeouts
+    retval['elapsed'] = time.monotonic() - tstart
 
     message_list = []
-    for key in retval.keys():        
+    for key in checks.keys():        
         if 'ok' not in retval[key].keys():
             if verbosity>0: print('missing ok key for %s' % key)
             continue
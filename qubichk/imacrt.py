@@ -14,21 +14,430 @@ user manuel: imacrt_1.4.pdf page 24-25
 this is especially the MGC3 temperature controller for the TES bath temperature
 see also in scripts directory:  mmr_mes1.py, fast_mmr.py (possibly to be updated)
 '''
-import socket,os
+import socket,os,time,select,threading
+from collections import deque
+import numpy as np
 from qubichk.utilities import get_known_hosts, printmsg, assign_logfile
 from satorchipy.datefunctions import utcnow
+from qubichw.pid_control import sliding_regression
 known_hosts = get_known_hosts()
 
+# the MES1 data packets from the MMR (user manual page 25)
+mes1_dtype = np.dtype([('id','u1'),          # byte id
+                       ('channel','u1'),     # channel (starting at 0)
+                       ('nsamples','<u2'),   # number of samples in the average
+                       ('index_I','u1'),
+                       ('index_U','u1'),
+                       ('seconds','<u4'),    # time (seconds)
+                       ('millisec','<u2'),   # time (millisec)
+                       ('status','<u2'),
+                       ('current','<f8'),
+                       ('DT_ADC','<f8'),
+                       ('R','<f8'),          # Ravg over n samples
+                       ('R2sum','<f8'),      # sum of R^2 for n samples
+                       ('Rpp','<f8'),        # peak-to-peak for the n samples of R
+                       ('Rconv','<f8')])     # R conversion
+mes1_packetsize = mes1_dtype.itemsize # 62 bytes
+
+class mes1_decoder:
+    '''
+    decode the MES1 datagrams from the MMR into a structured array
+
+    Each datagram should have a whole number of records.  Nothing is carried over to the next datagram,
+    so one bad datagram does not shift the records that follow.
+    A datagram which is truncated or has extra bytes is counted as an error, and only the records
+    at the start of the datagram with the expected id byte are kept.
+    The id byte is taken from the first datagram which has the right length and at least two records
+    with the same id.  Records with another id are dropped and counted.
+    '''
+
+    def __init__(self):
+        self.id_byte = None
+        self.t0 = None
+        self.errors = {'bad length': 0, 'bad id': 0, 'dropped bytes': 0}
+        return None
+
+    def decode(self,datagram):
+        '''
+        return the records in the datagram, and the timestamps
+        '''
+        nrecords = len(datagram) // mes1_packetsize
+        nbytes = nrecords*mes1_packetsize
+        aligned = nbytes==len(datagram)
+        if not aligned:
+            self.errors['bad length'] += 1
+            self.errors['dropped bytes'] += len(datagram) - nbytes
+
+        records = np.frombuffer(datagram[:nbytes],dtype=mes1_dtype)
+        if self.id_byte is None:
+            ids = np.unique(records['id'])
+            if aligned and nrecords>1 and len(ids)==1:
+                self.id_byte = ids[0]
+            elif not aligned:
+                # we can't check the records without the id
+                self.errors['dropped bytes'] += nbytes
+                records = records[:0]
+
+        if self.id_byte is not None:
+            good = records['id']==self.id_byte
+            nbad = len(records) - int(np.count_nonzero(good))
+            if nbad>0:
+                self.errors['bad id'] += nbad
+                self.errors['dropped bytes'] += nbad*mes1_packetsize
+                records = records[good]
+
+        t = records['seconds'] + 0.001*records['millisec']
+        if len(records)>0 and self.t0 is None:
+            self.t0 = utcnow().timestamp() - t[0]
+        if self.t0 is None: return records,t
+        return records,self.t0 + t
+
+class channel_writer:
+    '''
+    buffered output files, one for each channel
+    output can be text (timestamp value) or binary (float64 pairs)
+    the text files have the given extension, and the binary files have the extension .bin
+    '''
+
+    def __init__(self,rootname,binary=False,flush_interval=10,extension='dat'):
+        self.rootname = rootname
+        self.binary = binary
+        self.extension = extension
+        self.flush_interval = flush_interval
+        self.handle = {}
+        self.last_flush = utcnow().timestamp()
+        return None
+
+    def filename(self,ch):
+        '''
+        the filename for a given channel
+        '''
+        if self.binary: return '%s%i.bin' % (self.rootname,ch)
+        return '%s%i.%s' % (self.rootname,ch,self.extension)
+
+    def write(self,ch,t,v):
+        '''
+        write arrays of timestamp and values for a channel
+        '''
+        if ch not in self.handle.keys():
+            if self.binary:
+                self.handle[ch] = open(self.filename(ch),'ab')
+            else:
+                self.handle[ch] = open(self.filename(ch),'a')
+        h = self.handle[ch]
+
+        if self.binary:
+            np.column_stack((t,v)).astype('<f8').tofile(h)
+        else:
+            np.savetxt(h,np.column_stack((t,v)),fmt='%f %e')
+
+        now = utcnow().timestamp()
+        if now - self.last_flush > self.flush_interval:
+            self.flush()
+            self.last_flush = now
+        return
+
+    def flush(self):
+        '''
+        flush all the output files
+        '''
+        for h in self.handle.values():
+            h.flush()
+        return
+
+    def close(self):
+        '''
+        close all the output files
+        '''
+        for h in self.handle.values():
+            h.close()
+        self.handle = {}
+        return
+
+class mmr_poller:
+    '''
+    poll several MMR channels with MMR3GET, each channel at its own rate
+
+    The reply to MMR3GET does not say which channel it is for.  Requests can not be pipelined:
+    if a reply is lost, the following replies would be assigned to the wrong channels.
+    So there is only one request waiting for a reply, and the next request is sent after the reply
+    or after the timeout.  After a timeout, replies are thrown away until nothing has arrived
+    for another timeout, so that a late reply is not taken as the answer to the next request.
+
+    Arguments:
+
+    channels: list of MMR channels
+    rates: dictionary of sample rate in Hz for each channel.  Channels not in the dictionary are sampled as fast as possible
+    timeout: time in seconds to wait for a reply
+    writer: a channel_writer object for the output
+    verbosity: level of verboseness for printing to screen
+    '''
+
+    def __init__(self,channels,rates=None,timeout=0.5,writer=None,verbosity=0):
+        self.imacrtIP = known_hosts['mmr3']
+        self.imacrt_port = 12000 + int(self.imacrtIP.split('.')[-1])
+        self.channels = channels
+        self.period = {}
+        for ch in channels:
+            if rates is not None and ch in rates.keys() and rates[ch]>0:
+                self.period[ch] = 1/rates[ch]
+            else:
+                self.period[ch] = 0.0
+        self.timeout = timeout
+        if writer is None: writer = channel_writer('mmr_chan')
+        self.writer = writer
+        self.verbosity = verbosity
+        self.sock = None
+        self.reset_stats()
+        return None
+
+    def init_socket(self):
+        '''
+        initialize the socket for the MMR
+        '''
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('', 12000))
+        self.sock = sock
+        return sock
+
+    def reset_stats(self):
+        '''
+        reset the statistics for each channel
+        '''
+        self.stats = {}
+        self.stats['start'] = time.monotonic()
+        for ch in self.channels:
+            self.stats[ch] = {'samples': 0, 'timeouts': 0, 'bad replies': 0, 'rtt sum': 0.0}
+        return
+
+    def report(self):
+        '''
+        print the achieved rate and timeouts for each channel
+        '''
+        delta = time.monotonic() - self.stats['start']
+        if delta<=0: return
+        lines = ['%s MMR polling over %.1f seconds:' % (utcnow().strftime('%Y-%m-%d %H:%M:%S'),delta)]
+        for ch in self.channels:
+            chstats = self.stats[ch]
+            if chstats['samples']>0:
+                rtt = 1000*chstats['rtt sum']/chstats['samples']
+            else:
+                rtt = 0.0
+            lines.append('   channel %2i: %.2f samples per second, %i timeouts, %i bad replies, round trip %.1f ms'
+                         % (ch,chstats['samples']/delta,chstats['timeouts'],chstats['bad replies'],rtt))
+        print('\n'.join(lines))
+        return
+
+    def poll(self,duration=None,report_interval=60):
+        '''
+        run the polling loop for the given duration in seconds (default: forever)
+        '''
+        if self.sock is None: self.init_socket()
+
+        start = time.monotonic()
+        next_due = {}
+        for ch in self.channels:
+            next_due[ch] = start
+        last_report = start
+
+        while duration is None or time.monotonic()-start<duration:
+            # the channel which is due first
+            ch = min(self.channels,key=lambda chan: next_due[chan])
+            now = time.monotonic()
+            if next_due[ch]>now:
+                time.sleep(next_due[ch] - now)
+                now = time.monotonic()
+            next_due[ch] = max(next_due[ch] + self.period[ch], now)
+
+            cmd = 'MMR3GET %i\n' % ch
+            self.sock.sendto(cmd.encode(),(self.imacrtIP,self.imacrt_port))
+            sent = time.monotonic()
+
+            # wait for the reply from the MMR, ignoring anything else
+            ans_b = None
+            while True:
+                wait = sent + self.timeout - time.monotonic()
+                if wait<=0: break
+                readable,_,_ = select.select([self.sock],[],[],wait)
+                if not readable: break
+                dat,addr = self.sock.recvfrom(1024)
+                if addr[0]==self.imacrtIP:
+                    ans_b = dat
+                    break
+            rx_time = time.monotonic()
+
+            if ans_b is None:
+                # a late reply must not be taken as the answer to the next request
+                self.stats[ch]['timeouts'] += 1
+                self.drain(quiet=self.timeout)
+                continue
+            try:
+                val = float(ans_b.decode().strip())
+            except:
+                self.stats[ch]['bad replies'] += 1
+                continue
+            self.stats[ch]['samples'] += 1
+            self.stats[ch]['rtt sum'] += rx_time - sent
+            self.writer.write(ch,[utcnow().timestamp()],[val])
+
+            if self.verbosity>0 and rx_time-last_report>report_interval:
+                self.report()
+                self.reset_stats()
+                last_report = rx_time
+        return
+
+    def drain(self,quiet=0):
+        '''
+        throw away anything arriving on the socket until nothing has arrived for quiet seconds
+        '''
+        while True:
+            readable,_,_ = select.select([self.sock],[],[],quiet)
+            if not readable: return
+            self.sock.recv(1024)
+
+    def close(self):
+        '''
+        close the socket and output files
+        '''
+        self.writer.close()
+        if self.sock is not None: self.sock.close()
+        self.sock = None
+        return
+
+
+class settling_detector:
+    '''
+    decide when the temperature has settled at the target
+
+    A straight line is fit to the samples in a sliding time window (drift rate and noise).
+    The temperature is stable when the window is filled, the fitted value at the most recent sample
+    is within precision of the target, and the drift rate is within slope_tolerance.
+
+    Arguments:
+
+    target: the target temperature
+    precision: the acceptable offset from the target
+    window: the duration in seconds of the window for the fit
+    interval: the expected time in seconds between samples
+    slope_tolerance: the acceptable drift rate in K/s.  Default is a drift of precision over the window
+    '''
+
+    def __init__(self,target,precision,window=10,interval=0.5,slope_tolerance=None):
+        self.target = target
+        self.precision = precision
+        self.window = window
+        if slope_tolerance is None: slope_tolerance = precision/window
+        self.slope_tolerance = slope_tolerance
+        npts = max(3,int(round(window/interval)))
+        self.regression = sliding_regression(npts)
+        self.start = None
+        self.settled_time = None
+        return None
+
+    def add(self,tstamp,val):
+        '''
+        add a sample and return True if the temperature is stable
+        '''
+        if self.start is None: self.start = tstamp
+        self.regression.add(tstamp,val - self.target)
+        stable = self.is_stable()
+        if stable and self.settled_time is None: self.settled_time = tstamp - self.start
+        return stable
+
+    def fit(self):
+        '''
+        return the drift rate (K/s) and the offset from the target at the most recent sample
+        '''
+        slope,intercept = self.regression.fit()
+        if slope is None: return None,None
+        offset = slope*self.regression.newest() + intercept
+        return slope,offset
+
+    def noise(self):
+        '''
+        the rms of the samples around the fitted line
+        '''
+        slope,intercept = self.regression.fit()
+        if slope is None: return None
+        n = self.regression.n()
+        x = self.regression.x_buffer[:n]
+        y = self.regression.y_buffer[:n]
+        residual = y - (slope*x + intercept)
+        return np.sqrt((residual**2).mean())
+
+    def is_stable(self):
+        '''
+        check if both the offset and the drift rate are within tolerance
+        '''
+        if not self.regression.is_full(): return False
+        slope,offset = self.fit()
+        if slope is None: return False
+        return abs(offset)<self.precision and abs(slope)<=self.slope_tolerance
+
+    def time_to_settle(self):
+        '''
+        estimate the time in seconds until the temperature is stable
+        return 0 if it is already stable, and None if the temperature is not moving towards the target
+        '''
+        if self.is_stable(): return 0.0
+        slope,offset = self.fit()
+        if slope is None: return None
+
+        # time for the window to fill
+        t_fill = 0.0
+        if not self.regression.is_full():
+            n = self.regression.n()
+            t_fill = (self.regression.npts - n)*self.regression.interval()/max(1,n-1)
+        
+        if abs(offset)<self.precision: return max(t_fill,self.window)
+        if slope==0 or np.sign(slope)==np.sign(offset): return None
+        t_reach = (abs(offset) - self.precision)/abs(slope)
+        return max(t_fill,t_reach + self.window)
+
+
 class iMACRT:
-    def __init__(self,device='mgc',verbosity=1):
+    '''
+    client for the iMACRT devices (MGC3 temperature controller, MMR3 thermometer readout)
+
+    The device answers on UDP without any identifier in the reply, so we empty the socket before each command
+    and only accept a reply coming from the device.  A late reply to an earlier command is therefore thrown away
+    instead of being taken as the answer to the next command.
+
+    The socket is shared by several callers (see get_imacrt) and access is serialized with a lock.
+    A background sampler can read the measurement regularly.  The samples are cached for other callers,
+    and wait_for_stable() returns as soon as the temperature is within the requested precision.
+
+    Arguments:
+
+    device: 'mgc' or 'mmr'
+    timeout: time in seconds to wait for a reply
+    verbosity: level of verboseness for printing to screen
+    '''
+    def __init__(self,device='mgc',timeout=1.0,verbosity=1):
         self.sock = None
         
         if device.upper().find('MMR')==0:
+            self.device = 'mmr'
             self.imacrtIP = known_hosts['mmr3']
         else:
+            self.device = 'mgc'
             self.imacrtIP = known_hosts['mgc3']
-        self.imacrt_port = 12000 + eval(self.imacrtIP.split('.')[-1])
+        self.imacrt_port = 12000 + int(self.imacrtIP.split('.')[-1])
+        self.timeout = timeout
         self.verbosity = verbosity
+        self.stale_count = 0
+
+        self.socket_lock = threading.RLock()
+        self.condition = threading.Condition()
+        self.measurements = deque(maxlen=1000) # (timestamp, value) from the sampler
+        self.nsamples = 0
+        self.sampler = None
+        self.sampler_stop = threading.Event()
+        self.sampler_interval = 0.5
+        self.sampler_cmd = None
+        self.settling = None
+        if self.device=='mgc': self.sampler_cmd = 'MGC3GET 3'
 
         self.logfile = assign_logfile('pystudio_log.txt')
         return
@@ -48,7 +457,7 @@ class iMACRT:
 
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.settimeout(1)
+        sock.settimeout(self.timeout)
         sock.bind(('', 12000))
         self.sock = sock
         return sock
@@ -56,38 +465,75 @@ class iMACRT:
     def disconnect(self):
         '''
         disconnect socket so that the port is free
+        the socket is opened again with the next command
         '''
-        if self.sock is None:
-            self.printmsg('already disconnected')
-            return None
+        self.stop_sampler()
+        with self.socket_lock:
+            if self.sock is None:
+                self.printmsg('already disconnected',threshold=2)
+                return None
 
-        self.sock.close()
-        del(self.sock)
-        self.sock = None
+            self.sock.close()
+            self.sock = None
         return None
 
+    def drain(self):
+        '''
+        throw away anything waiting on the socket.  These are late replies to previous commands.
+        '''
+        while True:
+            readable,_,_ = select.select([self.sock],[],[],0)
+            if not readable: return
+            self.sock.recv(1024)
+            self.stale_count += 1
+            self.printmsg('discarded stale reply from iMACRT device: %s' % self.imacrtIP,threshold=2)
+
     def send_command(self,cmd,get_reply=True):
         '''
         send a command to the iMACRT device
         '''
-        if self.sock is None:
-            self.sock = self.init_socket()        
-        
-        full_cmd = cmd+'\n'
-        cmd_b = full_cmd.encode()
-        nbytes_sent = self.sock.sendto(cmd_b,(self.imacrtIP,self.imacrt_port))
+        with self.socket_lock:
+            if self.sock is None:
+                self.sock = self.init_socket()
+            self.drain()
 
-        
-        if not get_reply and nbytes_sent>0:
-            return True
-        
+            full_cmd = cmd+'\n'
+            cmd_b = full_cmd.encode()
+            nbytes_sent = self.sock.sendto(cmd_b,(self.imacrtIP,self.imacrt_port))
+
+            if not get_reply:
+                return nbytes_sent>0
+
+            deadline = time.monotonic() + self.timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining<=0:
+                    self.printmsg('ERROR! No reply from iMACRT device: %s' % self.imacrtIP)
+                    return None
+                self.sock.settimeout(remaining)
+                try:
+                    ans_b, addr = self.sock.recvfrom(1024)
+                except:
+                    self.printmsg('ERROR! No reply from iMACRT device: %s' % self.imacrtIP)
+                    return None
+                if addr[0]!=self.imacrtIP:
+                    self.stale_count += 1
+                    continue
+                return ans_b.decode()
+
+    def query_value(self,cmd):
+        '''
+        send a command and interpret the reply as a number
+        return None if there is no valid reply
+        '''
+        ans_str = self.send_command(cmd)
+        if ans_str is None: return None
         try:
-            ans_b = self.sock.recv(1024)
+            ans = float(ans_str.strip())
         except:
-            self.printmsg('ERROR! No reply from iMACRT device: %s' % self.imacrtIP)
+            self.printmsg('ERROR! invalid reply to %s: %s' % (cmd,ans_str.strip()),threshold=1)
             return None
-
-        return ans_b.decode()
+        return ans
     
     def get_id(self):
         '''
@@ -104,15 +550,12 @@ class iMACRT:
         get the current status of the PID (on or off)
         '''
         cmd = 'MGC3GET 1'
-        ans_str = self.send_command(cmd)
-        ans = None
-        try:
-            ans = eval(ans_str)
-        except:
-            self.printmsg('ERROR! MGC PID state unknown: %s' % ans_str)
+        ans = self.query_value(cmd)
+        if ans is None:
+            self.printmsg('ERROR! MGC PID state unknown')
             return None
 
-        return ans
+        return int(ans)
 
     def set_mgc_pid(self,onoff):
         '''
@@ -128,13 +571,11 @@ class iMACRT:
         get the temperature set point for the TES bath temperature
         '''
         cmd = 'MGC3GET 2'
-        ans_str = self.send_command(cmd)
-        try:
-            ans = eval(ans_str)
+        ans = self.query_value(cmd)
+        if ans is None:
+            self.printmsg('MGC setpoint: unknown')
+        else:
             self.printmsg('MGC setpoint: %0.4f K' % ans)
-        except:
-            ans = ans_str
-            self.printmsg('MGC setpoint: %s' % ans)
             
         return ans
         
@@ -148,23 +589,143 @@ class iMACRT:
         cmd = 'MGC3SET 2 %f' % setpt
         return self.send_command(cmd,get_reply=False)
 
-    def get_mgc_measurement(self):
+    def get_mgc_measurement(self,max_age=None):
         '''
         get the current measurement for the TES bath temperature
+
+        if max_age is given, and the sampler has a measurement more recent than max_age seconds,
+        the cached measurement is returned without asking the device
         '''
+        if max_age is not None:
+            cached = self.get_cached_measurement(max_age)
+            if cached is not None:
+                return cached[1]
+            
         cmd = 'MGC3GET 3'
+        ans = self.query_value(cmd)
+        if ans is None:
+            self.printmsg('MGC measurement: unknown')
+            return None
         
-        ans_str = self.send_command(cmd)
-        try:
-            ans = eval(ans_str)
-            self.printmsg('MGC measurement: %0.4f K' % ans)
-        except:
-            ans = ans_str
-            self.printmsg('MGC measurement: %s' % ans)
-
-        if ans is None or ans=='': return None
-            
+        self.printmsg('MGC measurement: %0.4f K' % ans)
         return ans
 
-    
+    def get_cached_measurement(self,max_age=None):
+        '''
+        return the most recent (timestamp, value) from the sampler
+        return None if there is no measurement, or if it is older than max_age seconds
+        '''
+        with self.condition:
+            if len(self.measurements)==0: return None
+            tstamp,val = self.measurements[-1]
+        if max_age is not None and time.time()-tstamp>max_age: return None
+        return tstamp,val
+
+    def start_sampler(self,interval=None,cmd=None):
+        '''
+        start reading the measurement in the background
+        the default is the MGC bath temperature measurement.  For the MMR, give the command (eg. MMR3GET 1)
+        '''
+        if interval is not None: self.sampler_interval = interval
+        if cmd is not None: self.sampler_cmd = cmd
+        if self.sampler is not None and self.sampler.is_alive(): return
+        if self.sampler_cmd is None:
+            self.printmsg('ERROR! No command given for the sampler')
+            return
+        self.sampler_stop.clear()
+        self.sampler = threading.Thread(target=self.sampler_loop,name='iMACRT-%s-sampler' % self.device,daemon=True)
+        self.sampler.start()
+        self.printmsg('sampler started with interval %.2f seconds' % self.sampler_interval,threshold=2)
+        return
+
+    def stop_sampler(self):
+        '''
+        stop the background sampler
+        '''
+        if self.sampler is None: return
+        self.sampler_stop.set()
+        self.sampler.join(timeout=self.timeout+self.sampler_interval+1)
+        self.sampler = None
+        self.printmsg('sampler stopped',threshold=2)
+        return
+
+    def sampler_loop(self):
+        '''
+        read the measurement at regular intervals, and notify anyone waiting for a new sample
+        '''
+        cmd = self.sampler_cmd
+        next_sample = time.monotonic()
+        while not self.sampler_stop.is_set():
+            val = self.query_value(cmd)
+            if val is not None:
+                with self.condition:
+                    self.measurements.append((time.time(),val))
+                    self.nsamples += 1
+                    self.condition.notify_all()
+
+            next_sample += self.sampler_interval
+            delay = next_sample - time.monotonic()
+            if delay<0:
+                next_sample = time.monotonic()
+                delay = 0
+            self.sampler_stop.wait(delay)
+        return
+
+    def wait_for_stable(self,target,precision,timeout=120,window=10,slope_tolerance=None):
+        '''
+        wait until the measurement has settled within precision of the target
+        the background sampler is started if necessary, and each new sample is given to a settling_detector.
+        The detector is kept in self.settling, for example to get the estimated time to settle.
+        return a tuple: (True/False, last measurement)
+        '''
+        self.start_sampler()
+        if self.sampler is None: return False,None
+        detector = settling_detector(target,precision,window=window,interval=self.sampler_interval,slope_tolerance=slope_tolerance)
+        self.settling = detector
+        deadline = time.monotonic() + timeout
+        next_report = time.monotonic() + window
+        latest = None
+        with self.condition:
+            nseen = self.nsamples
+            while True:
+                if self.nsamples>nseen:
+                    # give all the new samples to the detector
+                    nnew = min(self.nsamples - nseen,len(self.measurements))
+                    nseen = self.nsamples
+                    stable = False
+                    for tstamp,val in list(self.measurements)[-nnew:]:
+                        stable = detector.add(tstamp,val)
+                    latest = val
+                    if stable: return True,latest
+
+                now = time.monotonic()
+                if now>=next_report and latest is not None:
+                    t_settle = detector.time_to_settle()
+                    if t_settle is None:
+                        self.printmsg('waiting for %.3f mK, currently %.3f mK, not converging' % (1000*target,1000*latest),threshold=1)
+                    else:
+                        self.printmsg('waiting for %.3f mK, currently %.3f mK, estimated time to settle: %.0f seconds'
+                                      % (1000*target,1000*latest,t_settle),threshold=1)
+                    next_report = now + window
+                
+                remaining = deadline - now
+                if remaining<=0: return False,latest
+                self.condition.wait(min(remaining,next_report-now))
+
+
+# one client per device, shared by everyone in the same process so that they do not compete for the socket
+shared_clients = {}
+shared_clients_lock = threading.Lock()
 
+def get_imacrt(device='mgc',verbosity=1):
+    '''
+    get the shared iMACRT client for the device
+    '''
+    if device.upper().find('MMR')==0:
+        key = 'mmr'
+    else:
+        key = 'mgc'
+    with shared_clients_lock:
+        if key not in shared_clients.keys():
+            shared_clients[key] = iMACRT(device=key,verbosity=verbosity)
+    return shared_clients[key]
@@ -0,0 +1,267 @@
+'''
+$Id: netprobe.py
+$auth: Steve Torchinsky <satorchi@apc.in2p3.fr>
+$created: Mon 19 Oct 2026 19:47:12 CEST
+$license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
+
+          This is free software: you are free to change and
+          redistribute it.  There is NO WARRANTY, to the extent
+          permitted by law.
+
+check if the machines on the network are reachable, without running the shell command ping
+
+All the hosts are probed at the same time with asyncio.
+We use ICMP echo if it is permitted for the user (datagram ICMP socket, see net.ipv4.ping_group_range),
+or a raw ICMP socket if we are root.  Otherwise, we try a TCP connection.
+For TCP, a refused connection means the host is reachable:  it answered.
+
+The result for each host has the packet loss and the round trip time, and it can be logged to file.
+'''
+import os,socket,struct,time,asyncio
+import numpy as np
+from satorchipy.datefunctions import utcnow
+
+# TCP ports to try if we can't use ICMP (ssh, http)
+default_tcp_ports = [22,80]
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+
+def icmp_checksum(packet):
+    '''
+    the internet checksum (RFC 1071)
+    '''
+    if len(packet)%2==1: packet += b'\x00'
+    total = sum(struct.unpack('!%iH' % (len(packet)//2),packet))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return (~total) & 0xFFFF
+
+def make_echo_request(ident,seq):
+    '''
+    make the ICMP echo request packet
+    '''
+    payload = struct.pack('!d',time.time())
+    header = struct.pack('!BBHHH',ICMP_ECHO_REQUEST,0,0,ident,seq)
+    checksum = icmp_checksum(header+payload)
+    header = struct.pack('!BBHHH',ICMP_ECHO_REQUEST,0,checksum,ident,seq)
+    return header+payload
+
+def icmp_socket():
+    '''
+    open an ICMP socket if it is permitted
+    return the socket and True if it is a raw socket (the reply includes the IP header)
+    return None if ICMP is not permitted
+    '''
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+        sock.setblocking(False)
+        return sock,False
+    except:
+        pass
+
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        sock.setblocking(False)
+        return sock,True
+    except:
+        pass
+
+    return None,False
+
+def icmp_is_permitted():
+    '''
+    check if we can use ICMP
+    '''
+    sock,raw = icmp_socket()
+    if sock is None: return False
+    sock.close()
+    return True
+
+
+async def icmp_echo(address,seq,timeout):
+    '''
+    send one ICMP echo request and wait for the reply
+    return the round trip time in seconds, or None if there is no reply
+    '''
+    loop = asyncio.get_running_loop()
+    sock,raw = icmp_socket()
+    if sock is None: return None
+
+    ident = (os.getpid() + seq) & 0xFFFF
+    packet = make_echo_request(ident,seq)
+    try:
+        # loop.sock_sendto and loop.sock_recvfrom are only in python>=3.11
+        # with a connected socket, we only receive the packets from this address
+        sock.connect((address,0))
+        t0 = time.monotonic()
+        await loop.sock_sendall(sock,packet)
+        deadline = t0 + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining<=0: return None
+            data = await asyncio.wait_for(loop.sock_recv(sock,1024),remaining)
+            if raw: data = data[4*(data[0] & 0x0F):] # remove the IP header
+            if len(data)<8: continue
+            icmp_type,code,checksum,reply_ident,reply_seq = struct.unpack('!BBHHH',data[:8])
+            if icmp_type!=ICMP_ECHO_REPLY or reply_seq!=seq: continue
+            # with a datagram socket, the kernel assigns the identifier
+            if raw and reply_ident!=ident: continue
+            return time.monotonic() - t0
+    except (asyncio.TimeoutError,OSError):
+        return None
+    finally:
+        sock.close()
+
+async def tcp_connect(address,port,timeout):
+    '''
+    try to open a TCP connection
+    return the time to get an answer in seconds (connection accepted or refused), or None if there was no answer
+    '''
+    t0 = time.monotonic()
+    try:
+        reader,writer = await asyncio.wait_for(asyncio.open_connection(address,port),timeout)
+    except ConnectionRefusedError:
+        return time.monotonic() - t0
+    except (asyncio.TimeoutError,OSError):
+        return None
+    rtt = time.monotonic() - t0
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except:
+        pass
+    return rtt
+
+async def probe_host(host,count=3,timeout=1.0,interval=0.2,method=None,ports=None):
+    '''
+    probe one host with count attempts
+
+    Arguments:
+
+    host: hostname or IP address
+    count: the number of attempts
+    timeout: the time in seconds to wait for each answer
+    interval: the time in seconds between attempts
+    method: 'icmp' or 'tcp'.  Default is ICMP if permitted, otherwise TCP
+    ports: the TCP ports to try
+    '''
+    if ports is None: ports = default_tcp_ports
+    if method is None:
+        if icmp_is_permitted():
+            method = 'icmp'
+        else:
+            method = 'tcp'
+
+    result = {}
+    result['host'] = host
+    result['address'] = None
+    result['method'] = method
+    result['sent'] = 0
+    result['received'] = 0
+    result['loss'] = 100.0
+    result['rtt'] = []
+    result['rtt min'] = None
+    result['rtt mean'] = None
+    result['rtt max'] = None
+    result['ok'] = False
+    result['error_message'] = ''
+
+    loop = asyncio.get_running_loop()
+    try:
+        addrinfo = await asyncio.wait_for(loop.getaddrinfo(host,None,family=socket.AF_INET),timeout)
+        result['address'] = addrinfo[0][4][0]
+    except:
+        result['error_message'] = 'Could not resolve %s' % host
+        return result
+
+    for seq in range(count):
+        if seq>0: await asyncio.sleep(interval)
+        result['sent'] += 1
+        if method=='icmp':
+            rtt = await icmp_echo(result['address'],seq+1,timeout)
+        else:
+            rtt = None
+            for port in ports:
+                rtt = await tcp_connect(result['address'],port,timeout)
+                if rtt is not None: break
+        if rtt is None: continue
+        result['received'] += 1
+        result['rtt'].append(rtt)
+
+    result['loss'] = 100.0*(result['sent'] - result['received'])/result['sent']
+    if result['received']>0:
+        result['rtt min'] = min(result['rtt'])
+        result['rtt mean'] = float(np.mean(result['rtt']))
+        result['rtt max'] = max(result['rtt'])
+
+    if result['received']==0:
+        result['error_message'] = 'unreachable'
+    elif result['loss']>0:
+        result['error_message'] = 'Unstable network'
+    else:
+        result['ok'] = True
+    return result
+
+async def probe_hosts_async(hosts,count=3,timeout=1.0,interval=0.2,method=None,ports=None):
+    '''
+    probe all the hosts at the same time
+    '''
+    if method is None:
+        if icmp_is_permitted():
+            method = 'icmp'
+        else:
+            method = 'tcp'
+    tasks = [probe_host(host,count=count,timeout=timeout,interval=interval,method=method,ports=ports) for host in hosts]
+    results = await asyncio.gather(*tasks)
+    retval = {}
+    for host,result in zip(hosts,results):
+        retval[host] = result
+    return retval
+
+def probe_hosts(hosts=None,count=3,timeout=1.0,interval=0.2,method=None,ports=None):
+    '''
+    probe the hosts and return a dictionary of results for each host
+    the total time is about count*(timeout+interval) regardless of the number of hosts
+
+    hosts: list of hostnames or IP addresses.  Default is all the known hosts (see utilities.get_known_hosts)
+    the other arguments are given to probe_host()
+    '''
+    if hosts is None:
+        from qubichk.utilities import get_known_hosts
+        hosts = list(get_known_hosts().keys())
+    return asyncio.run(probe_hosts_async(hosts,count=count,timeout=timeout,interval=interval,method=method,ports=ports))
+
+def write_probe_log(results,filename=None):
+    '''
+    append the probe results to a log file, one line per host
+    the columns are: timestamp host address method sent received loss rtt_min rtt_mean rtt_max (milliseconds)
+    '''
+    if filename is None:
+        from qubichk.utilities import assign_logfile
+        filename = assign_logfile('netprobe.txt')
+    if filename is None: return None
+
+    tstamp = utcnow().timestamp()
+    lines = []
+    for host in results.keys():
+        result = results[host]
+        rtt_cols = []
+        for key in ['rtt min','rtt mean','rtt max']:
+            if result[key] is None:
+                rtt_cols.append('nan')
+            else:
+                rtt_cols.append('%.3f' % (1000*result[key]))
+        lines.append('%.3f %s %s %s %i %i %.1f %s' % (tstamp,
+                                                      host,
+                                                      result['address'],
+                                                      result['method'],
+                                                      result['sent'],
+                                                      result['received'],
+                                                      result['loss'],
+                                                      ' '.join(rtt_cols)))
+    h = open(filename,'a')
+    h.write('\n'.join(lines)+'\n')
+    h.close()
+    return filename
@@ -14,14 +14,13 @@ This is the QUBIC Telegram bot
 https://web.telegram.org/#/im?p=@QUBIC_bot
 
 '''
-import sys,os,re,time,inspect,urllib
+import sys,os,re,io,time,inspect,urllib,threading,tempfile
 import datetime as dt
-from glob import glob
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 import matplotlib
 matplotlib.use('Agg')
-from matplotlib import pyplot as plt
 
 from satorchipy.datefunctions import str2dt,utcnow, utcfromtimestamp
 from qubichw.calsource_configuration_manager import calsource_configuration_manager
@@ -31,7 +30,11 @@ from qubichk.send_telegram import get_botId,get_TelegramAddresses, get_alarm_rec
 from qubichk.utilities import get_fullpath
 from qubichk.ups import get_ups_info
 from qubichk.utilities import shellcommand
+from qubichk.hk_freshness import get_freshness_index
 from qubichk.scripts.show_hk import list_hk
+from qubichk.hk_plot import render_plot, figure_cache, default_figsize, default_dpi
+from qubichk.hk_pyramid import hk_pyramid
+from qubichk.entropy_catalog import entropy_catalog
 
 class dummy_bot:
     '''
@@ -61,12 +64,96 @@ class dummy_bot:
         return
 
 
+class bot_worker_pool:
+    '''
+    execute the bot commands in worker threads so that a slow command does not block the other users
+
+    Fast commands go to the priority lane and are executed right away.
+    Heavy commands (plots, photos, calsource) go to a separate, bounded queue.
+    An identical request from the same chat that is already waiting in the queue is not added again.
+
+    Arguments:
+
+    execute: the function which executes a request
+    nfast: the number of workers in the priority lane
+    nheavy: the number of workers for heavy commands
+    max_pending: the maximum number of heavy requests waiting or running
+    '''
+
+    def __init__(self,execute,nfast=4,nheavy=2,max_pending=10):
+        self.execute = execute
+        self.max_pending = max_pending
+        self.fast_pool = ThreadPoolExecutor(max_workers=nfast,thread_name_prefix='bot_fast')
+        self.heavy_pool = ThreadPoolExecutor(max_workers=nheavy,thread_name_prefix='bot_heavy')
+        self.pending = {}
+        self.lock = threading.Lock()
+        return None
+
+    def submit(self,request,heavy=False):
+        '''
+        add a request to the priority lane or the heavy queue
+        return a status and the number of heavy requests ahead of this one
+        status is 'fast', 'queued', 'duplicate', or 'full'
+        '''
+        if not heavy:
+            self.fast_pool.submit(self.run,request)
+            return 'fast',0
+
+        key = (request['chat_id'],request['text'])
+        with self.lock:
+            if key in self.pending and not self.pending[key]['started']:
+                return 'duplicate',len(self.pending)-1
+            if len(self.pending)>=self.max_pending:
+                return 'full',len(self.pending)
+            nahead = len(self.pending)
+            request['started'] = False
+            self.pending[key] = request
+        self.heavy_pool.submit(self.run_heavy,key,request)
+        return 'queued',nahead
+
+    def run(self,request):
+        '''
+        execute a request
+        '''
+        request['start'] = time.time()
+        try:
+            self.execute(request)
+        except:
+            # the execute function reports its own errors.  This is just to keep the worker alive
+            pass
+        return
+
+    def run_heavy(self,key,request):
+        '''
+        execute a request from the heavy queue
+        '''
+        with self.lock:
+            request['started'] = True
+        try:
+            self.run(request)
+        finally:
+            with self.lock:
+                if self.pending.get(key) is request: del(self.pending[key])
+        return
+
+    def shutdown(self,wait=True):
+        '''
+        stop the workers after the pending requests are finished
+        '''
+        self.fast_pool.shutdown(wait=wait)
+        self.heavy_pool.shutdown(wait=wait)
+        return
+
+
 class qubic_bot :
     '''
     a class to send QUBIC housekeeping information via Telegram
     '''
 
     def __init__(self,test=False,idfile=None):
+        # chat_id and args are specific to each request, which are executed in worker threads
+        self.context = threading.local()
+        self.default_chat_id = 0xFFFFFFFF
         self.TESTMODE=test
         self.botId=None
         self.bot=None
@@ -115,6 +202,23 @@ class qubic_bot :
                          '/hk': self.list_hk
                          }
 
+        # commands which can take a long time go in the heavy queue (see bot_worker_pool)
+        self.heavy_commands = ['/calsource',
+                               '/photo',
+                               '/photo2',
+                               '/photo3',
+                               '/photo4',
+                               '/plot',
+                               '/entropy_plotall',
+                               '/plot300mkzoom',
+                               '/plot300mk',
+                               '/plot1k',
+                               '/hk']
+        # the calsource manager listens on a fixed port, so only one request at a time
+        self.command_locks = {'/calsource': threading.Lock()}
+        self.workers = bot_worker_pool(self._execute)
+        self.figures = figure_cache()
+
 
         self.temperature_headings = ['40K filters',
                                      '40K sd',
@@ -135,6 +239,7 @@ class qubic_bot :
                                      '1K-4HS-D-1',
                                      '1K-4CP-D-1']
 
+        self.entropy = entropy_catalog()
         self._assign_entropy_labels()
         self._assign_heater_labels()
 
@@ -158,6 +263,7 @@ class qubic_bot :
         else:
             homedir = '/home/qubic'
         self.hk_dir = homedir+'/data/temperature/broadcast'
+        self.pyramid = hk_pyramid(self.hk_dir)
 
         # this is not used since we implemented HK socket broadcasting 20181212
         self.temperature_log_dir = homedir+'/data/temperature/data/log_cryo/dirfile_cryo_current'
@@ -179,7 +285,7 @@ class qubic_bot :
         if self.TESTMODE:
             print('running in test mode')
             self.bot=dummy_bot()
-            self.chat_id=0            
+            self.default_chat_id=0            
         else:
             import telepot
             self.bot = telepot.Bot(self.botId)
@@ -192,7 +298,34 @@ class qubic_bot :
         start the listening loop
         '''
         self.bot.message_loop(self._respuesta, run_forever=True)
-        
+
+        # the dummy bot returns after one command.  Wait for it to finish.
+        self.workers.shutdown(wait=True)
+        return
+
+    @property
+    def chat_id(self):
+        '''
+        the chat for the request being executed in this thread
+        '''
+        return getattr(self.context,'chat_id',self.default_chat_id)
+
+    @chat_id.setter
+    def chat_id(self,chat_id):
+        self.context.chat_id = chat_id
+        return
+
+    @property
+    def args(self):
+        '''
+        the arguments for the request being executed in this thread
+        '''
+        if not hasattr(self.context,'args'): self._init_args()
+        return self.context.args
+
+    @args.setter
+    def args(self,args):
+        self.context.args = args
         return
 
     def _init_args(self):
@@ -257,11 +390,20 @@ class qubic_bot :
         latest_date = utcfromtimestamp(0)
         fmt_str = '\n%%%is:  %%7.3fK' % self.temperature_heading_maxlen
         answer = 'Temperatures:'
+        # the latest values are in the index maintained by the HK logger, if it exists (see hk_freshness.py)
+        index = get_freshness_index(self.hk_dir)
         for ch_idx in self.temperature_display_order:
             basename = 'TEMPERATURE%02i.txt' % (ch_idx+1)
             fullname = '%s/%s' % (self.hk_dir,basename)
-            if not os.path.isfile(fullname):
+            vals = None
+            if index is not None: vals = index.read(basename)
+            if vals is not None:
+                tstamp = self.timestamp_factor*vals[0]
+                reading = vals[1]
+                
+            elif not os.path.isfile(fullname):
                 answer += '\n%s:\tno data' % self.temperature_headings[ch_idx]
+                continue
             
             else:
                 h = open(fullname,'rb')
@@ -269,50 +411,73 @@ class qubic_bot :
                 if nbytes < 35:
                     h.close()
                     answer += '\n%s:\tinsufficient data' % self.temperature_headings[ch_idx]
-                else:
-                    h.seek(-35,os.SEEK_END)
-                    lines = h.read().decode().split('\n')
-                    h.close()
-                    lastline = lines[-2]
-                    cols = lastline.split()
-                    tstamp = self.timestamp_factor*float(cols[0])
-                    reading_date = utcfromtimestamp(tstamp)
-                    if reading_date > latest_date:
-                        latest_date = reading_date
-                    reading = eval(cols[1])
-                    answer += fmt_str % (self.temperature_headings[ch_idx],reading)
+                    continue
+                h.seek(-35,os.SEEK_END)
+                lines = h.read().decode().split('\n')
+                h.close()
+                lastline = lines[-2]
+                cols = lastline.split()
+                tstamp = self.timestamp_factor*float(cols[0])
+                reading = eval(cols[1])
+
+            reading_date = utcfromtimestamp(tstamp)
+            if reading_date > latest_date:
+                latest_date = reading_date
+            answer += fmt_str % (self.temperature_headings[ch_idx],reading)
+        if index is not None: index.close()
 
         answer += '\n\nTime: %s' % latest_date.strftime(self.time_fmt)    
         self._send_message(answer)
         return
 
-    def temp_hk_data(self,ch=1):
+    def hk_series(self,basename,dmin=None,dmax=None):
         '''
-        return the date,temperature data from the Housekeeping broadcast
+        return the timestamp,value arrays from a Housekeeping file between the dates dmin and dmax
+        for a long time range, the summary from the HK pyramid is used instead of all the samples
         '''
-        basename = 'TEMPERATURE%02i.txt' % ch
         fullname = '%s/%s' % (self.hk_dir,basename)
         if not os.path.isfile(fullname):
             return None,None
+        t,v = self.hk_summary_series(basename,dmin,dmax)
+        if t is not None: return t,v
+        t,v,off = self.read_hk_window(fullname,dmin,dmax)
+        if len(t)==0: return None,None
+        return t,v
 
-        h = open(fullname,'r')
-        lines = h.read().split('\n')
-        h.close()
-        del(lines[-1])
-        t=[]
-        v=[]
-        for line in lines:
-            cols = line.split()
-            try:
-                tstamp = self.timestamp_factor*float(cols[0])
-                reading_date = utcfromtimestamp(tstamp)
-                reading = eval(cols[1])
-                t.append(reading_date)
-                v.append(reading)
-            except:
-                pass
+    def hk_summary_series(self,basename,dmin=None,dmax=None):
+        '''
+        return the minimum and maximum of each bin of the HK pyramid (see hk_pyramid.py)
+        the bins are not larger than one pixel of the plot.  The data since the last update of the pyramid is read from the HK file
+        return None,None if the time range is too short, or there is no pyramid for this file
+        '''
+        first,last = self.pyramid.extent(basename)
+        if first is None: return None,None
+        tmin = self.date2tstamp(dmin)
+        tmax = self.date2tstamp(dmax)
+        if tmin is None: tmin = first
+        if tmax is None: tmax = max(last,time.time())
+        if tmax<=tmin: return None,None
+        npixels = default_figsize[0]*default_dpi
+        bins,step = self.pyramid.query(basename,tmin,tmax,(tmax-tmin)/npixels)
+        if bins is None or len(bins)==0: return None,None
+        t = np.repeat(bins['tstart'],2)
+        v = np.column_stack((bins['min'],bins['max'])).ravel()
+        if tmax>last:
+            fullname = '%s/%s' % (self.hk_dir,basename)
+            t_new,v_new,off = self.read_hk_window(fullname,utcfromtimestamp(last),dmax)
+            t = np.concatenate((t,t_new))
+            v = np.concatenate((v,v_new))
         return t,v
 
+    def temp_hk_data(self,ch=1,dmin=None,dmax=None):
+        '''
+        return the date,temperature data from the Housekeeping broadcast
+        '''
+        t,v = self.hk_series('TEMPERATURE%02i.txt' % ch,dmin,dmax)
+        if t is None: return None,None
+        dates = [utcfromtimestamp(tstamp) for tstamp in t]
+        return dates,list(v)
+
     def _assign_heater_labels(self):
         ''' read user supplied labels corresponding to HEATER1, HEATER2, etc
         '''
@@ -381,10 +546,98 @@ class qubic_bot :
         self._send_message(answer)
         return
 
-    def heater_hk_data(self,ch):
+    def date2tstamp(self,date):
+        '''
+        convert a date to a timestamp.  A date without timezone is UT
+        '''
+        if date is None: return None
+        if date.tzinfo is None: date = date.replace(tzinfo=dt.timezone.utc)
+        return date.timestamp()
+
+    def seek_hk_file(self,h,fsize,tstamp):
+        '''
+        find the position in a HK file of the first line at or after the given timestamp
+        the HK files are in chronological order, so we do a binary search on the file position
+        '''
+        lo = 0
+        hi = fsize
+        while hi - lo > 1024:
+            mid = (lo + hi)//2
+            h.seek(mid)
+            h.readline() # skip the partial line
+            pos = h.tell()
+            line = h.readline()
+            try:
+                line_tstamp = self.timestamp_factor*float(line.split()[0])
+            except:
+                # end of file or bad line: search below
+                hi = mid
+                continue
+            if line_tstamp < tstamp:
+                lo = pos
+            else:
+                hi = mid
+        return lo
+
+    def read_hk_window(self,filename,dmin=None,dmax=None):
+        '''
+        read the timestamps, values, and OFF status from a HK file between the dates dmin and dmax
+        only the requested part of the file is read
+        '''
+        tmin = self.date2tstamp(dmin)
+        tmax = self.date2tstamp(dmax)
+
+        h = open(filename,'rb')
+        fsize = h.seek(0,os.SEEK_END)
+        if tmin is None:
+            pos = 0
+        else:
+            pos = self.seek_hk_file(h,fsize,tmin)
+        h.seek(pos)
+        lines = h.read().decode(errors='replace').split('\n')
+        h.close()
+
+        tstamps = []
+        vals = []
+        off = []
+        for line in lines:
+            cols = line.split()
+            if len(cols)<2: continue
+            try:
+                tstamp = self.timestamp_factor*float(cols[0])
+                val = float(cols[1])
+            except:
+                continue
+            if tmin is not None and tstamp<tmin: continue
+            if tmax is not None and tstamp>tmax: break
+            tstamps.append(tstamp)
+            vals.append(val)
+            off.append(len(cols)==3 and cols[2]=='OFF')
+
+        tstamps = np.array(tstamps)
+        vals = np.array(vals)
+        off = np.array(off,dtype=bool)
+        if len(tstamps)>1 and (np.diff(tstamps)<0).any():
+            order = np.argsort(tstamps,kind='stable')
+            tstamps = tstamps[order]
+            vals = vals[order]
+            off = off[order]
+        return tstamps,vals,off
+
+    def heater_hk_data(self,ch,dmin=None,dmax=None):
         '''
         return the date,power data from the heaters (power supplies)
         '''
+        t,power = self.heater_power(ch,dmin,dmax)
+        if t is None: return None,None
+        dates = [utcfromtimestamp(tstamp) for tstamp in t]
+        return dates,list(power)
+
+    def heater_power(self,ch,dmin=None,dmax=None):
+        '''
+        return the timestamp,power arrays from the heaters (power supplies)
+        the power is the voltage times the mean of the currents measured within 1 second of the voltage
+        '''
         basename_volt = 'HEATER%i_Volt.txt' % ch
         fullname_volt = '%s/%s' % (self.hk_dir,basename_volt)
         if not os.path.isfile(fullname_volt):
@@ -396,72 +649,37 @@ class qubic_bot :
             print('Could not find file: %s' % fullname_amp)
             return None,None
 
-
-        #print('Reading Heater files:\n  %s\n  %s' % (fullname_volt,fullname_amp))
-
-        power = []
-        # read voltages
-        h = open(fullname_volt,'r')
-        lines = h.read().split('\n')
-        h.close()
-        del(lines[-1])
-        
-        t_volt=[]
-        volt=[]
-        for line in lines:
-            cols = line.split()
-            try:
-                tstamp = self.timestamp_factor*float(cols[0])
-                t_volt.append(tstamp)
-                reading = eval(cols[1])
-                volt.append(reading)
-                power.append(-1)
-                if len(cols)==3:
-                    status = cols[2]
-                    if status=='OFF':
-                        volt[-1] = 0.0
-                        power[-1] = 0.0
-            except:
-                print("Couldn't interpret data:  %s" % line)
-
-        # read currents
-        h = open(fullname_amp,'r')
-        lines = h.read().split('\n')
-        h.close()
-        del(lines[-1])
-
-        t_amp=[]
-        amp=[]
-        for line in lines:
-            cols = line.split()
-            try:
-                tstamp = self.timestamp_factor*float(cols[0])
-                t_amp.append(tstamp)
-                reading = eval(cols[1])
-                amp.append(reading)
-                if len(cols)==3:
-                    status = cols[2]
-                    if status=='OFF':
-                        amp[-1]=0.0
-            except:
-                #print("Couldn't interpret data:  %s" % line)
-                pass
-        amp = np.array(amp)
-
-
-        t = np.array(t_volt)
-        dates = []
-        for idx,tstamp in enumerate(t):
-            dates.append(utcfromtimestamp(tstamp))
-            p = power[idx]
-            if p==-1:
-                v = volt[idx]
-                i_indexes = np.where( (t>tstamp-1)*(t<tstamp+1) )
-                #print('indexes = %s' % i_indexes)
-                i_avg = amp[i_indexes].mean()
-                power[idx] = i_avg*v                                         
-        
-        return dates,power
+        # read one extra second of current on each side of the window
+        if dmin is None:
+            amp_dmin = None
+        else:
+            amp_dmin = dmin - dt.timedelta(seconds=1)
+        if dmax is None:
+            amp_dmax = None
+        else:
+            amp_dmax = dmax + dt.timedelta(seconds=1)
+        t_volt,volt,volt_off = self.read_hk_window(fullname_volt,dmin,dmax)
+        t_amp,amp,amp_off = self.read_hk_window(fullname_amp,amp_dmin,amp_dmax)
+        if len(t_volt)==0: return None,None
+
+        volt[volt_off] = 0.0
+        amp[amp_off] = 0.0
+
+        # mean current within 1 second of each voltage measurement, using the cumulative sum
+        amp_cumsum = np.concatenate(([0.0],np.cumsum(amp)))
+        idx_lo = np.searchsorted(t_amp,t_volt-1,side='right')
+        idx_hi = np.searchsorted(t_amp,t_volt+1,side='left')
+        npts = idx_hi - idx_lo
+        amp_sum = amp_cumsum[idx_hi] - amp_cumsum[idx_lo]
+        amp_mean = np.full(len(t_volt),np.nan)
+        has_amp = npts>0
+        amp_mean[has_amp] = amp_sum[has_amp]/npts[has_amp]
+
+        power = amp_mean*volt
+        power[volt_off] = 0.0
+        ok = np.isfinite(power)
+        if not ok.any(): return None,None
+        return t_volt[ok],power[ok]
 
     
     def read_mech(self):
@@ -550,32 +768,14 @@ class qubic_bot :
         self._send_message(answer)
         return
 
-    def pressure_hk_data(self,ch=1):
+    def pressure_hk_data(self,ch=1,dmin=None,dmax=None):
         '''
         return the data,pressure data
         '''
-        basename = 'PRESSURE%i.txt' % ch
-        fullname = '%s/%s' % (self.hk_dir,basename)
-        if not os.path.isfile(fullname):
-            return None,None
-
-        h = open(fullname,'r')
-        lines = h.read().split('\n')
-        h.close()
-        del(lines[-1])
-        t=[]
-        v=[]
-        for line in lines:
-            cols = line.split()
-            try:
-                tstamp = self.timestamp_factor*float(cols[0])
-                reading_date = utcfromtimestamp(tstamp)
-                reading = eval(cols[1])
-                t.append(reading_date)
-                v.append(reading)
-            except:
-                pass
-        return t,v
+        t,v = self.hk_series('PRESSURE%i.txt' % ch,dmin,dmax)
+        if t is None: return None,None
+        dates = [utcfromtimestamp(tstamp) for tstamp in t]
+        return dates,list(v)
     
     def photo(self,camnum):
         '''
@@ -589,31 +789,40 @@ class qubic_bot :
         return
     
 
+    def _snapshot(self,host):
+        '''
+        take a picture with the webcam on a Raspberry Pi and send it
+        each request has its own file, so two requests at the same time do not get mixed up
+        '''
+        cmd='ssh %s ./snapshot.sh' % host
+        out,err = shellcommand(cmd)
+        fd,filename = tempfile.mkstemp(prefix='webcamshot_',suffix='.jpg')
+        os.close(fd)
+        try:
+            cmd='scp -p %s:webcamshot.jpg %s' % (host,filename)
+            out,err = shellcommand(cmd)
+            if os.path.getsize(filename)==0:
+                self._send_message('Sorry, could not get the picture from %s' % host)
+                return
+            with open(filename,'rb') as photo:
+                self._send_photo(photo)
+        finally:
+            os.remove(filename)
+        return
+
     def photo1(self):
         '''
         take a picture of the APC QUBIC Integration Lab
         with the webcam near the calibration source
         '''
-        cmd='ssh pigps ./snapshot.sh'
-        out,err = shellcommand(cmd)
-        cmd='scp -p pigps:webcamshot.jpg .'
-        out,err = shellcommand(cmd)
-        with open('webcamshot.jpg','rb') as photo:
-            if photo is not None: self._send_photo(photo)
-        return
+        return self._snapshot('pigps')
 
     def photo2(self):
         '''
         take a picture of the APC QUBIC Integration Lab
         with the webcam on the electronics rack
         '''
-        cmd='ssh pitemps ./snapshot.sh'
-        out,err = shellcommand(cmd)
-        cmd='scp -p pitemps:webcamshot.jpg .'
-        out,err = shellcommand(cmd)
-        with open('webcamshot.jpg','rb') as photo:
-            if photo is not None: self._send_photo(photo)
-        return
+        return self._snapshot('pitemps')
 
     def webcam(self,camname):
         '''
@@ -649,20 +858,11 @@ class qubic_bot :
         '''
         find the location of the most recent temperature data
         '''
-        entropy_dir='/entropy/logs'
-    
-        if not os.path.exists(entropy_dir):
+        tempdir = self.entropy.latest_dir()
+        if tempdir is None:
             answer='Cannot read the temperatures on Entropy'
             self._send_message(answer)
             return None
-
-        dlist=[]
-        for r,d,f in os.walk(entropy_dir):
-            if r!=entropy_dir:
-                dlist.append(r)
-
-        dlist.sort(key=os.path.getmtime)
-        tempdir=dlist[-1]
         return tempdir
 
 
@@ -686,17 +886,11 @@ class qubic_bot :
                 
         # read the configured labels
         self.entropy_nchannels=0
-        filelist=glob(tempdir+'/*')
-        match_str = '.* AVS47 (AVS47_[12]) Ch ([0-7]) '
-        for f in filelist:
-            chan_str = re.sub('\.log','',os.path.basename(f))
-            match = re.match(match_str,chan_str)
-            chan_str = re.sub(match_str,'',chan_str)
-            if match:
-                avs=match.group(1)
-                ch=eval(match.group(2))
-                self.entropy_channel_title[avs][ch]=chan_str
-                self.entropy_nchannels+=1
+        for entry in self.entropy.files():
+            if entry['channel'] is None: continue
+            avs = 'AVS47_%i' % entry['controller']
+            self.entropy_channel_title[avs][entry['channel']]=entry['label']
+            self.entropy_nchannels+=1
                                 
 
         # debug message
@@ -716,34 +910,12 @@ class qubic_bot :
         latest_date = utcfromtimestamp(0)
     
         answer_list = []
-        filelist=glob(tempdir+'/*')
-        for f in filelist:
-            chan_str = re.sub('\.log','',os.path.basename(f))
-            chan_str = re.sub('.* AVS47 AVS47_[12] Ch [0-7] ','',chan_str)
-            h = open(f,'rb')
-            dat = h.read()
-            h.close()
-            del(h)
-            try:
-                lines = dat.decode('iso-8859-1').split('\n')
-            except:  # hack in case iso-8859-1 is not correct
-                lines = str(dat).replace('\\t','\t').replace('\\r','').split('\\n')
-                            
-
-            for line in lines:
-                if line.find('#Log session timestamp:')==0:
-                    # get start time from header
-                    tstart_str=line.replace('#Log session timestamp:','')
-                    try:
-                        tstart=eval(tstart_str)*1e-3 
-                    except:
-                        tstart=-1
-                    break
-        
-            lastline=lines[-2]
-            cols=lastline.split()
-            val=float(cols[1])
-            if len(cols)==3:
+        for entry in self.entropy.files():
+            chan_str = entry['label']
+            latest = self.entropy.latest(entry['filename'])
+            if latest is None: continue
+            tstamp,val,ncols = latest
+            if ncols==3:
                 if val<1:
                     fmt_str = '%s : %.1f mK'
                     val *= 1000
@@ -753,7 +925,6 @@ class qubic_bot :
             else:
                 tempans='%s : %.4f Ohm' % (chan_str,val)        
 
-            tstamp = 1e-3*eval(cols[0]) + tstart
             reading_date = utcfromtimestamp(tstamp)
             if reading_date > latest_date:
                 latest_date = reading_date
@@ -779,59 +950,23 @@ class qubic_bot :
         '''
         read a temperature log file produced by Entropy
         '''
-        if not os.path.exists(filename):
-            print('file not found: %s' % filename)
-            return None,None
-        if not os.path.isfile(filename):
-            print('this is not a file: %s' % filename)
-            return None,None
-
-        h=open(filename,'rb')
-        dat = h.read()
-        h.close()
-        try:
-            lines = dat.decode('iso-8859-1').split('\n')
-        except:  # hack in case iso-8859-1 is not correct
-            lines = str(dat).replace('\\t','\t').replace('\\r','').split('\\n')
-
-        # go through the lines
-        t=[]
-        val=[]
-        for line in lines:
-            if line.find('#')!=0:
-                cols=line.split()
-                try:
-                    tt=eval(cols[0])*1e-3
-                    yy=eval(cols[1])
-                    t.append(tt)
-                    val.append(yy)
-                
-                except:
-                    #print('DEBUG: unable to interpret: %s' % line)
-                    pass
-            elif line.find('#Log session timestamp:')==0:
-                # get start time from header
-                tstart_str=line.replace('#Log session timestamp:','')
-                try:
-                    tstart=eval(tstart_str)*1e-3
-                except:
-                    tstart=-1
-
-        #print('DEBUG: tstart = %f' % tstart)
-        t=np.array(t)
-        #print(t)
-        val=np.array(val)
-        #print(val)
-        tdate=[]
+        t,val,tstart = self.read_entropy_arrays(filename)
+        if t is None: return None,None
         if tstart>0:
-            t+=tstart
-            for tstamp in t:
-                tdate.append(utcfromtimestamp(tstamp))
+            tdate = [utcfromtimestamp(tstamp) for tstamp in t]
         else:
-            tdate=t
-
+            tdate = t
         return tdate,val
 
+    def read_entropy_arrays(self,filename):
+        '''
+        read a temperature log file produced by Entropy
+        return the timestamps, the values, and the session start time
+        if the session start time is not known, the times are relative to the start of the session
+        only the lines added since the last time the file was read are parsed (see entropy_catalog.py)
+        '''
+        return self.entropy.read(filename)
+
     def tempall(self):
         '''
         print out all the temperatures
@@ -844,30 +979,38 @@ class qubic_bot :
     def plot_temperature(self,t,v,title,dmin=None,dmax=None,Tmin=None,Tmax=None,logscale=False):
         '''
         make a quick plot of the temperature cooldown/warmup
-        '''
-
-        plt.ioff()
-        fig=plt.figure(figsize=(20.48,7.68))
-        plt.plot(t,v,ls='none',marker='D')
-        ax=fig.axes[0]
-        if Tmin is None:Tmin=min(v)
-        if Tmax is None:Tmax=max(v)
-        if dmin is None:dmin=t[0]
-        if dmax is None:dmax=t[-1]
-        ax.set_ylim(Tmin,Tmax)
-        ax.set_xlim(dmin,dmax)
-        
-        
-        ax.set_xlabel('date',fontsize=self.labelsize)
-        ax.set_ylabel('temperature / K',fontsize=self.labelsize)
-        ax.tick_params(labelsize=self.labelsize)
-        fig.suptitle(title,fontsize=self.labelsize)
-        savefig_fmt='png'
-        fig.savefig('temperature_plot.'+savefig_fmt,format=savefig_fmt,dpi=100,bbox_inches='tight')
-    
-        plt.close()
+        t can be a list of dates or an array of timestamps
+        return the PNG image
+        '''
+        png = render_plot([(t,v,None)],
+                          title=title,
+                          ylabel='temperature / K',
+                          dmin=dmin,
+                          dmax=dmax,
+                          ymin=Tmin,
+                          ymax=Tmax,
+                          logscale=logscale,
+                          labelsize=self.labelsize,
+                          legend=False)
+        return png
+
+    def _send_png(self,png,name='hk_plot.png'):
+        '''
+        send a PNG image from memory
+        '''
+        img = io.BytesIO(png)
+        img.name = name
+        self._send_photo(img)
         return
 
+    def entropy_channel_file(self,controller=1,channel=1):
+        '''
+        find the log file for one of the Entropy temperature sensors
+        '''
+        entry = self.entropy.find(controller,channel)
+        if entry is None: return None
+        return entry['filename']
+
     def entropy_plot_channel(self,controller=1,channel=1,dmin=None,dmax=None,Tmin=None,Tmax=None,logscale=False):
         '''
         plot a given channel
@@ -875,28 +1018,19 @@ class qubic_bot :
         tempdir=self.entropy_latest_temperature_dir()
         if tempdir is None:return None
 
-        filename=''
-        find_str='.* AVS47_%i Ch (%i)' % (controller,channel)
-
-        filelist=glob(tempdir+'/*')
-        for f in filelist:
-            match=re.match(find_str,f)
-            if match:
-                filename=f
-                break
+        filename=self.entropy_channel_file(controller,channel)
 
         avs = 'AVS47_%i' % controller
         print('DEBUG: filename=%s' % filename)
-        t,v=self.read_entropy_logfile(filename)
-        if t is None:
+        t,v,tstart=self.read_entropy_arrays(filename)
+        if t is None or len(t)==0:
             answer='No MACRT temperatures on Entropy'
             self._send_message(answer)
             return answer
 
-        result=self.plot_temperature(t,v,self.entropy_channel_title[avs][channel],
-                                     dmin=dmin,dmax=dmax,Tmin=Tmin,Tmax=Tmax,logscale=logscale)
-        with open('temperature_plot.png','rb') as plot:
-            self.bot.sendPhoto(self.chat_id,plot)
+        png=self.plot_temperature(t,v,self.entropy_channel_title[avs][channel],
+                                  dmin=dmin,dmax=dmax,Tmin=Tmin,Tmax=Tmax,logscale=logscale)
+        self._send_png(png,'temperature_plot.png')
         return
 
     def entropy_channel_data(self,controller=1,channel=1):
@@ -906,18 +1040,27 @@ class qubic_bot :
         tempdir=self.entropy_latest_temperature_dir()
         if tempdir is None:return None,None
 
-        filename=''
-        find_str='.* AVS47_%i Ch (%i)' % (controller,channel)
-
-        filelist=glob(tempdir+'/*')
-        for f in filelist:
-            match=re.match(find_str,f)
-            if match:
-                filename=f
-                break
+        filename=self.entropy_channel_file(controller,channel)
 
         t,v = self.read_entropy_logfile(filename)
         return t,v
+
+    def entropy_channel_series(self,controller=1,channel=1,dmin=None,dmax=None):
+        '''
+        get the timestamp,temperature arrays from one of the Entropy temperature sensors between the dates dmin and dmax
+        '''
+        tempdir=self.entropy_latest_temperature_dir()
+        if tempdir is None:return None,None
+
+        filename=self.entropy_channel_file(controller,channel)
+
+        t,v,tstart = self.read_entropy_arrays(filename)
+        if t is None or tstart<=0: return None,None
+        inwindow = np.ones(len(t),dtype=bool)
+        if dmin is not None: inwindow &= t>=self.date2tstamp(dmin)
+        if dmax is not None: inwindow &= t<=self.date2tstamp(dmax)
+        if not inwindow.any(): return None,None
+        return t[inwindow],v[inwindow]
         
 
 
@@ -940,35 +1083,27 @@ class qubic_bot :
         tempdir=self.entropy_latest_temperature_dir()
         if tempdir is None:return None
         channel=2
-        filename=''
-        find_str='.*(AVS47_[12]) Ch (%i)' % channel
-        filelist=glob(tempdir+'/*')
-        for f in filelist:
-            match=re.match(find_str,f)
-            if match:
-                filename=f
-                avs = match.groups()[0]
-                break
-
+        entry = self.entropy.find(channel=channel)
+        if entry is None:
+            answer='No AVS47 temperatures on Entropy'
+            self._send_message(answer)
+            return answer
+        avs = 'AVS47_%i' % entry['controller']
 
-        t,v=self.read_entropy_logfile(filename)
-        if t is None:
+        t,v,tstart=self.read_entropy_arrays(entry['filename'])
+        if t is None or len(t)==0:
             answer='No AVS47 temperatures on Entropy'
             self._send_message(answer)
             return answer
 
-        dmax=t[-1]
-        dmin=dmax-dt.timedelta(minutes=60)
-        for idx,dd in enumerate(t):
-            if dd>dmin:
-                imin=idx
-                break
-        Tmin=min(v[imin:])
-        Tmax=max(v[imin:])
+        tmax=t[-1]
+        tmin=tmax-3600
+        imin=np.searchsorted(t,tmin,side='right')
+        Tmin=v[imin:].min()
+        Tmax=v[imin:].max()
     
-        result=self.plot_temperature(t,v,self.entropy_channel_title[avs][channel],dmin,dmax,Tmin,Tmax)
-        with open('temperature_plot.png','rb') as plot:
-            self._send_photo(plot)
+        png=self.plot_temperature(t[imin:],v[imin:],self.entropy_channel_title[avs][channel],tmin,tmax,Tmin,Tmax)
+        self._send_png(png,'temperature_plot.png')
         return
 
     def entropy_plotall(self,Tmin=None,Tmax=None):
@@ -978,38 +1113,26 @@ class qubic_bot :
         tempdir=self.entropy_latest_temperature_dir()
         if tempdir is None:return tempdir
 
-        plt.ioff()
-        fig=plt.figure(figsize=(20.48,7.68))
+        key = ('entropy_plotall',tempdir,Tmin,Tmax)
+        png = self.figures.get(key)
+        if png is not None:
+            self._send_png(png,'temperature_plot.png')
+            return
 
-        filelist=glob(tempdir+'/*')
-        Tminlist=[]
-        Tmaxlist=[]
-        for f in filelist:
-            print(f)
-            find_str='.*(AVS47_[12]) Ch ([0-%i])' % (self.entropy_nchannels-1)
-            match=re.match(find_str,f)
-            if match:
-                ch=eval(match.groups()[1])
-                t,v=self.read_entropy_logfile(f)
-                Tminlist.append(min(v))
-                Tmaxlist.append(max(v))
-                avs = match.groups()[0]
-                if t is not None:plt.plot(t,v,ls='none',marker='D',label=self.entropy_channel_title[avs][ch])
-        if Tmin is None:
-            Tmin = min(Tminlist)
-        if Tmax is None:
-            Tmax = max(Tmaxlist)
-        ax=fig.axes[0]
-        ax.set_ylim((Tmin,Tmax))
-        ax.set_xlabel('date',fontsize=self.labelsize)
-        ax.set_ylabel('temperature / K',fontsize=self.labelsize)
-        ax.tick_params(labelsize=self.labelsize)
-        fig.suptitle('Temperatures from the AVS47',fontsize=self.labelsize)
-        plt.legend(fontsize=self.labelsize)
-        fig.savefig('temperature_plot.png',format='png',dpi=100,bbox_inches='tight')
-        plt.close()
-        with open('temperature_plot.png','rb') as plot:
-            self._send_photo(plot)
+        series=[]
+        for entry in self.entropy.files():
+            if entry['channel'] is None: continue
+            t,v,tstart=self.read_entropy_arrays(entry['filename'])
+            if t is not None and len(t)>0: series.append((t,v,entry['label']))
+
+        png = render_plot(series,
+                          title='Temperatures from the AVS47',
+                          ylabel='temperature / K',
+                          ymin=Tmin,
+                          ymax=Tmax,
+                          labelsize=self.labelsize)
+        self.figures.put(key,png)
+        self._send_png(png,'temperature_plot.png')
         return
 
     def plothelp(self):
@@ -1046,26 +1169,30 @@ class qubic_bot :
             return self.plothelp()
             
 
-        something2plot = False
-        plt.ioff()
-        fig=plt.figure(figsize=(20.48,7.68))
-        tmin_list=[]
-        tmax_list=[]
-        dmin_list=[]
-        dmax_list=[]
+        dmin = self.args['DMIN']
+        dmax = self.args['DMAX']
+        key = ['plot']
+        for hktype in self.hktypes:
+            if hktype in self.args.keys(): key.append((hktype,tuple(self.args[hktype])))
+        key += [dmin,dmax,self.args['YMIN'],self.args['YMAX'],self.args['LOG']]
+        key = tuple(key)
+        png = self.figures.get(key)
+        if png is not None:
+            self._send_png(png)
+            return
+
+        # only the requested time range is read from the files
+        series = []
+        ylabel = ''
+        ttl = ''
         
         # plot temperature diodes
         for ch in self.args['TEMPERATURE']:
             ch_idx = ch-1
-            t,v=self.temp_hk_data(ch)
+            t,v=self.hk_series('TEMPERATURE%02i.txt' % ch,dmin,dmax)
             if (t is not None) and (v is not None):
-                something2plot = True
                 channel_label=self.temperature_headings[ch_idx]
-                plt.plot(t,v,ls='none',marker='D',label=channel_label)
-                tmax_list.append(max(v))
-                tmin_list.append(min(v))
-                dmax_list.append(max(t))
-                dmin_list.append(min(t))
+                series.append((t,v,channel_label))
         if self.args['TEMPERATURE']:
             ylabel = 'temperature / K'
             ttl = 'Temperatures'
@@ -1078,82 +1205,48 @@ class qubic_bot :
                 ylabel = 'temperature / K'
                 ttl = 'Temperatures'
             for ch in self.args[avs]:
-                t,v = self.entropy_channel_data(controller,ch)
+                t,v = self.entropy_channel_series(controller,ch,dmin,dmax)
                 if (t is not None) and (v is not None):
-                    something2plot = True
                     entropy_label=self.entropy_channel_title[avs][ch]
-                    plt.plot(t,v,ls='none',marker='D',label=entropy_label)                
-                    tmax_list.append(max(v))
-                    tmin_list.append(min(v))
-                    dmax_list.append(max(t))
-                    dmin_list.append(min(t))
+                    series.append((t,v,entropy_label))
 
         # plot heater power
         for ch in self.args['HEATER']:
             idx = ch-1
-            t,v=self.heater_hk_data(ch)
+            t,v=self.heater_power(ch,dmin,dmax)
             if (t is not None) and (v is not None):
-                something2plot = True
                 channel_label='HEATER%i' % ch
-                plt.plot(t,v,ls='none',marker='D',label=channel_label)
-                tmax_list.append(max(v))
-                tmin_list.append(min(v))
-                dmax_list.append(max(t))
-                dmin_list.append(min(t))
+                series.append((t,v,channel_label))
         if self.args['HEATER']:
             ylabel = 'power / mW'
             ttl = 'Heater power'
 
         # plot pressure
         for ch in self.args['PRESSURE']:
-            t,v = self.pressure_hk_data(ch)
+            t,v = self.hk_series('PRESSURE%i.txt' % ch,dmin,dmax)
             if (t is not None) and (v is not None):
-                something2plot = True
                 channel_label='PRESSURE%i' % ch
-                plt.plot(t,v,ls='none',marker='D',label=channel_label)
-                tmax_list.append(max(v))
-                tmin_list.append(min(v))
-                dmax_list.append(max(t))
-                dmin_list.append(min(t))
+                series.append((t,v,channel_label))
         if self.args['PRESSURE']:
             ylabel = 'pressure / mbar'
             ttl = 'Pressure'
 
-        if not something2plot:
+        if len(series)==0:
             msg = 'Sorry, your argument list resulted in no plot.  Are you sure about the channel numbers?'
             self._send_message(msg)
             return self.plothelp()
 
-        Tmin=min(tmin_list)
-        Tmax=max(tmax_list)
-        if self.args['YMIN'] is not None:
-            Tmin=self.args['YMIN']
-        if self.args['YMAX'] is not None:
-            Tmax=self.args['YMAX']
-            
-        dmin=min(dmin_list)
-        dmax=max(dmax_list)
-        if self.args['DMIN'] is not None:
-            dmin=self.args['DMIN']
-        if self.args['DMAX'] is not None:
-            dmax=self.args['DMAX']
-            
-        ax=fig.axes[0]
-        ax.set_xlim((dmin,dmax))
-        ax.set_ylim((Tmin,Tmax))
-        ax.set_xlabel('date',fontsize=self.labelsize)
-        plt.xticks(fontsize=self.labelsize)
-        ax.set_ylabel(ylabel,fontsize=self.labelsize)
-        plt.yticks(fontsize=self.labelsize)
-        fig.suptitle(ttl,fontsize=self.labelsize)
-        plt.legend(fontsize=self.labelsize)
-        
-        plt.grid()
-        if self.args['LOG']: plt.yscale("log")
-        fig.savefig('hk_plot.png',format='png',dpi=100,bbox_inches='tight')
-        plt.close()
-        with open('hk_plot.png','rb') as plot:
-            self._send_photo(plot)
+        png = render_plot(series,
+                          title=ttl,
+                          ylabel=ylabel,
+                          dmin=dmin,
+                          dmax=dmax,
+                          ymin=self.args['YMIN'],
+                          ymax=self.args['YMAX'],
+                          logscale=self.args['LOG'],
+                          labelsize=self.labelsize)
+        self.figures.put(key,png,dmax)
+        self._send_png(png)
         return
 
     def list_channels(self):
@@ -1457,39 +1550,125 @@ class qubic_bot :
             msg = _msg
 
         if 'chat' in msg.keys():
-            self.chat_id = msg['chat']['id']
+            chat_id = msg['chat']['id']
         else:
-            self.chat_id = 0xFFFFFFFF
+            chat_id = 0xFFFFFFFF
 
         if 'text' in msg.keys():
             cmd = msg['text']
         else:
             cmd = 'NONE'
 
-        cmd_list = cmd.split()
-        if len(cmd_list)>1:
-            self._parseargs(cmd_list[1:])
-
         now = utcnow()
         user='unknown'
         known_users = get_TelegramAddresses()
-        if self.chat_id in known_users.keys():user=known_users[self.chat_id]
-        msg="%s %i %16s %s" % (now.strftime(self.time_fmt),self.chat_id, user, cmd)
+        if chat_id in known_users.keys():user=known_users[chat_id]
+        msg="%s %i %16s %s" % (now.strftime(self.time_fmt),chat_id, user, cmd)
     
         print(msg)
         h=open('bot.log','a')
         h.write(msg+'\n')
         h.close()
 
+        cmd_list = cmd.split()
         if len(cmd_list)>0:
             run_cmd = cmd_list[0].lower()
             if run_cmd.find('/')!=0:run_cmd='/'+run_cmd
-            if run_cmd in self.commands.keys():
-                self.commands[run_cmd]()
-            else:
-                self._default_answer()
         else:
-            self.commands['/start']()
+            run_cmd = '/start'
+
+        request = {}
+        request['chat_id'] = chat_id
+        request['user'] = user
+        request['text'] = cmd.strip()
+        request['command'] = run_cmd
+        request['cmd_list'] = cmd_list
+        request['received'] = time.time()
+        heavy = run_cmd in self.heavy_commands
+        status,nahead = self.workers.submit(request,heavy=heavy)
+        if status=='queued':
+            answer = 'Working on %s' % run_cmd
+            if nahead>0: answer += ' (%i requests ahead of yours)' % nahead
+        elif status=='duplicate':
+            answer = 'Your request is already in the queue: %s' % request['text']
+        elif status=='full':
+            answer = "Sorry, I'm busy with %i requests.  Please try again in a minute." % nahead
+        else:
+            return
+        self._send_message_to(chat_id,answer)
+        return
+
+    def _send_message_to(self,chat_id,msg):
+        '''
+        send a message to a given chat, outside of the worker threads
+        '''
+        if self.bot is None:
+            print('bot not configured.  message not sent: %s' % msg)
+            return
+        try:
+            self.bot.sendMessage(chat_id,msg)
+        except:
+            print('ERROR! Could not send message to %s: %s' % (chat_id,msg))
+        return
+
+    def _execute(self,request):
+        '''
+        execute a command in a worker thread
+        '''
+        self.chat_id = request['chat_id']
+        self._init_args()
+        if len(request['cmd_list'])>1:
+            self._parseargs(request['cmd_list'][1:])
+
+        run_cmd = request['command']
+        if run_cmd in self.commands.keys():
+            func = self.commands[run_cmd]
+        else:
+            func = self._default_answer
+
+        # the time waiting for the lock is counted as waiting in the queue
+        lock = self.command_locks.get(run_cmd)
+        if lock is not None: lock.acquire()
+        request['start'] = time.time()
+        ok = True
+        try:
+            func()
+        except:
+            ok = False
+            print('ERROR! command failed: %s\n%s' % (request['text'],sys.exc_info()[1]))
+            try:
+                self._send_message('Sorry, there was an error executing: %s' % request['text'])
+            except:
+                pass
+        finally:
+            if lock is not None: lock.release()
+        self._log_latency(request,time.time(),ok)
+        return
+
+    def _log_latency(self,request,end,ok):
+        '''
+        log the time waiting in the queue and the time to execute each command
+        columns: date chat_id lane wait execute ok command
+        '''
+        if request['command'] in self.heavy_commands:
+            lane = 'heavy'
+        else:
+            lane = 'fast'
+        wait = request['start'] - request['received']
+        exec_time = end - request['start']
+        line = '%s %i %s %.3f %.3f %s %s' % (utcfromtimestamp(request['received']).strftime('%Y-%m-%dT%H:%M:%S'),
+                                             request['chat_id'],
+                                             lane,
+                                             wait,
+                                             exec_time,
+                                             ok,
+                                             request['text'])
+        try:
+            h = open('bot_latency.log','a')
+            h.write(line+'\n')
+            h.close()
+        except:
+            print('ERROR! Could not write latency log: %s' % line)
         return
 
 
@@ -9,32 +9,43 @@ $license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
           redistribute it.  There is NO WARRANTY, to the extent
           permitted by law.
 
-convert calsource dat file to fits
+convert calsource dat files to fits
+several files are converted at the same time
+
+usage: calsource2fits.py [--nprocs=<N>] <filename> [<filename> ...]
 '''
 import os,sys
 
-from qubichk.copy_data import calsource2fits
+from qubichk.copy_data import calsource2fits_files
 
 def cli():
-    if len(sys.argv)<2:
-        print('usage: calsource2fits.py <filename>')
+    nprocs = None
+    filenames = []
+    for arg in sys.argv[1:]:
+        if arg.find('--nprocs=')==0:
+            nprocs = int(arg.split('=')[-1])
+            continue
+        filenames.append(arg)
+
+    if len(filenames)==0:
+        print('usage: calsource2fits.py [--nprocs=<N>] <filename> [<filename> ...]')
         return
 
-    f = sys.argv[1]
-    if not os.path.isfile(f):
-        print('file not found: %s' % f)
-        return
+    files2convert = []
+    for f in filenames:
+        if not os.path.isfile(f):
+            print('file not found: %s' % f)
+            continue
 
-    rootname = f.replace('.dat','')
-    fitsname = rootname+'.fits'
-    if os.path.isfile(fitsname):
-        print('file already exists.  not overwriting %s' % fitsname)
-        return
+        rootname = f.replace('.dat','')
+        fitsname = rootname+'.fits'
+        if os.path.isfile(fitsname):
+            print('file already exists.  not overwriting %s' % fitsname)
+            continue
+        files2convert.append(f)
 
-    calsource2fits(f)
+    calsource2fits_files(files2convert,nprocs=nprocs)
     return
 
 if __name__ == '__main__':
     cli()
-
-        
@@ -12,13 +12,60 @@ $license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
 save the calibration source data regularly
 
 this should be run on qubic-central in directory /archive/calsource/hourly
+
+invoke with argument --demodulate to broadcast the on-the-fly demodulation of the signal
+   the modulation frequency is asked once to the calibration source manager,
+   or it can be given with --frequency=<Hz>
+invoke with argument --fits to convert each file to FITS while the next one is acquired
 '''
+import sys,time
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from qubichw.arduino import arduino
+from qubichw.calsource_demodulator import get_modulation_frequency
+from qubichk.copy_data import calsource2fits
+
+demodulate = '--demodulate' in sys.argv
+convert = '--fits' in sys.argv
+modulation_frequency = None
+for arg in sys.argv:
+    if arg.find('--frequency=')==0:
+        modulation_frequency = float(arg.split('=')[-1])
+        continue
+
+# ask for the modulation frequency only once, and not at the start of every file
+if demodulate and modulation_frequency is None:
+    modulation_frequency = get_modulation_frequency()
+    if modulation_frequency is None:
+        print('ERROR! Could not get the modulation frequency.  No demodulation')
+        demodulate = False
+
+def conversion_done(filename,future):
+    '''
+    print the result of the FITS conversion, or the error
+    '''
+    try:
+        fitsname = future.result()
+    except Exception as err:
+        print('ERROR! Could not convert %s to FITS: %s' % (filename,err))
+        return
+    if fitsname is None:
+        print('ERROR! Could not convert %s to FITS' % filename)
+        return
+    print('converted %s to %s' % (filename,fitsname))
+    return
 
 cs = arduino()
+converter = None
+if convert: converter = ProcessPoolExecutor(max_workers=1)
 
 while True:
-    cs.acquire(3600)
-
-    
+    outfile = cs.acquire(3600,demodulate=demodulate,modulation_frequency=modulation_frequency)
+    if not isinstance(outfile,str):
+        # not connected to the Arduino.  Try again in a while
+        time.sleep(10)
+        continue
+    if converter is not None:
+        future = converter.submit(calsource2fits,outfile)
+        future.add_done_callback(partial(conversion_done,outfile))
 
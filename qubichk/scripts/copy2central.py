@@ -16,7 +16,7 @@ import os
 from glob import glob
 import datetime as dt
 
-from qubichk.copy_data import copy2central, central_datadir, calsource2fits
+from qubichk.copy_data import copy2central, central_datadir, calsource2fits_files
 
 copy2central()
 
@@ -25,6 +25,7 @@ os.chdir('%s/calsource' % central_datadir)
 glob_pattern = 'calsource_????????T??????.dat'
 datfiles = glob(glob_pattern)
 datfiles.sort()
+files2convert = []
 for f in datfiles:
     h = open(f,'r')
     l1 = h.readline()
@@ -38,10 +39,12 @@ for f in datfiles:
 
     print('expected output FITS file: %s' % fitsname)
     if not os.path.isfile(fitsname):
-        calsource2fits(f)
+        files2convert.append(f)
     else:
         print('file exists, not overwriting: %s' % fitsname)
 
+calsource2fits_files(files2convert)
+
         
 
         
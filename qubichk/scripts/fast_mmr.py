@@ -11,69 +11,62 @@ $license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
           permitted by law.
 
 read fast temperature data from the iMACRT
-'''
-import sys,socket,time
-import datetime as dt
-
-print('DEPRECATED!  This script is deprecated.  Please use mmr_mes1.py instead')
-exit
 
-mmr_ip = '192.168.2.213'
-mmr_port = 12000 + int(mmr_ip.split('.')[-1])
+the channels are polled with MMR3GET, one request at a time (see qubichk.imacrt.mmr_poller)
+for the full rate acquisition of all channels, use mmr_mes1.py
+'''
+import sys
+from qubichk.imacrt import mmr_poller, channel_writer
 
 hlp = 'Sample fast MMR temperatures'
 hlp += '\n   to specifiy channels use a comma separated list'
+hlp += '\n   optionally give the sample rate in Hz for each channel with a colon'
 hlp += '\n   for example:'
-hlp += '\n       fast_mmr.py 3,14,25\n'
+hlp += '\n       fast_mmr.py 3,14,25'
+hlp += '\n       fast_mmr.py 3:10,14:1,25'
+hlp += '\n   options:'
+hlp += '\n       --timeout=<T>      timeout in seconds for a reply (default 0.5)'
+hlp += '\n       --duration=<T>     duration in seconds (default forever)'
+hlp += '\n       --binary           write binary output (mmr_chan<N>.bin) instead of text (mmr_chan<N>.dat)\n'
 print(hlp)
     
 
 #interesting_channels = [5,16,27] # T
 interesting_channels = [3,14,25] # R
-if len(sys.argv)>1:
-    ch_str_list = sys.argv[1].split(',')
+rates = {}
+timeout = 0.5
+duration = None
+binary = False
+for arg in sys.argv[1:]:
+    if arg.find('--timeout=')==0:
+        timeout = float(arg.split('=')[-1])
+        continue
+    if arg.find('--duration=')==0:
+        duration = float(arg.split('=')[-1])
+        continue
+    if arg=='--binary':
+        binary = True
+        continue
+    
+    ch_str_list = arg.split(',')
     interesting_channels = []
     for ch_str in ch_str_list:
-        interesting_channels.append(int(ch_str))
+        ch_rate = ch_str.split(':')
+        ch = int(ch_rate[0])
+        interesting_channels.append(ch)
+        if len(ch_rate)>1: rates[ch] = float(ch_rate[1])
         
-    
-# setup socket connection
-sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-sock.settimeout(10)
-sock.bind(('', 12000))
-
 
-# file handles
-handle = []
-for ch in interesting_channels:
-    handle.append(open('mmr_chan%i.dat' % ch,'a'))
-    
-
-cmd = 'MMR3GET %i' % ch
-cmd_encode = cmd.encode()
-counter = 0
-while True:
-
-    for idx,ch in enumerate(interesting_channels):
-        try:
-            res = sock.sendto(cmd_encode, (mmr_ip,mmr_port))
-            ret = sock.recv(1024)
-        except KeyboardInterrupt:
-            print('stopped by ctrl-c')
-            break
+writer = channel_writer('mmr_chan',binary=binary)
+poller = mmr_poller(interesting_channels,
+                    rates=rates,
+                    timeout=timeout,
+                    writer=writer,
+                    verbosity=1)
+try:
+    poller.poll(duration=duration)
+except KeyboardInterrupt:
+    print('stopped by ctrl-c')
 
-        #if idx==2: print(ret)
-        val_str = ret.decode().strip()
-        now = dt.datetime.utcnow()
-        tstamp_str = now.strftime('%s.%f')
-        handle[idx].write('%s %s\n' % (tstamp_str,val_str))
-        #print('%s %s' % (tstamp_str,val_str))
-        time.sleep(0.05)
-    #print('\n')
-
-    counter += 1
-
-    
-print('collected %i samples' % counter)
+poller.report()
+poller.close()
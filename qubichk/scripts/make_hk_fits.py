@@ -11,6 +11,10 @@ $license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
 
 make a FITS file with all the housekeeping data recorded on qubic-central
 the data are found in /home/qubic/data/temperature/broadcast
+
+The file is written one housekeeping item at a time (see qubichk.hk_fits)
+options:
+  --compress   lossless tile compression
 '''
 import sys,os,re,time
 import datetime as dt
@@ -18,6 +22,7 @@ from glob import glob
 import numpy as np
 from astropy.io import fits as pyfits
 
+from qubichk.hk_fits import hk_fits_writer, hk_blocks
 from qubichk.hk_file_tools import read_entropy_label, read_entropy_logfile, read_temperature_dat
 from qubicpack.housekeeping.utilities import read_hk_file
 # a dictionary will have all the HK data
@@ -33,6 +38,12 @@ else:
 
 hk_topdir = '/home/qubic/data/temperature/broadcast'
 
+compress = False
+for arg in sys.argv[1:]:
+    if arg=='--compress':
+        compress = True
+        continue
+
 
 # The Housekeeping types are the items saved by the housekeeping broadcast:
 #   AVS47_1 (this is managed by the Entropy machine, and already read above)
@@ -138,81 +149,84 @@ for key in HKtypes.keys():
         hk[label]['unit'] = HKtypes[key]['unit']
         HKname2label[hkname] = label
 
-keys = HKname2label.keys()
-keys.sort()
-for hkname in keys:
-    basename = hkname+'.txt'
-    filename = '%s/%s' % (hk_topdir,basename)
-    label = HKname2label[hkname]
-    tstamps, val = read_hk_file(filename)
-    if tstamps is None: continue
-    tstamp_end = tstamps[-1]
-
-    if label not in hk.keys():
-        hk[label] = {}
-        hk[label]['value'] = val
-        hk[label]['time'] = tstamps
-    else:
-        #print('appending data for "%s" in file %s' % (label,filename))
-        hk[label]['value'] = np.append(hk[label]['value'],val)
-        hk[label]['time'] = np.append(hk[label]['time'],tstamps)
-
-
-    npts=len(val)
-    tot_npts=len(hk[label]['value'])        
-    end_date=dt.datetime.fromtimestamp(tstamp_end).strftime('%Y-%m-%d %H:%M:%S')
-    print('%s npts=%8i tot_npts=%8i %s' % (end_date,npts,tot_npts,filename))
-
-
-    
-# the files were read not necessarily in chronological order.  We have to resort
-start_ctime = float(dt.datetime.utcnow().strftime('%s.%f'))
-end_ctime = 0.0
+# the housekeeping files for each label
+label2HKname = {}
 for label in hk.keys():
-    sorted_index = sorted(range(len(hk[label]['time'])), key=lambda i: hk[label]['time'][i])
-    hk[label]['time'] = hk[label]['time'][sorted_index]
-    hk[label]['value'] = hk[label]['value'][sorted_index]
-
-    if len(hk[label]['time'])>0:
-        if hk[label]['time'][0] < start_ctime:
-            start_ctime = hk[label]['time'][0]
+    label2HKname[label] = sorted([hkname for hkname in HKname2label.keys() if HKname2label[hkname]==label])
 
-        if hk[label]['time'][-1] > end_ctime:
-            end_ctime = hk[label]['time'][-1]
-        
-
-# write the fits file
-start_date = dt.datetime.fromtimestamp(start_ctime)
-end_date = dt.datetime.fromtimestamp(end_ctime)
+# the primary header is written first.  The dates are updated at the end when we know them
 datefmt = '%Y-%m-%d %H:%M:%S UTC'
-start_date_str = start_date.strftime(datefmt)
-end_date_str = end_date.strftime(datefmt)
-fitsfile = 'QUBIC_HK_%s.fits' % start_date.strftime('%Y%m%d-%H%M%S')
+now_str = dt.datetime.utcnow().strftime(datefmt)
 prihdr = pyfits.Header()
 prihdr['TELESCOP'] = ('QUBIC','Telescope used for the observation')
 prihdr['OBSERVER'] = ('APC','name of the observer')
 prihdr['AUTHOR'] = ('qubicpack by Steve Torchinsky https://github.com/satorchi/pystudio','')
-prihdr['FILEDATE'] = (dt.datetime.utcnow().strftime(datefmt),'date this file was written')
-prihdr['DATE-OBS'] = (start_date_str,'date of the observation in UTC')
-prihdr['END-OBS']  = (end_date_str,'end time of the observation in UTC')
+prihdr['FILEDATE'] = (now_str,'date this file was written')
+prihdr['DATE-OBS'] = (now_str,'date of the observation in UTC')
+prihdr['END-OBS']  = (now_str,'end time of the observation in UTC')
 prihdr['N-HK'] = (len(hk),'number of housekeeping items')
 prihdr.add_comment('each binary table has two columns corresponding to the date and values')
 for idx,label in enumerate(hk.keys()):
     prikey = 'HK%02i' % (idx+1)
     prihdr[prikey] = (label,'label for FITS binary table %2i' % (idx+1))
-prihdu = pyfits.PrimaryHDU(header=prihdr)
 
+tmp_fitsfile = 'QUBIC_HK_%i.fits.part' % os.getpid()
+writer = hk_fits_writer(tmp_fitsfile,prihdr,compress=compress)
 
-tbhdu = []
+# read one housekeeping item at a time, so only one is in memory
+start_ctime = float(dt.datetime.utcnow().strftime('%s.%f'))
+end_ctime = 0.0
 for label in hk.keys():
+    tstamps_list = []
+    val_list = []
+    for hkname in label2HKname[label]:
+        basename = hkname+'.txt'
+        filename = '%s/%s' % (hk_topdir,basename)
+        tstamps, val = read_hk_file(filename)
+        if tstamps is None: continue
+        tstamps_list.append(tstamps)
+        val_list.append(val)
+        tstamp_end = tstamps[-1]
+
+        npts=len(val)
+        tot_npts=sum([len(v) for v in val_list])
+        end_date=dt.datetime.fromtimestamp(tstamp_end).strftime('%Y-%m-%d %H:%M:%S')
+        print('%s npts=%8i tot_npts=%8i %s' % (end_date,npts,tot_npts,filename))
+
+    if len(tstamps_list)>0:
+        tstamps = np.concatenate(tstamps_list)
+        val = np.concatenate(val_list)
+    else:
+        tstamps = np.empty(0)
+        val = np.empty(0)
+    del(tstamps_list,val_list)
+
+    # the files were read not necessarily in chronological order.  We have to resort
+    sorted_index = np.argsort(tstamps,kind='stable')
+    tstamps = tstamps[sorted_index]
+    val = val[sorted_index]
+    del(sorted_index)
 
-    dimstr = '%i' % len(hk[label]['value'])
+    if len(tstamps)>0:
+        if tstamps[0] < start_ctime:
+            start_ctime = tstamps[0]
 
-    col1 = pyfits.Column(name='DATE', format='D', dim=dimstr, unit='seconds', array=hk[label]['time'])
-    col2 = pyfits.Column(name=label, format='D', dim=dimstr, unit=hk[label]['unit'],  array=hk[label]['value'])
-    cols  = pyfits.ColDefs([col1,col2])
-    tbhdu.append(pyfits.BinTableHDU.from_columns(cols))
+        if tstamps[-1] > end_ctime:
+            end_ctime = tstamps[-1]
 
+    writer.write_channel(label,hk[label]['unit'],hk_blocks(tstamps,val))
+    del(tstamps,val)
 
-hdulist = pyfits.HDUList([prihdu]+tbhdu)
-hdulist.writeto(fitsfile,overwrite=True)
+
+# finish the fits file
+start_date = dt.datetime.fromtimestamp(start_ctime)
+end_date = dt.datetime.fromtimestamp(end_ctime)
+start_date_str = start_date.strftime(datefmt)
+end_date_str = end_date.strftime(datefmt)
+updates = {}
+updates['DATE-OBS'] = (start_date_str,'date of the observation in UTC')
+updates['END-OBS']  = (end_date_str,'end time of the observation in UTC')
+writer.close(updates)
+fitsfile = 'QUBIC_HK_%s.fits' % start_date.strftime('%Y%m%d-%H%M%S')
+os.rename(tmp_fitsfile,fitsfile)
+print('written: %s' % fitsfile)
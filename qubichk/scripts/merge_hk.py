@@ -13,6 +13,9 @@ merge QUBIC housekeeping raw data into a FITS file
 this is probably a one-off script to re-organize the HK data taken
 while the system was undergoing changes.
 
+options:
+  --compress   lossless tile compression (see qubichk.hk_fits)
+
 '''
 import sys,os,re,time
 import datetime as dt
@@ -20,6 +23,7 @@ from glob import glob
 import numpy as np
 from astropy.io import fits as pyfits
 
+from qubichk.hk_fits import hk_fits_writer, hk_blocks
 from qubichk.hk_file_tools import read_entropy_label, read_entropy_logfile, read_temperature_dat
 from qubicpack.housekeeping.utilities import read_hk_file
 # a dictionary will have all the HK data
@@ -37,6 +41,12 @@ entropy_topdir='/entropy/logs'
 # this is not used since we implemented HK socket broadcasting 20181212
 temperature_topdir = homedir+'/data/temperature/data/log_cryo'
 
+compress = False
+for arg in sys.argv[1:]:
+    if arg=='--compress':
+        compress = True
+        continue
+
 summertime = dt.datetime.strptime('2018-10-28 02:00','%Y-%m-%d %H:%M')
 summertime_ctime = summertime.strftime('%c')
 
@@ -224,10 +234,12 @@ for subdir in subdirs:
 start_ctime = float(dt.datetime.utcnow().strftime('%s.%f'))
 end_ctime = 0.0
 for label in hk.keys():
-    sorted_index = sorted(range(len(hk[label]['time'])), key=lambda i: hk[label]['time'][i])
+    sorted_index = np.argsort(hk[label]['time'],kind='stable')
     hk[label]['time'] = hk[label]['time'][sorted_index]
     hk[label]['value']      = hk[label]['value'][sorted_index]
 
+    if len(hk[label]['time'])==0: continue
+
     if hk[label]['time'][0] < start_ctime:
         start_ctime = hk[label]['time'][0]
 
@@ -254,22 +266,10 @@ prihdr.add_comment('each binary table has two columns corresponding to the date
 for idx,label in enumerate(hk.keys()):
     prikey = 'HK%02i' % (idx+1)
     prihdr[prikey] = (label,'label for FITS binary table %2i' % (idx+1))
-prihdu = pyfits.PrimaryHDU(header=prihdr)
-
-
-tbhdu = []
-for label in hk.keys():
-
-    dimstr = '%i' % len(hk[label]['value'])
-
-    col1 = pyfits.Column(name='DATE', format='D', dim=dimstr, unit='seconds', array=hk[label]['time'])
-    col2 = pyfits.Column(name=label, format='D', dim=dimstr, unit=hk[label]['unit'],  array=hk[label]['value'])
-    cols  = pyfits.ColDefs([col1,col2])
-    tbhdu.append(pyfits.BinTableHDU.from_columns(cols))
-
-
-hdulist = pyfits.HDUList([prihdu]+tbhdu)
-hdulist.writeto(fitsfile,overwrite=True)
-    
-
 
+# each item is written in blocks and then released
+writer = hk_fits_writer(fitsfile,prihdr,compress=compress)
+for label in list(hk.keys()):
+    writer.write_channel(label,hk[label]['unit'],hk_blocks(hk[label]['time'],hk[label]['value']))
+    del(hk[label]['time'],hk[label]['value'])
+writer.close()
@@ -29,11 +29,20 @@ the data packets have the following:
 8 [46:54]    double             peak-to-peak for the n samples of R
 8 [54:62]    double             R conversion
 
+the data packets are decoded with qubichk.imacrt.mes1_decoder
+output is written to mmr_mes_ch<N>.txt (or .bin with --binary, pairs of float64 timestamp,R)
+
+options:
+   --binary               write binary output instead of text
+   --verbosity=<N>        0: quiet, 1: rate summary, 2: print every sample
+   --max_datagrams=<N>    send the MES command again after N datagrams (default: no limit)
 '''
-import sys,socket,time,struct
+import sys,socket,time
+import numpy as np
 from satorchipy.datefunctions import utcnow
 from qubichk.utilities import get_known_hosts
-known_hosts = get_known_hosts
+from qubichk.imacrt import mes1_decoder, channel_writer
+known_hosts = get_known_hosts()
 mmr_ip = known_hosts['mmr3']
 mmr_port = 12000 + int(mmr_ip.split('.')[-1])
 
@@ -60,90 +69,84 @@ def start_mes(sock):
     return res
 
 
-def write_dat(filename,t,v):
-    '''
-    write a line of data to file
-    '''
-    h = open(filename,'a')
-    line = '%f %e\n' % (t,v)
-    h.write(line)
-    h.close()
-    return
-    
-
-def mes_acquisition(sock):
+def mes_acquisition(sock,writer,max_datagrams=None,verbosity=0):
     '''
     run the acquisition loop for MES1 mode
+    max_datagrams is the number of datagrams to receive before returning (default: no limit)
     '''
-    
+    decoder = mes1_decoder()
     counter = 0
-    t0 = None
-    while counter<121:
-        print('=== %04i ===' % counter)
+    nsamples = 0
+    retry = True
+    report_tstamp = utcnow().timestamp()
+    while max_datagrams is None or counter<max_datagrams:
         try:
             bigpack = sock.recv(3*930)
         except KeyboardInterrupt:
             print('interrupted with ctrl-c')
             return False
+        except socket.timeout:
+            # ask again for MES1 once before giving up
+            if not retry:
+                print('no more data.  timeout on socket')
+                return False
+            print('timeout on socket.  sending MES command again')
+            start_mes(sock)
+            retry = False
+            continue
         except:
             print('problem receiving data packet')
             return False
+        retry = True
 
-        pack_bytes = len(bigpack)
-
-        if pack_bytes < 62:
-            print('no more data.  received package of %i bytes' % pack_bytes)
-            return False
-    
-        modulo = pack_bytes % 62
-    
-    
-        if modulo!=0: 
-            print('returned %i bytes. skipping this packet.' % len(bigpack)) 
-            counter += 1 
-            continue
-
-        npacks = int(pack_bytes/62)
-        print('number of packets: %i' % npacks)
-        ch = 0
-        for ctr in range(npacks):
-            ret = bigpack[ctr*62:ctr*62+62]
-
-            ch = struct.unpack('<B',ret[1:2])[0] + 1
-            
-            # nsamps = struct.unpack('<H',ret[2:4])[0]
-            nsecs = struct.unpack('<I',ret[6:10])[0]
-            nmillisecs = struct.unpack('<H',ret[10:12])[0]
-            t = nsecs + 0.001*nmillisecs
-            if t0 is None:
-                tstamp = utcnow().timestamp()
-                t0 = tstamp - t
-            else:
-                tstamp = t0 + t
-            
-                                
-            val = struct.unpack('<d',ret[30:38])[0]
-            
-            current = struct.unpack('<d',ret[14:22])[0] 
-            
-            # current_rounded_down = int(1e9*current)
-            filename = 'mmr_mes_ch%i.txt' % ch
-            write_dat(filename,tstamp,val)
-            print('%02i) t0=%16.06f t=%16.06f secs: R=%011.4f | current=%010.6f' % (ctr,t0,t,val,1e9*current))
-
-            
+        records,tstamps = decoder.decode(bigpack)
         counter += 1
+        if len(records)==0: continue
+        
+        channels = records['channel'] + 1
+        for ch in np.unique(channels):
+            mask = channels==ch
+            writer.write(ch,tstamps[mask],records['R'][mask])
+        nsamples += len(records)
+
+        if verbosity>1:
+            for idx,rec in enumerate(records):
+                print('%02i) ch%02i t=%16.06f secs: R=%011.4f | current=%010.6f' % (idx,channels[idx],tstamps[idx],rec['R'],1e9*rec['current']))
+
+        now = utcnow().timestamp()
+        if verbosity>0 and now-report_tstamp>10:
+            print('%s: %i datagrams, %i samples, %.1f samples per second, %i bad datagrams, %i bad records'
+                  % (utcnow().strftime('%Y-%m-%d %H:%M:%S'),counter,nsamples,nsamples/(now-report_tstamp),
+                     decoder.errors['bad length'],decoder.errors['bad id']))
+            report_tstamp = now
+            nsamples = 0
+            
     return True
 
     
     
 if __name__=='__main__':
+    binary = False
+    verbosity = 1
+    max_datagrams = None
+    for arg in sys.argv:
+        if arg=='--binary':
+            binary = True
+            continue
+        if arg.find('--verbosity=')==0:
+            verbosity = int(arg.split('=')[-1])
+            continue
+        if arg.find('--max_datagrams=')==0:
+            max_datagrams = int(arg.split('=')[-1])
+            continue
+
+    writer = channel_writer('mmr_mes_ch',binary=binary,extension='txt')
     sock = init_socket()
-    start_mes(sock)
     keepgoing = True
     while keepgoing:
         start_mes(sock)
-        keepgoing = mes_acquisition(sock)        
+        keepgoing = mes_acquisition(sock,writer,max_datagrams=max_datagrams,verbosity=verbosity)
+    writer.close()
     sock.close()
     del(sock)
     
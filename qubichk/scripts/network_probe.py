@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+'''
+$Id: network_probe.py
+$auth: Steve Torchinsky <satorchi@apc.in2p3.fr>
+$created: Mon 19 Oct 2026 20:31:05 CEST
+$license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
+
+          This is free software: you are free to change and
+          redistribute it.  There is NO WARRANTY, to the extent
+          permitted by law.
+
+check all the known hosts on the network at the same time, and log the packet loss and round trip time
+this can be run regularly from crontab to follow the network over time
+
+usage: network_probe.py [--count=<N>] [--timeout=<seconds>] [--tcp] [--silent] [host1 host2 ...]
+'''
+import sys
+from qubichk.netprobe import probe_hosts, write_probe_log
+
+count = 3
+timeout = 1.0
+method = None
+verbosity = 1
+hosts = []
+for arg in sys.argv[1:]:
+    if arg.find('--count=')==0:
+        count = int(arg.split('=')[-1])
+        continue
+    if arg.find('--timeout=')==0:
+        timeout = float(arg.split('=')[-1])
+        continue
+    if arg=='--tcp':
+        method = 'tcp'
+        continue
+    if arg=='--silent':
+        verbosity = 0
+        continue
+    hosts.append(arg)
+
+if len(hosts)==0: hosts = None
+results = probe_hosts(hosts,count=count,timeout=timeout,method=method)
+logfile = write_probe_log(results)
+
+if verbosity>0:
+    for host in results.keys():
+        result = results[host]
+        if result['rtt mean'] is None:
+            rtt_str = ''
+        else:
+            rtt_str = 'rtt min/mean/max = %.1f/%.1f/%.1f ms' % (1000*result['rtt min'],1000*result['rtt mean'],1000*result['rtt max'])
+        print('%20s %15s %4s %5.1f%% loss %s' % (host,result['address'],result['method'],result['loss'],rtt_str))
+    if logfile is not None: print('results saved to: %s' % logfile)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+'''
+$Id: pid_simulation.py
+$auth: Steve Torchinsky <satorchi@apc.in2p3.fr>
+$created: Mon 19 Oct 2026 15:02:44 CEST
+$license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
+
+          This is free software: you are free to change and
+          redistribute it.  There is NO WARRANTY, to the extent
+          permitted by law.
+
+simulate the calbox temperature control with a simple thermal model
+and compare the incremental PID (pid_control.py) with the batch fit using np.polyfit
+
+thermal model:  dT/dt = (heater_gain*heater_on - (T - T_ambient))/tau  + noise
+
+usage: pid_simulation.py [--nsamples=<N>] [--npts=<PID window>]
+'''
+import sys,time
+import numpy as np
+from qubichw.pid_control import pid_controller
+
+nsamples = 20000
+npts = 75 # default for MCP9808: PID_interval=300, acquisition_rate=4, broadcast_buffer=16
+for arg in sys.argv:
+    if arg.find('--nsamples=')==0:
+        nsamples = int(arg.split('=')[-1])
+        continue
+    if arg.find('--npts=')==0:
+        npts = int(arg.split('=')[-1])
+        continue
+
+setpoint = 305.0
+T_ambient = 290.0
+heater_gain = 30.0
+tau = 600.0
+noise = 0.03
+sample_period = 4.0 # seconds between averaged samples (broadcast_buffer/acquisition_rate)
+Kp = Ki = Kd = 1
+
+def batch_PID(tstamps,temperatures):
+    '''
+    the PID as previously calculated in MCP9808.PID() with np.polyfit over the whole buffer
+    '''
+    error_value = temperatures - setpoint
+    P = Kp * error_value.mean()
+    interval = tstamps[-1] - tstamps[0]
+    I = Ki * error_value.sum() / interval
+    m = np.polyfit(tstamps,error_value,1)[0]
+    D = Kd * m * interval
+    return P,I,D,P+I+D
+
+def simulate():
+    '''
+    run the thermal model with the incremental PID controlling the heater
+    and calculate the batch PID at the same time for comparison
+    '''
+    rng = np.random.default_rng(1)
+    controller = pid_controller(setpoint,npts,Kp=Kp,Ki=Ki,Kd=Kd)
+    tstamp_buffer = np.zeros(npts)
+    temperature_buffer = np.zeros(npts)
+
+    T = T_ambient
+    heater_on = False
+    max_diff = 0.0
+    incremental_time = 0.0
+    batch_time = 0.0
+    ncompared = 0
+    heater_on_count = 0
+    for idx in range(nsamples):
+        tstamp = idx*sample_period
+        T += sample_period*(heater_gain*heater_on - (T - T_ambient))/tau
+        Tmeas = T + noise*rng.standard_normal()
+
+        t0 = time.perf_counter()
+        controller.add(tstamp,Tmeas)
+        ready = controller.is_ready()
+        if ready: U = controller.PID()[-1]
+        incremental_time += time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        tstamp_buffer = np.roll(tstamp_buffer,-1)
+        tstamp_buffer[-1] = tstamp
+        temperature_buffer = np.roll(temperature_buffer,-1)
+        temperature_buffer[-1] = Tmeas
+        if ready: U_batch = batch_PID(tstamp_buffer,temperature_buffer)[-1]
+        batch_time += time.perf_counter() - t0
+
+        if not ready: continue
+        ncompared += 1
+        diff = abs(U - U_batch)/max(1.0,abs(U_batch))
+        if diff>max_diff: max_diff = diff
+
+        # simple on/off action on the heater
+        heater_on = U<0
+        heater_on_count += heater_on
+
+    print('samples: %i, PID window: %i samples' % (nsamples,npts))
+    print('final temperature: %.3f K (setpoint %.2f K), heater duty: %.1f%%' % (T,setpoint,100*heater_on_count/max(1,ncompared)))
+    print('maximum relative difference incremental vs batch control output: %.3e' % max_diff)
+    print('time per sample: incremental %.2f microseconds, batch %.2f microseconds'
+          % (1e6*incremental_time/nsamples,1e6*batch_time/nsamples))
+    return max_diff
+
+if __name__ == '__main__':
+    max_diff = simulate()
+    if max_diff>1e-6:
+        print('ERROR! incremental PID does not match the batch fit')
+        sys.exit(1)
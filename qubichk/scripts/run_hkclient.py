@@ -10,7 +10,16 @@ $license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
           permitted by law.
 
 run the client for gathering QUBIC housekeeping data sent on the socket
+with the option --alarms, the alarms are sent by Telegram (see hk_alarms)
 '''
+import sys
 from qubichk.hk_broadcast import hk_broadcast
+
+alarms = False
+for arg in sys.argv:
+    if arg=='--alarms':
+        alarms = True
+        continue
+
 bc=hk_broadcast()
-bc.hk_client()
+bc.hk_client(alarms=alarms)
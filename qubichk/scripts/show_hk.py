@@ -21,6 +21,7 @@ from satorchipy.datefunctions import str2dt, utcnow, utcfromtimestamp
 from qubichk.hwp import get_hwp_info
 from qubichk.utilities import get_fullpath, read_labels, get_sun_separation, get_moon_separation, get_altaz
 from qubichk.dome import get_dome_status
+from qubichk.hk_freshness import get_freshness_index
 
 year_str = utcnow().strftime('%Y')
 
@@ -84,6 +85,16 @@ def read_lastline(filename):
 
     return val_list
 
+def read_latest(filename,index=None):
+    '''
+    read the latest values from the HK freshness index (see hk_freshness.py)
+    or from the end of the file if it is not in the index
+    '''
+    if index is not None:
+        vals = index.read(os.path.basename(filename))
+        if vals is not None: return vals
+    return read_lastline(filename)
+
 
 def assign_val_string(val,units):
     if abs(val)>=1:
@@ -270,7 +281,8 @@ def list_hk():
     '''
     list all the latest housekeeping values on the screen
     '''
-    
+    # the latest values are in the index maintained by the HK logger, if it exists
+    index = get_freshness_index(hk_dir)
     
     # first look at the weather
     retval = read_weather('outside')
@@ -289,7 +301,7 @@ def list_hk():
     labelkey = basename.replace('.txt','')
     F = '%s%s%s' % (hk_dir,os.sep,basename)
     if os.path.isfile(F):
-        retval = read_lastline(F)
+        retval = read_latest(F,index)
         if retval is not None:
             tstamp = retval[0]
             tstamps.append(tstamp)
@@ -363,7 +375,7 @@ def list_hk():
             F = '%s%s%s' % (hk_dir,os.sep,basename)
             if not os.path.isfile(F): continue
 
-            retval = read_lastline(F)
+            retval = read_latest(F,index)
             if retval is None: continue
             tstamp,val,onoff = retval
             date = utcfromtimestamp(tstamp)
@@ -436,10 +448,10 @@ def list_hk():
         if basename in exclude_files: continue
         if basename.find('HEATER')==0: continue # already done, above
 
-        retval = read_lastline(F)
+        retval = read_latest(F,index)
         if retval is None: continue
         tstamp,val,onoff = retval
-        if val=='inf': val=1e6
+        if val=='inf' or val==float('inf'): val=1e6
 
         try:
             date = utcfromtimestamp(tstamp)
@@ -546,6 +558,7 @@ def list_hk():
             lines[idx] = colored(line,'red','on_white')
 
 
+    if index is not None: index.close()
     page = '\n'.join(lines)
     return page
 
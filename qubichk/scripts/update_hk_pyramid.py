@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+'''
+$Id: update_hk_pyramid.py
+$auth: Steve Torchinsky <satorchi@apc.in2p3.fr>
+$created: Tue 20 Oct 2026 11:02:26 CEST
+$license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
+
+          This is free software: you are free to change and
+          redistribute it.  There is NO WARRANTY, to the extent
+          permitted by law.
+
+update the multi-resolution summary of the housekeeping files (see hk_pyramid.py)
+this can be run regularly from crontab, or with --loop it runs continuously
+
+usage: update_hk_pyramid.py [--hkdir=<directory>] [--loop=<seconds>] [--silent]
+'''
+import sys,time
+from qubichk.hk_pyramid import hk_pyramid
+
+hk_dir = None
+loop = None
+verbosity = 1
+for arg in sys.argv[1:]:
+    if arg.find('--hkdir=')==0:
+        hk_dir = arg.split('=')[-1]
+        continue
+    if arg.find('--loop=')==0:
+        loop = float(arg.split('=')[-1])
+        continue
+    if arg=='--silent':
+        verbosity = 0
+        continue
+
+pyramid = hk_pyramid(hk_dir)
+while True:
+    t0 = time.time()
+    results = pyramid.update()
+    if verbosity>0:
+        nsamples = sum(results.values())
+        print('%i samples added from %i HK files in %.1f seconds' % (nsamples,len(results),time.time()-t0))
+    if loop is None: break
+    time.sleep(max(0,loop - (time.time() - t0)))
@@ -16,6 +16,7 @@ import datetime as dt
 from urllib.request import urlopen
 from satorchipy.datefunctions import utcnow
 from qubichk.utilities import shellcommand, get_known_hosts
+from qubichk.hk_freshness import freshness_index
 known_hosts = get_known_hosts()
 
 #### history of server addresses ####
@@ -300,6 +301,22 @@ def get_inside_weather(options):
     return values
     
 
+def update_freshness(logfile,tstamp,values):
+    '''
+    update the index of latest HK values so that hk_verify can check the weather without reading the log file
+    '''
+    if 'temperature' in values.keys():
+        val = values['temperature']
+    else:
+        val = None
+    try:
+        index = freshness_index(os.path.dirname(os.path.abspath(logfile)),writable=True)
+        index.update(os.path.basename(logfile),tstamp,val)
+        index.close()
+    except:
+        return False
+    return True
+
 def show_weather(values,options):
     '''
     log the weather and/or show it on screen
@@ -320,6 +337,7 @@ def show_weather(values,options):
         h = open(options['logfile'],'a')
         h.write(line)
         h.close()
+        update_freshness(options['logfile'],tstamp,values)
 
     if options['verbosity']>0:
         print(line)
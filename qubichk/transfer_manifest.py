@@ -0,0 +1,167 @@
+'''
+$Id: transfer_manifest.py
+$auth: Steve Torchinsky <satorchi@apc.in2p3.fr>
+$created: Tue 20 Oct 2026 14:26:51 CEST
+$license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
+
+          This is free software: you are free to change and
+          redistribute it.  There is NO WARRANTY, to the extent
+          permitted by law.
+
+record of the data files copied to the archives (see copy_data.copy2archive)
+
+For each archive (cc, apcjupyter, central) and each file, we keep:
+the size and modification time of the source file, the MD5 checksum, the source, the destination,
+the time it was copied, and the time the copy on the archive was last verified.
+
+With the manifest, copy2archive only needs to look at the new source files.
+The archive is listed once a day to check that the files are still there,
+and the checksums of a few files on the archive are compared with the manifest each time.
+
+The manifest is an SQLite database.
+'''
+import os,time,sqlite3,hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+if 'HOME' in os.environ.keys():
+    default_manifest = '%s/data/transfer_manifest.sqlite' % os.environ['HOME']
+else:
+    default_manifest = '/home/qubic/data/transfer_manifest.sqlite'
+
+def file_checksum(filename,blocksize=1024*1024):
+    '''
+    the MD5 checksum of a file, the same as md5sum.  Return None if the file can't be read
+    '''
+    md5 = hashlib.md5()
+    try:
+        h = open(filename,'rb')
+    except OSError:
+        return None
+    while True:
+        dat = h.read(blocksize)
+        if not dat: break
+        md5.update(dat)
+    h.close()
+    return md5.hexdigest()
+
+def file_checksums(filenames,max_workers=8):
+    '''
+    compute the checksums in a thread pool (hashlib releases the GIL)
+    return a dictionary of filename -> checksum
+    '''
+    retval = {}
+    if len(filenames)==0: return retval
+    with ThreadPoolExecutor(max_workers=min(max_workers,len(filenames))) as executor:
+        for F,checksum in zip(filenames,executor.map(file_checksum,filenames)):
+            retval[F] = checksum
+    return retval
+
+
+class transfer_manifest:
+    '''
+    the database of files copied to the archives
+
+    Arguments:
+
+    filename: the SQLite database file
+    '''
+
+    def __init__(self,filename=None):
+        if filename is None: filename = default_manifest
+        self.filename = filename
+        d = os.path.dirname(os.path.abspath(filename))
+        if not os.path.isdir(d): os.makedirs(d)
+        self.db = sqlite3.connect(filename)
+        self.db.execute('CREATE TABLE IF NOT EXISTS files ('
+                        'server TEXT, relname TEXT, size INTEGER, mtime INTEGER, checksum TEXT,'
+                        'source TEXT, destination TEXT, copied REAL, verified REAL,'
+                        'PRIMARY KEY (server,relname))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS checks (server TEXT PRIMARY KEY, checked REAL)')
+        self.db.commit()
+        return None
+
+    def close(self):
+        '''
+        close the database
+        '''
+        self.db.close()
+        return
+
+    def known(self,server):
+        '''
+        return a dictionary of relative filename -> (size, mtime) for the files copied to the archive
+        '''
+        retval = {}
+        for relname,size,mtime in self.db.execute('SELECT relname,size,mtime FROM files WHERE server=?',(server,)):
+            retval[relname] = (size,mtime)
+        return retval
+
+    def record(self,server,entries,copied=None):
+        '''
+        add files to the manifest, or replace them
+
+        entries: list of (relname, size, mtime, checksum, source, destination)
+        copied: the time of the copy.  Default is now
+        '''
+        if copied is None: copied = time.time()
+        rows = [(server,)+tuple(entry)+(copied,) for entry in entries]
+        self.db.executemany('INSERT OR REPLACE INTO files '
+                            '(server,relname,size,mtime,checksum,source,destination,copied,verified) '
+                            'VALUES (?,?,?,?,?,?,?,?,NULL)',rows)
+        self.db.commit()
+        return
+
+    def forget(self,server,relnames):
+        '''
+        remove files from the manifest, so that they are copied again
+        '''
+        self.db.executemany('DELETE FROM files WHERE server=? AND relname=?',[(server,relname) for relname in relnames])
+        self.db.commit()
+        return
+
+    def set_checksums(self,server,checksums):
+        '''
+        add the checksums of files recorded without checksum
+
+        checksums: dictionary of relname -> checksum
+        '''
+        self.db.executemany('UPDATE files SET checksum=? WHERE server=? AND relname=?',
+                            [(checksums[relname],server,relname) for relname in checksums.keys()])
+        self.db.commit()
+        return
+
+    def set_verified(self,server,relnames,verified=None):
+        '''
+        record the time the files on the archive were verified
+        '''
+        if verified is None: verified = time.time()
+        self.db.executemany('UPDATE files SET verified=? WHERE server=? AND relname=?',
+                            [(verified,server,relname) for relname in relnames])
+        self.db.commit()
+        return
+
+    def to_verify(self,server,nfiles):
+        '''
+        return the files which have not been verified for the longest time
+        a list of (relname, checksum, source, destination)
+        '''
+        cur = self.db.execute('SELECT relname,checksum,source,destination FROM files WHERE server=? '
+                              'ORDER BY verified IS NOT NULL, verified, copied LIMIT ?',(server,nfiles))
+        return cur.fetchall()
+
+    def last_check(self,server):
+        '''
+        the time the archive was last listed.  Return 0 if it has never been done
+        '''
+        row = self.db.execute('SELECT checked FROM checks WHERE server=?',(server,)).fetchone()
+        if row is None: return 0
+        return row[0]
+
+    def set_check(self,server,checked=None):
+        '''
+        record the time the archive was listed
+        '''
+        if checked is None: checked = time.time()
+        self.db.execute('INSERT OR REPLACE INTO checks (server,checked) VALUES (?,?)',(server,checked))
+        self.db.commit()
+        return
@@ -0,0 +1,268 @@
+'''
+$Id: udp_receiver.py
+$auth: Steve Torchinsky <satorchi@apc.in2p3.fr>
+$created: Mon 19 Oct 2026 11:03:18 CEST
+$license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
+
+          This is free software: you are free to change and
+          redistribute it.  There is NO WARRANTY, to the extent
+          permitted by law.
+
+common receive layer for the UDP data streams (GPS, MCP9808, calsource, housekeeping)
+
+The packets do not have a sequence number, but they all have a float64 timestamp.
+We use the timestamp to detect gaps (missing packets and dead time), packets arriving out of order,
+and the latency between the time the data was sampled and the time it was received.
+The kernel counter of packets dropped because of socket buffer overrun is read with SO_RXQ_OVFL.
+
+Statistics are written regularly to a file for each stream: <name>_rxstats.txt
+'''
+import os,socket,struct,time,bisect
+import numpy as np
+from satorchipy.datefunctions import utcnow
+
+# SO_RXQ_OVFL is not defined in the python socket module on all versions (Linux value is 40)
+SO_RXQ_OVFL = getattr(socket,'SO_RXQ_OVFL',40)
+
+# upper edges of the latency histogram bins in milliseconds.  The last bin is for everything larger.
+latency_bin_edges = [1,2,5,10,20,50,100,200,500,1000,2000,5000]
+
+
+class udp_receiver:
+    '''
+    class to receive a UDP data stream and keep statistics
+
+    Arguments:
+
+    name: name of the stream used for the statistics file
+    listener: address to listen on ('' for all)
+    port: the port number
+    packetsize: the number of bytes in a data packet
+    tstamp_offset: position in bytes of the float64 timestamp in the data packet
+    period: the expected time in seconds between packets.  If None, it is estimated from the first packets
+    rcvbuf: the socket receive buffer size in bytes.  If None, use the system default
+    timeout: socket timeout in seconds.  If None, the socket is blocking
+    stats_interval: interval in seconds for writing the statistics to file
+    verbosity: level of verboseness for printing to screen
+    '''
+
+    def __init__(self,
+                 name,
+                 listener,
+                 port,
+                 packetsize,
+                 tstamp_offset=1,
+                 period=None,
+                 rcvbuf=None,
+                 timeout=None,
+                 stats_interval=60,
+                 verbosity=0
+                 ):
+        self.name = name
+        self.listener = listener
+        self.port = port
+        self.packetsize = packetsize
+        self.tstamp_offset = tstamp_offset
+        self.period = period
+        self.stats_interval = stats_interval
+        self.statsfile = '%s_rxstats.txt' % name
+        self.verbosity_threshold = verbosity
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        if rcvbuf is not None:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.rcvbuf = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+            self.overflow_counter_ok = True
+        except:
+            self.log('WARNING! kernel drop counter SO_RXQ_OVFL not available')
+            self.overflow_counter_ok = False
+        self.ancbufsize = socket.CMSG_SPACE(4)
+        self.sock.settimeout(timeout)
+        self.sock.bind((listener,port))
+        self.log('listening on %s port %i with receive buffer %i bytes' % (listener,port,self.rcvbuf),verbosity=1)
+
+        self.period_estimate_list = []
+        self.kernel_drops = 0
+        self.previous_tstamp = None
+        self.reset_stats()
+        return None
+
+    def log(self,msg,verbosity=0):
+        '''
+        print a statement if we are sufficiently verbose
+        '''
+        if verbosity>self.verbosity_threshold: return
+        print('%s|%s receiver|%s' % (utcnow().strftime('%Y-%m-%d %H:%M:%S'),self.name,msg))
+        return
+
+    def reset_stats(self):
+        '''
+        reset the counters for a new statistics interval
+        '''
+        self.stats = {}
+        self.stats['start'] = time.time()
+        self.stats['packets'] = 0
+        self.stats['bad size'] = 0
+        self.stats['missing'] = 0
+        self.stats['gaps'] = 0
+        self.stats['dead time'] = 0.0
+        self.stats['out of order'] = 0
+        self.stats['timeouts'] = 0
+        self.stats['latency sum'] = 0.0
+        self.stats['latency max'] = 0.0
+        self.stats['kernel drops'] = 0
+        self.latency_histogram = np.zeros(len(latency_bin_edges)+1,dtype=int)
+        return
+
+    def recv(self):
+        '''
+        receive a data packet.  This replaces socket.recvfrom()
+        socket.timeout is raised as usual
+        '''
+        try:
+            data, ancdata, flags, addr = self.sock.recvmsg(self.packetsize, self.ancbufsize)
+        except socket.timeout:
+            self.stats['timeouts'] += 1
+            self.check_stats_interval()
+            raise
+        rx_tstamp = time.time()
+
+        for cmsg_level, cmsg_type, cmsg_data in ancdata:
+            if cmsg_level==socket.SOL_SOCKET and cmsg_type==SO_RXQ_OVFL and len(cmsg_data)>=4:
+                self.update_kernel_drops(struct.unpack('I',cmsg_data[:4])[0])
+
+        if len(data)!=self.packetsize:
+            self.stats['bad size'] += 1
+        else:
+            tstamp = struct.unpack_from('<d',data,self.tstamp_offset)[0]
+            self.update_stats(tstamp,rx_tstamp)
+
+        self.check_stats_interval()
+        return data, addr
+
+    def update_kernel_drops(self,counter):
+        '''
+        the kernel counter is cumulative since the socket was opened
+        '''
+        ndrops = counter - self.kernel_drops
+        if ndrops>0:
+            self.stats['kernel drops'] += ndrops
+            self.kernel_drops = counter
+        return
+
+    def update_stats(self,tstamp,rx_tstamp):
+        '''
+        update the gap and latency statistics with a new packet
+        '''
+        self.stats['packets'] += 1
+
+        latency = rx_tstamp - tstamp
+        self.stats['latency sum'] += latency
+        if latency>self.stats['latency max']: self.stats['latency max'] = latency
+        bin_idx = bisect.bisect_left(latency_bin_edges,1000*latency)
+        self.latency_histogram[bin_idx] += 1
+
+        if self.previous_tstamp is None:
+            self.previous_tstamp = tstamp
+            return
+
+        interval = tstamp - self.previous_tstamp
+        if interval<=0:
+            self.stats['out of order'] += 1
+            return
+        self.previous_tstamp = tstamp
+
+        if self.period is None:
+            self.period_estimate_list.append(interval)
+            if len(self.period_estimate_list)<16: return
+            self.period = float(np.median(self.period_estimate_list))
+            self.period_estimate_list = []
+            self.log('estimated packet period: %.6f seconds' % self.period,verbosity=1)
+
+        if interval>1.5*self.period:
+            nmissing = int(round(interval/self.period)) - 1
+            self.stats['gaps'] += 1
+            self.stats['missing'] += nmissing
+            self.stats['dead time'] += interval - self.period
+            self.log('gap of %.3f seconds (%i packets missing)' % (interval,nmissing),verbosity=2)
+        return
+
+    def check_stats_interval(self):
+        '''
+        write the statistics if the interval has passed
+        '''
+        if time.time() - self.stats['start'] < self.stats_interval: return
+        self.write_stats()
+        self.reset_stats()
+        return
+
+    def write_stats(self):
+        '''
+        write the statistics to file
+        '''
+        npackets = self.stats['packets']
+        if npackets>0:
+            latency_mean = self.stats['latency sum']/npackets
+        else:
+            latency_mean = 0.0
+        if self.period is None:
+            period = 0.0
+        else:
+            period = self.period
+
+        columns = ['%.3f' % self.stats['start'],
+                   '%.3f' % (time.time() - self.stats['start']),
+                   '%i' % npackets,
+                   '%i' % self.stats['missing'],
+                   '%i' % self.stats['gaps'],
+                   '%.3f' % self.stats['dead time'],
+                   '%i' % self.stats['out of order'],
+                   '%i' % self.stats['bad size'],
+                   '%i' % self.stats['timeouts'],
+                   '%i' % self.stats['kernel drops'],
+                   '%i' % self.rcvbuf,
+                   '%.6f' % period,
+                   '%.6f' % latency_mean,
+                   '%.6f' % self.stats['latency max']]
+        columns += ['%i' % val for val in self.latency_histogram]
+        line = ' '.join(columns)
+
+        write_header = not os.path.isfile(self.statsfile)
+        try:
+            h = open(self.statsfile,'a')
+            if write_header: h.write(self.stats_header())
+            h.write(line+'\n')
+            h.close()
+        except:
+            self.log('ERROR! Could not write statistics file: %s' % self.statsfile)
+
+        self.log('%i packets, %i missing, %.3fs dead time, %i out of order, %i kernel drops, latency mean=%.3fms max=%.3fms'
+                 % (npackets,
+                    self.stats['missing'],
+                    self.stats['dead time'],
+                    self.stats['out of order'],
+                    self.stats['kernel drops'],
+                    1000*latency_mean,
+                    1000*self.stats['latency max']),
+                 verbosity=1)
+        return
+
+    def stats_header(self):
+        '''
+        description of the columns in the statistics file
+        '''
+        hist_labels = ['<%ims' % edge for edge in latency_bin_edges] + ['>=%ims' % latency_bin_edges[-1]]
+        columns = ['start','interval','packets','missing','gaps','deadtime','out_of_order','bad_size',
+                   'timeouts','kernel_drops','rcvbuf','period','latency_mean','latency_max'] + hist_labels
+        return '# %s\n' % ' '.join(columns)
+
+    def close(self):
+        '''
+        write the final statistics and close the socket
+        '''
+        self.write_stats()
+        self.sock.close()
+        return
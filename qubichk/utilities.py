@@ -10,11 +10,12 @@ $license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
 
 utilities used by various modules in qubichk/hw especially hk_verify
 '''
-import sys,os,subprocess,re,struct
+import sys,os,subprocess,struct
 import numpy as np
 from astropy.coordinates import SkyCoord, EarthLocation, AltAz, get_body, angular_separation
 from astropy.time import Time as astrotime
 from satorchipy.datefunctions import utcnow
+from qubichk.netprobe import probe_hosts
 
 # format to use for log output
 log_datefmt = '%Y-%m-%dT%H:%M:%S UT'
@@ -188,61 +189,72 @@ def shellcommand(cmd):
     return out.decode().strip(),err.decode().strip()
 
 
-def ping(machine,verbosity=1):
+def ping(machine,verbosity=1,count=1,timeout=2.0):
     '''
     ping a machine to make sure it's online
     '''
-    retval = {}
-    retval['machine'] = machine
-    retval['ok'] = True
-    retval['error_message'] = ''
-    retval['message'] = ''
-
-    msg = 'checking connection to %s...' % machine
-    retval['message'] = msg
-    if verbosity>0: print(msg, end='', flush=True)
-    
-    cmd = 'ping -c1 %s' % machine
-    out,err = shellcommand(cmd)
-
-    match = re.search('([0-9]*%) packet loss',out)
-    if match is None:
-        retval['ok'] = False
-        msg = 'Could not determine network packet loss to %s' % machine
-        retval['error_message'] = msg
-        if verbosity>0: print('UNREACHABLE!\n--> %s' % msg)
-        return retval
-
-    packet_loss_str = match.groups()[0].replace('%','')
-    packet_loss = float(packet_loss_str)
-
-    if packet_loss > 99.0:
-        retval['ok'] = False
-        retval['error_message'] = 'unreachable'
-        retval['message'] += 'UNREACHABLE'
-        msg = 'UNREACHABLE!\n--> %s is unreachable.' % machine
-        if machine=='modulator':
-            msg += ' This is okay if carbon fibre is off.'
-        elif machine=='horns':
-            msg += ' This is okay for normal observations (no calsource).'
-        else:
-            msg += ' Please make sure it is switched on and connected to the housekeeping network'
-        if verbosity>0: print(msg)
-        return retval
+    return ping_machines([machine],verbosity=verbosity,count=count,timeout=timeout)[machine]
+
+def ping_machines(machines,verbosity=1,count=1,timeout=2.0):
+    '''
+    ping a list of machines to make sure they are online
+    all the machines are checked at the same time (see netprobe.py)
+    return a dictionary with the result for each machine
+    '''
+    results = probe_hosts(machines,count=count,timeout=timeout)
+
+    retvals = {}
+    for machine in machines:
+        result = results[machine]
+        retval = {}
+        retval['machine'] = machine
+        retval['ok'] = True
+        retval['error_message'] = ''
+        retval['message'] = ''
+        retval['loss'] = result['loss']
+        retval['latency'] = result['rtt mean']
+        retval['probe'] = result
+        retvals[machine] = retval
+
+        msg = 'checking connection to %s...' % machine
+        retval['message'] = msg
+        if verbosity>0: print(msg, end='', flush=True)
+
+        if result['address'] is None:
+            retval['ok'] = False
+            msg = 'Could not determine network packet loss to %s' % machine
+            retval['error_message'] = msg
+            if verbosity>0: print('UNREACHABLE!\n--> %s' % msg)
+            continue
+
+        packet_loss = result['loss']
+        if packet_loss > 99.0:
+            retval['ok'] = False
+            retval['error_message'] = 'unreachable'
+            retval['message'] += 'UNREACHABLE'
+            msg = 'UNREACHABLE!\n--> %s is unreachable.' % machine
+            if machine=='modulator':
+                msg += ' This is okay if carbon fibre is off.'
+            elif machine=='horns':
+                msg += ' This is okay for normal observations (no calsource).'
+            else:
+                msg += ' Please make sure it is switched on and connected to the housekeeping network'
+            if verbosity>0: print(msg)
+            continue
     
-    if packet_loss > 0.0:
-        retval['ok'] = False
-        retval['error_message'] = 'Unstable network'
-        retval['message'] += 'UNREACHABLE'
-        msg = 'ERROR!\n--> Unstable network to %s.' % machine
-        msg += '  Please make sure the ethernet cable is well connected'
-        if verbosity>0: print(msg)
-        return retval
-
-    retval['message'] += 'OK'
-    if verbosity>0: print('OK')
+        if packet_loss > 0.0:
+            retval['ok'] = False
+            retval['error_message'] = 'Unstable network'
+            retval['message'] += 'UNREACHABLE'
+            msg = 'ERROR!\n--> Unstable network to %s.' % machine
+            msg += '  Please make sure the ethernet cable is well connected'
+            if verbosity>0: print(msg)
+            continue
+
+        retval['message'] += 'OK'
+        if verbosity>0: print('OK (%.1f ms)' % (1000*result['rtt mean']))
     
-    return retval
+    return retvals
 
 def read_conf_file(filename):
     '''
@@ -352,11 +364,82 @@ def bytes2str(somebytes):
     bytes_str = ' '.join(bytes_list)
     return bytes_str
 
+# parsed DAC offset tables, keyed by filename.  Each entry is (modification time, table)
+DACoffsetTable_cache = {}
+
+def parse_DACoffsetTable(filename):
+    '''
+    read and validate the text file with the DAC offset table for one ASIC
+    there is one value per line, with comments marked by #
+    '''
+    h = open(filename,'r')
+    lines = h.read().split('\n')
+    h.close()
+
+    offsetTable = np.zeros(128,dtype=float)
+    table_idx = 0
+    for line in lines:
+        line = line.split('#')[0].strip()
+        if len(line)==0: continue
+
+        if table_idx>=128:
+            print('ERROR! too many values in DAC offset table.  Ignoring the rest: %s' % filename)
+            break
+        
+        try:
+            val = float(line)
+        except:
+            print('ERROR!  TES%03i - unable to interpret value: %s' % (table_idx+1,line))
+            val = 0.0
+
+        if not np.isfinite(val):
+            print('ERROR!  TES%03i - invalid value: %s' % (table_idx+1,line))
+            val = 0.0
+
+        offsetTable[table_idx] = val
+        table_idx += 1
+
+    if table_idx<128:
+        print('ERROR! only %i values in DAC offset table.  The rest are zero: %s' % (table_idx,filename))
+    return offsetTable
+
+def read_DACoffsetTable_cached(filename):
+    '''
+    get the DAC offset table, reading the text file only if it has changed
+    The parsed table is kept in memory, and also in a binary file next to the text file (filename.cache)
+    The binary file has the modification time of the text file followed by the 128 values.
+    '''
+    mtime = os.path.getmtime(filename)
+    if filename in DACoffsetTable_cache.keys():
+        cache_mtime,offsetTable = DACoffsetTable_cache[filename]
+        if cache_mtime==mtime: return offsetTable.copy()
+
+    cache_filename = filename+'.cache'
+    if os.path.isfile(cache_filename):
+        try:
+            cache = np.fromfile(cache_filename,dtype='<f8')
+        except:
+            cache = np.zeros(0)
+        if len(cache)==129 and cache[0]==mtime:
+            offsetTable = cache[1:]
+            DACoffsetTable_cache[filename] = (mtime,offsetTable)
+            return offsetTable.copy()
+
+    offsetTable = parse_DACoffsetTable(filename)
+    DACoffsetTable_cache[filename] = (mtime,offsetTable)
+    cache = np.concatenate(([mtime],offsetTable)).astype('<f8')
+    try:
+        cache.tofile(cache_filename)
+    except:
+        pass # the directory is not writable.  We keep only the cache in memory.
+    return offsetTable.copy()
+
 def read_DACoffsetTables():
     '''
     read DAC offset table for ASICs
     files are to be found in standard places, usually $HOME/.local/share/qubic
     and are named DAC-Offset-Table_ASICnn.txt
+    the text files are parsed only if they have changed (see read_DACoffsetTable_cached)
     '''
     offsetTables = {}
     for asic_idx in range(16):
@@ -365,32 +448,7 @@ def read_DACoffsetTables():
         offset_filename_fullpath = get_fullpath(offset_filename)
         if offset_filename_fullpath is None: continue
 
-        h = open(offset_filename_fullpath,'r')
-        lines = h.read().split('\n')
-        h.close()
-
-        offsetTable = np.zeros(128,dtype=float)
-        table_idx = 0
-        for line in lines:
-            if line.find('#')==0: continue
-
-            if line.find('#')>0:
-                line = line.split('#')[0]
-
-            if len(line)==0: continue
-
-            try:
-                val = eval(line)
-            except:
-                val = line
-
-            if isinstance(val,str):
-                print('ERROR!  TES%03i - unable to interpret value: %s' % (table_idx+1,val))
-                val = 0.0
-
-            offsetTable[table_idx] = val
-            table_idx += 1
-        offsetTables[asic_num] = offsetTable
+        offsetTables[asic_num] = read_DACoffsetTable_cached(offset_filename_fullpath)
 
     return offsetTables
 
@@ -11,12 +11,14 @@ $license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
 use the Arduino Uno as an ADC to monitor the signal generator
 
 '''
-import socket,serial,time,multiprocessing,os,pathlib
+import serial,time,multiprocessing,os,pathlib
 from glob import glob
 import numpy as np
 import datetime as dt
 import struct
 from satorchipy.datefunctions import utcnow
+from qubichw.calsource_demodulator import calsource_demodulator, get_modulation_frequency
+from qubichk.udp_receiver import udp_receiver
 
 class arduino:
     '''
@@ -31,6 +33,8 @@ class arduino:
         if self.connection!='serial': self.connection='socket'
 
         self.broadcast_port = 31337
+        self.data_rate = 300. # samples per second sent by read_calsource.py
+        self.modulation_frequency = None # for the demodulation, kept from one acquisition to the next
         self.s = None
         self.port = port
         self.assign_logfile()
@@ -207,12 +211,18 @@ class arduino:
         
         return True
     
-    def acquire(self,duration=None):
+    def acquire(self,duration=None,demodulate=False,modulation_frequency=None,rcvbuf=None):
         '''
         acquire data with timestamps from the Arduino Uno
 
         duration is given in seconds
 
+        if demodulate is True, the signal is demodulated on-the-fly and the result is broadcast (see calsource_demodulator)
+        the modulation frequency is read from the modulator if not given, and kept for the next acquisitions
+
+        rcvbuf is the socket receive buffer size in bytes (default is the system default)
+        packet loss and latency statistics are written to calsource_rxstats.txt
+
 
         Fri 12 Apr 2019 14:17:47 CEST:  change of behaviour.
         we don't return the data, we return the filename with the data
@@ -222,6 +232,11 @@ class arduino:
         if not self.connected: return None,None
         self.clear_interrupt_flag()
 
+        # ask for the modulation frequency before listening to the Arduino
+        if modulation_frequency is not None: self.modulation_frequency = modulation_frequency
+        if demodulate and self.connection!='serial' and self.modulation_frequency is None:
+            self.modulation_frequency = get_modulation_frequency()
+
         if duration is None:
             dt_duration=dt.timedelta(minutes=5)
         else:
@@ -231,12 +246,22 @@ class arduino:
         if self.connection=='serial':
             self.s.flush()
         else:            
-            client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # UDP
-            client.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            #client.settimeout(2.0)
-            client.bind(('', self.broadcast_port))
+            fmts = '<Bdq'
+            client = udp_receiver('calsource','',self.broadcast_port,struct.calcsize(fmts),
+                                  period=1/self.data_rate,
+                                  rcvbuf=rcvbuf)
             self.log('listening to Arduino on socket port %i' % self.broadcast_port)
 
+        demodulator = None
+        if demodulate:
+            if self.connection=='serial':
+                self.log('demodulation is only available for socket acquisition')
+            elif self.modulation_frequency is None:
+                self.log('ERROR! No modulation frequency.  No demodulation')
+            else:
+                demodulator = calsource_demodulator(frequency=self.modulation_frequency,publish=True)
+                if demodulator.frequency is None: demodulator = None
+
         #y=[]
         #t=[]
         start_time = utcnow()
@@ -259,7 +284,7 @@ class arduino:
         else:
             counter = 0
             while now < end_time and not os.path.isfile(self.interrupt_flag_file):
-                x, addr = client.recvfrom(1024)
+                x, addr = client.recv()
 
                 # Mon 29 Apr 2019 16:31:25 CEST
                 # now we are using the ADC on the Raspberry Pi and not the Arduino
@@ -274,13 +299,13 @@ class arduino:
                 #dat = x.strip().split()
                 #tstamp = dat[0]
                 #val = dat[1]
-                fmts = '<Bdq'
                 data_tuple = struct.unpack(fmts,x)
                 stx = data_tuple[0]
                 tstamp = data_tuple[1]
                 val = data_tuple[2]
 
                 h.write('%.6f %i\n' % (tstamp,val))
+                if demodulator is not None: demodulator.add_sample(tstamp,val)
                 
                 #y.append(val)
                 #t.append(now)
@@ -288,6 +313,7 @@ class arduino:
             
         end_time = now
         h.close()
+        if self.connection=='socket': client.close()
         self.log('output file written: %s' % outfile)
         self.log('started data acquisition at %s' %  start_time.strftime('%Y-%m-%d %H:%M:%S.%f UTC'))
         self.log('  ended data acquisition at %s' % end_time.strftime('%Y-%m-%d %H:%M:%S.%f UTC'))
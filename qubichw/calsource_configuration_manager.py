@@ -59,7 +59,7 @@ class calsource_configuration_manager():
         self.assign_variables(role)
         if self.role == 'manager':
             self.listen_loop()
-        elif self.role == 'bot':
+        elif self.role == 'bot' or self.role == 'demodulator':
             pass # create object but don't go into the Command Line Interface loop.
         else:
             self.command_loop()
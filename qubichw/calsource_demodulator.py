@@ -0,0 +1,297 @@
+'''
+$Id: calsource_demodulator.py
+$auth: Steve Torchinsky <satorchi@apc.in2p3.fr>
+$created: Mon 19 Oct 2026 09:12:37 CEST
+$license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
+
+          This is free software: you are free to change and
+          redistribute it.  There is NO WARRANTY, to the extent
+          permitted by law.
+
+online lock-in demodulation of the calibration source monitor signal
+
+The samples received by arduino.acquire() are demodulated as they arrive.
+For each sample we accumulate the sums needed for a least-squares fit of
+    offset + a*cos(2*pi*f*t) + b*sin(2*pi*f*t)
+into one-second bins.  The fit is done over a sliding window of the most recent bins,
+so memory is bounded by the number of bins in the window, and not by the acquisition length.
+
+The result follows the same convention as arduino.sin_curve():
+    offset + amplitude*sin(2*pi*t/period + shift)
+'''
+import socket,math
+import numpy as np
+from satorchipy.datefunctions import utcnow, utcfromtimestamp
+from qubichk.utilities import get_receiver_list
+from qubichw.calsource_configuration_manager import calsource_configuration_manager
+
+# the demodulated result is sent as a numpy record, like the other calbox broadcasts
+rec_names = 'STX,timestamp,frequency,amplitude,phase,offset,rms,npts'
+rec_formats = 'uint8,float64,float32,float32,float32,float32,float32,int32'
+rec = np.recarray(names=rec_names,formats=rec_formats,shape=(1))
+rec[0].STX = 0xAA
+packetsize = rec.nbytes
+
+PORT = 31338
+
+# index of the running sums for each bin
+sum_keys = ['n','c','s','cc','cs','ss','v','vc','vs','vv']
+nsums = len(sum_keys)
+
+
+def parse_modulation_frequency(ack,channel=1):
+    '''
+    find the modulator frequency in the status acknowledgement from the calsource configuration manager
+    the acknowledgement contains items like: modulator_ch1:frequency=0.700
+    '''
+    if isinstance(ack,bytes): ack = ack.decode()
+
+    findstr = 'modulator_ch%i:frequency=' % channel
+    for item in ack.split():
+        if item.find(findstr)!=0: continue
+        val_str = item.replace(findstr,'')
+        try:
+            frequency = float(val_str)
+        except:
+            return None
+        return frequency
+
+    return None
+
+def get_modulation_frequency(channel=1,timeout=20):
+    '''
+    ask the calsource configuration manager for the modulator state and return the modulation frequency in Hz
+    this can take up to the acknowledgement timeout (see calsource_configuration_manager.listen_for_acknowledgement),
+    so it should be done once, before the acquisition, and not for every file.
+    The acknowledgement arrives on a fixed port, so it fails if another program on this machine
+    is waiting for an acknowledgement at the same time (for example, the bot)
+    '''
+    try:
+        cli = calsource_configuration_manager(role='demodulator', verbosity=0)
+        cli.send_command('status')
+        retval = cli.listen_for_acknowledgement(timeout=timeout)
+    except OSError:
+        print('ERROR! Could not ask the calibration source manager for the modulation frequency')
+        return None
+    if retval is None: return None
+
+    tstamp,ack = retval
+    return parse_modulation_frequency(ack,channel=channel)
+
+
+class calsource_demodulator:
+    '''
+    class for streaming lock-in demodulation of the calsource signal
+
+    Arguments:
+
+    frequency: the modulation frequency in Hz.  If None, it is read from the modulator state (see get_modulation_frequency)
+    channel: the modulator output channel used for the calibration source
+    integration: the bin size in seconds.  One result is given per bin (default 1 second)
+    window: the number of bins used for the fit.  Default is the number of bins covering one modulation period
+    publish: broadcast the results on socket
+    verbosity: level of verboseness for printing to screen
+    '''
+
+    def __init__(self,
+                 frequency=None,
+                 channel=1,
+                 integration=None,
+                 window=None,
+                 publish=False,
+                 verbosity=0
+                 ):
+        self.verbosity_threshold = verbosity
+        self.channel = channel
+
+        if integration is None:
+            self.integration = 1.0
+        else:
+            self.integration = integration
+        self.window_request = window
+
+        self.publish = publish
+        self.sock = None
+        self.receivers = []
+        if self.publish:
+            self.receivers = get_receiver_list('calbox.conf')
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+        self.frequency = None
+        if frequency is None:
+            frequency = get_modulation_frequency(channel=self.channel)
+        if frequency is None:
+            self.log('ERROR! Could not get the modulation frequency')
+        else:
+            self.set_frequency(frequency)
+        return None
+
+    def log(self,msg,verbosity=0):
+        '''
+        print a statement if we are sufficiently verbose
+        '''
+        if verbosity>self.verbosity_threshold: return
+        print('%s|DEMODULATOR|%s' % (utcnow().strftime('%Y-%m-%d %H:%M:%S'),msg))
+        return
+
+    def set_frequency(self,frequency):
+        '''
+        assign the modulation frequency and reset the accumulated sums
+        return False if the frequency is not valid
+        '''
+        if frequency is None or not np.isfinite(frequency) or frequency<=0:
+            self.log('ERROR! Invalid modulation frequency: %s' % frequency)
+            self.frequency = None
+            return False
+        self.frequency = frequency
+        self.omega = 2*np.pi*frequency
+
+        if self.window_request is None:
+            self.window = max(1,int(np.ceil(1/(frequency*self.integration))))
+        else:
+            self.window = self.window_request
+
+        self.bins = np.zeros((self.window,nsums),dtype=float)
+        self.bin_idx = 0
+        self.nbins_filled = 0
+        self.bin_end = None
+        self.clear_sums()
+        self.log('modulation frequency: %.4f Hz, fit window: %i x %.1f seconds' % (frequency,self.window,self.integration),verbosity=1)
+        return True
+
+    def clear_sums(self):
+        '''
+        reset the running sums for the current bin
+        '''
+        self.sums = [0.0]*nsums
+        return
+
+    def add_sample(self,tstamp,val):
+        '''
+        add a sample to the running sums.
+        return the demodulated result if a bin was completed, otherwise return None
+        '''
+        if self.frequency is None: return None
+
+        result = None
+        if self.bin_end is None:
+            self.bin_end = (math.floor(tstamp/self.integration) + 1)*self.integration
+        elif tstamp>=self.bin_end:
+            result = self.close_bin()
+            # empty bins if there is a gap in the data
+            nskip = min(self.window,int((tstamp-self.bin_end)//self.integration))
+            for idx in range(nskip):
+                self.close_bin(dofit=False)
+            self.bin_end = (math.floor(tstamp/self.integration) + 1)*self.integration
+
+        phi = self.omega*tstamp
+        c = math.cos(phi)
+        s = math.sin(phi)
+        sums = self.sums
+        sums[0] += 1
+        sums[1] += c
+        sums[2] += s
+        sums[3] += c*c
+        sums[4] += c*s
+        sums[5] += s*s
+        sums[6] += val
+        sums[7] += val*c
+        sums[8] += val*s
+        sums[9] += val*val
+        return result
+
+    def close_bin(self,dofit=True):
+        '''
+        put the current bin into the sliding window and do the fit
+        '''
+        self.bins[self.bin_idx,:] = self.sums
+        self.bin_idx = (self.bin_idx + 1) % self.window
+        if self.nbins_filled<self.window: self.nbins_filled += 1
+        tstamp = self.bin_end
+        self.clear_sums()
+        if not dofit: return None
+
+        result = self.fit(tstamp)
+        if result is not None and self.publish: self.send_result(result)
+        return result
+
+    def fit(self,tstamp=None):
+        '''
+        least-squares fit of offset, cosine, and sine over the sliding window
+        '''
+        n,c,s,cc,cs,ss,v,vc,vs,vv = self.bins.sum(axis=0)
+        if n<3: return None
+
+        A = np.array([[n, c, s ],
+                      [c, cc,cs],
+                      [s, cs,ss]])
+        B = np.array([v,vc,vs])
+        try:
+            offset,a,b = np.linalg.solve(A,B)
+        except np.linalg.LinAlgError:
+            self.log('ERROR! singular matrix for demodulation',verbosity=1)
+            return None
+
+        # residual sum of squares without keeping the samples
+        chi2 = vv - (offset*v + a*vc + b*vs)
+        if chi2<0: chi2 = 0.0
+
+        result = {}
+        result['timestamp'] = tstamp
+        result['frequency'] = self.frequency
+        result['amplitude'] = np.sqrt(a**2 + b**2)
+        result['phase'] = np.arctan2(a,b)
+        result['offset'] = offset
+        result['rms'] = np.sqrt(chi2/n)
+        result['npts'] = int(n)
+        result['complete'] = self.nbins_filled==self.window
+        self.log('%17.6f amplitude=%.2f phase=%+.3f offset=%.2f rms=%.2f npts=%i'
+                 % (tstamp,result['amplitude'],result['phase'],result['offset'],result['rms'],result['npts']),verbosity=2)
+        return result
+
+    def send_result(self,result):
+        '''
+        broadcast the demodulated result
+        '''
+        for key in rec.dtype.names[1:]:
+            rec[key][0] = result[key]
+        for rx in self.receivers:
+            try:
+                self.sock.sendto(rec,(rx,PORT))
+            except:
+                self.log('ERROR! Could not send demodulation result to %s' % rx,verbosity=1)
+        return
+
+
+def monitor_demodulation(listener=None,timeout=5):
+    '''
+    listen for the demodulated calsource results on socket and print them to screen
+    '''
+    if listener is None: listener = ''
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    client.settimeout(timeout)
+    client.bind((listener,PORT))
+    print_fmt = '%s | f=%.4f Hz amplitude=%10.2f phase=%+7.3f offset=%10.2f rms=%8.2f npts=%i'
+
+    while True:
+        try:
+            dat = client.recv(packetsize)
+        except socket.timeout:
+            print('%s timeout error on socket' % utcnow().strftime('%Y-%m-%d %H:%M:%S'))
+            continue
+        except KeyboardInterrupt:
+            print('exit using ctrl-c')
+            return
+
+        result = np.frombuffer(dat,dtype=rec.dtype)[0]
+        date_str = utcfromtimestamp(result['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
+        print(print_fmt % (date_str,
+                           result['frequency'],
+                           result['amplitude'],
+                           result['phase'],
+                           result['offset'],
+                           result['rms'],
+                           result['npts']))
+    return
@@ -0,0 +1,216 @@
+'''
+$Id: pid_control.py
+$auth: Steve Torchinsky <satorchi@apc.in2p3.fr>
+$created: Mon 19 Oct 2026 14:21:05 CEST
+$license: GPLv3 or later, see https://www.gnu.org/licenses/gpl-3.0.txt
+
+          This is free software: you are free to change and
+          redistribute it.  There is NO WARRANTY, to the extent
+          permitted by law.
+
+Proportional-Integral-Derivative control with a sliding window linear regression
+https://en.wikipedia.org/wiki/Proportional%E2%80%93integral%E2%80%93derivative_controller
+
+The regression is updated with running sums, so each new sample costs O(1)
+instead of refitting the whole window with np.polyfit.
+This is used by the MCP9808 calbox temperature controller, and can be used by other control loops (eg. heater)
+'''
+import numpy as np
+
+class sliding_regression:
+    '''
+    least-squares straight line fit over a sliding window of the most recent samples
+
+    Arguments:
+
+    npts: the number of samples in the window
+    '''
+
+    def __init__(self,npts):
+        self.npts = npts
+        self.x_buffer = np.zeros(npts,dtype=float)
+        self.y_buffer = np.zeros(npts,dtype=float)
+        self.idx = 0 # circular buffer index.  This is where the next sample goes (i.e. the oldest sample).
+        self.count = 0
+        self.nupdates = 0
+        self.recompute()
+        return None
+
+    def recompute(self):
+        '''
+        calculate the sums from the buffer
+        this is done regularly to avoid accumulating rounding errors in the running sums
+        the x values are relative to the oldest sample to keep the sums small
+        '''
+        n = min(self.count,self.npts)
+        if n==0:
+            self.x_ref = 0.0
+            x = np.zeros(0)
+            y = np.zeros(0)
+        else:
+            oldest_idx = self.idx if self.count>=self.npts else 0
+            self.x_ref = self.x_buffer[oldest_idx]
+            x = self.x_buffer[:n] - self.x_ref
+            y = self.y_buffer[:n]
+        self.Sx = x.sum()
+        self.Sy = y.sum()
+        self.Sxx = (x*x).sum()
+        self.Sxy = (x*y).sum()
+        self.nupdates = 0
+        return
+
+    def add(self,x,y):
+        '''
+        add a sample, replacing the oldest one if the window is full
+        '''
+        if self.count>=self.npts:
+            x_old = self.x_buffer[self.idx] - self.x_ref
+            y_old = self.y_buffer[self.idx]
+            self.Sx -= x_old
+            self.Sy -= y_old
+            self.Sxx -= x_old*x_old
+            self.Sxy -= x_old*y_old
+
+        # the first sample is the reference, so the sums are small from the start (eg. x is a Unix timestamp)
+        if self.count==0: self.x_ref = x
+
+        self.x_buffer[self.idx] = x
+        self.y_buffer[self.idx] = y
+        self.idx = (self.idx + 1) % self.npts
+        self.count += 1
+
+        x_new = x - self.x_ref
+        self.Sx += x_new
+        self.Sy += y
+        self.Sxx += x_new*x_new
+        self.Sxy += x_new*y
+
+        self.nupdates += 1
+        if self.nupdates>=self.npts: self.recompute()
+        return
+
+    def is_full(self):
+        '''
+        check if the window is filled
+        '''
+        return self.count>=self.npts
+
+    def n(self):
+        '''
+        the number of samples currently in the window
+        '''
+        return min(self.count,self.npts)
+
+    def oldest(self):
+        '''
+        the x value of the oldest sample in the window
+        '''
+        if self.count>=self.npts: return self.x_buffer[self.idx]
+        return self.x_buffer[0]
+
+    def newest(self):
+        '''
+        the x value of the most recent sample
+        '''
+        return self.x_buffer[self.idx-1]
+
+    def interval(self):
+        '''
+        the x interval covered by the window
+        '''
+        return self.newest() - self.oldest()
+
+    def mean(self):
+        '''
+        the mean of the y values
+        '''
+        n = self.n()
+        if n==0: return None
+        return self.Sy/n
+
+    def sum(self):
+        '''
+        the sum of the y values
+        '''
+        return self.Sy
+
+    def fit(self):
+        '''
+        return slope and intercept, the same as np.polyfit(x,y,1)
+        '''
+        n = self.n()
+        denominator = n*self.Sxx - self.Sx**2
+        if n<2 or denominator==0: return None,None
+        slope = (n*self.Sxy - self.Sx*self.Sy)/denominator
+        intercept = (self.Sy - slope*self.Sx)/n - slope*self.x_ref
+        return slope,intercept
+
+    def slope(self):
+        '''
+        the slope of the straight line fit
+        '''
+        return self.fit()[0]
+
+
+class pid_controller:
+    '''
+    PID controller using the sliding window regression
+
+    Arguments:
+
+    setpoint: the target value
+    npts: the number of samples in the window for calculating the PID terms
+    Kp, Ki, Kd: gain factors for the PID
+    integral: include the integral term
+    derivative: include the derivative term
+    '''
+
+    def __init__(self,setpoint,npts,Kp=1,Ki=1,Kd=1,integral=True,derivative=True):
+        self.setpoint = setpoint
+        self.Kp = Kp
+        self.Ki = Ki
+        self.Kd = Kd
+        self.use_integral = integral
+        self.use_derivative = derivative
+        self.regression = sliding_regression(npts)
+        return None
+
+    def add(self,tstamp,val):
+        '''
+        add a measurement
+        '''
+        self.regression.add(tstamp,val - self.setpoint)
+        return
+
+    def is_ready(self):
+        '''
+        check if there are enough samples to calculate the PID
+        '''
+        return self.regression.is_full()
+
+    def PID(self):
+        '''
+        calculate the Proportional-Integral-Derivative terms and the control function
+        the terms are the same as previously calculated in MCP9808.PID() with np.polyfit
+        '''
+        interval = self.regression.interval()
+
+        # Proportional
+        P = self.Kp * self.regression.mean()
+
+        # Integral
+        I = 0.0
+        if self.use_integral and interval>0:
+            I = self.Ki * self.regression.sum() / interval
+
+        # Derivative
+        D = 0.0
+        if self.use_derivative:
+            m = self.regression.slope()
+            if m is not None:
+                D = self.Kd * m * interval
+
+        # Control function
+        U = P + I + D
+
+        return P,I,D,U
@@ -24,6 +24,8 @@ if os.uname().machine.find('arm')>=0:
 import datetime as dt
 import numpy as np
 from qubichk.utilities import get_myip, get_receiver_list
+from qubichk.udp_receiver import udp_receiver
+from qubichw.pid_control import pid_controller
 from satorchipy.datefunctions import utcnow
 
 # 4 sensors in the calsource box
@@ -135,6 +137,9 @@ class MCP9808:
             self.Kd = Kd
         
         self.verbosity_threshold = verbosity
+
+        # interval in seconds for reporting the CPU use and timing jitter of the sampling loop
+        self.timing_report_interval = 600
         return
 
     def log(self,msg,verbosity=0):
@@ -195,26 +200,9 @@ class MCP9808:
         https://en.wikipedia.org/wiki/Proportional%E2%80%93integral%E2%80%93derivative_controller
 
         The data is updated in broadcast_temperatures()
+        The regression over the PID interval is updated incrementally (see pid_control.py)
         '''
-
-        # Proportional
-        error_value = self.PID_temperature_buffer - self.setpoint_temperature
-        P = self.Kp * error_value.mean()
-
-        # Integral
-        error_sum = error_value.sum()
-        interval = self.PID_tstamp_buffer[-1] - self.PID_tstamp_buffer[0]
-        I = self.Ki * error_sum / interval
-
-        # Derivative
-        fitresult = np.polyfit(self.PID_tstamp_buffer,error_value,1)
-        m = fitresult[0]
-        D = self.Kd * m * interval
-
-        # Control function
-        U = P + I + D
-
-        return P,I,D,U
+        return self.PID_controller.PID()
 
     def control_action(self,tstamp,control_value):
         '''
@@ -233,6 +221,70 @@ class MCP9808:
         self.PID_log_handle.flush()
         return
 
+    def wait_for_next_sample(self):
+        '''
+        sleep until the next scheduled sample time
+        the schedule is fixed from the start time so that there is no accumulated drift
+        if we are late by more than a sample period, we skip to the next slot in the schedule
+        '''
+        self.sample_counter += 1
+        next_sample_tstamp = self.schedule_start + self.sample_counter*self.sample_period
+        now_tstamp = time.monotonic()
+        if now_tstamp > next_sample_tstamp + self.sample_period:
+            nskip = int((now_tstamp - next_sample_tstamp)/self.sample_period)
+            self.timing_stats['skipped'] += nskip
+            self.sample_counter += nskip
+            next_sample_tstamp += nskip*self.sample_period
+            
+        wait = next_sample_tstamp - now_tstamp
+        if wait>0: time.sleep(wait)
+
+        # timing jitter is the difference between the scheduled time and the actual time
+        jitter = time.monotonic() - next_sample_tstamp
+        self.timing_stats['n'] += 1
+        self.timing_stats['jitter sum'] += jitter
+        self.timing_stats['jitter sum2'] += jitter**2
+        if abs(jitter) > self.timing_stats['jitter max']: self.timing_stats['jitter max'] = abs(jitter)
+        return
+
+    def reset_timing_stats(self):
+        '''
+        reset the statistics for CPU use and timing jitter
+        '''
+        self.timing_stats = {}
+        self.timing_stats['n'] = 0
+        self.timing_stats['skipped'] = 0
+        self.timing_stats['jitter sum'] = 0.0
+        self.timing_stats['jitter sum2'] = 0.0
+        self.timing_stats['jitter max'] = 0.0
+        self.timing_stats['wall start'] = time.monotonic()
+        self.timing_stats['cpu start'] = time.process_time()
+        return
+
+    def report_timing_stats(self):
+        '''
+        report the CPU use and timing jitter at regular intervals
+        '''
+        wall_delta = time.monotonic() - self.timing_stats['wall start']
+        if wall_delta < self.timing_report_interval: return
+
+        npts = self.timing_stats['n']
+        if npts==0: return
+        cpu_delta = time.process_time() - self.timing_stats['cpu start']
+        jitter_mean = self.timing_stats['jitter sum']/npts
+        jitter_var = self.timing_stats['jitter sum2']/npts - jitter_mean**2
+        if jitter_var<0: jitter_var = 0.0
+        msg = 'timing: %.2f samples per second, CPU use %.1f%%, jitter mean=%.2fms rms=%.2fms max=%.2fms, %i samples skipped' \
+            % (npts/wall_delta,
+               100*cpu_delta/wall_delta,
+               1000*jitter_mean,
+               1000*np.sqrt(jitter_var),
+               1000*self.timing_stats['jitter max'],
+               self.timing_stats['skipped'])
+        self.log(msg,verbosity=0)
+        self.reset_timing_stats()
+        return
+    
     def broadcast_temperatures(self):
         '''
         read and broadcast the MCP9809 temperature data
@@ -253,14 +305,13 @@ class MCP9808:
         #    acquisition_rate in samples per second when there is *no* buffer
         #    number of samples to fill the buffer
         PID_npts = int(np.ceil(self.PID_interval*self.acquisition_rate/self.broadcast_buffer_npts))
-        self.PID_temperature_buffer = -np.ones(PID_npts,dtype=float)
-        self.PID_tstamp_buffer = -np.ones(PID_npts,dtype=float)
+        self.PID_controller = pid_controller(self.setpoint_temperature,PID_npts,Kp=self.Kp,Ki=self.Ki,Kd=self.Kd)
         tstamp_buffer_offset = date_now.timestamp() # so we don't need double float precision
-        FIFO_counter = 0
 
         self.PID_log_handle = open('PID_logger.txt','a')
 
         rec[0].STX = 0xAA
+        temperature_keys = ['T%i' % sensor for sensor in sensors]
         broadcast_buffer_idx = 0
         broadcast_temperature_buffer = -np.ones((self.broadcast_buffer_npts,nsensors),dtype=float)
         logmsg_list = ['entering temperature broadcast loop',
@@ -271,13 +322,13 @@ class MCP9808:
                        ]
         self.log('\n   '.join(logmsg_list),verbosity=0)
 
-        previous_sample_tstamp = utcnow().timestamp()
-        next_sample_tstamp = utcnow().timestamp()
+        self.sample_period = 1/self.acquisition_rate
+        self.schedule_start = time.monotonic()
+        self.sample_counter = 0
+        self.reset_timing_stats()
         while True:
-            now_tstamp = utcnow().timestamp()
-            if now_tstamp<next_sample_tstamp: continue
-            
             try:
+                self.wait_for_next_sample()
                 temperatures = self.read_temperatures()        
             except KeyboardInterrupt:
                 print('loop exit with ctrl-c')
@@ -293,7 +344,6 @@ class MCP9808:
                 continue
             else:
                 trycount = 0
-                next_sample_tstamp = utcnow().timestamp() + 1/self.acquisition_rate
 
             # add temperatures to the buffer
             broadcast_temperature_buffer[broadcast_buffer_idx,:] = temperatures
@@ -307,15 +357,10 @@ class MCP9808:
             # average the samples
             temperatures = broadcast_temperature_buffer.mean(axis=0)
                 
-                
             rec[0].timestamp = utcnow().timestamp()
-            for idx,sensor in enumerate(sensors):
-                fmt_idx = idx + 2
-                data_type = rec_formats_list[fmt_idx]
-                val = temperatures[idx]
-                cmd = 'rec[0].T%i = %f' % (sensor,val)
-                self.log('%16.6f | %16s | executing: %s' % (val,data_type,cmd),verbosity=3)
-                exec(cmd)
+            for idx,key in enumerate(temperature_keys):
+                rec[key][0] = temperatures[idx]
+            self.log('temperatures: %s' % rec,verbosity=3)
                     
             # broadcast the data
             for rx in receivers:
@@ -323,15 +368,13 @@ class MCP9808:
                 if self.verbosity_threshold==0: time.sleep(0.05) # need a delay before sending data again
                 sock.sendto(rec,(rx,PORT))
 
-            # FIFO for PID
-            self.PID_temperature_buffer = np.roll(self.PID_temperature_buffer,-1)
-            self.PID_temperature_buffer[-1] = temperatures[setpoint_sensor_idx]
-            self.PID_tstamp_buffer = np.roll(self.PID_tstamp_buffer,-1)
-            self.PID_tstamp_buffer[-1] = rec[0].timestamp - tstamp_buffer_offset
+            # sliding window for PID
+            self.PID_controller.add(rec[0].timestamp - tstamp_buffer_offset, temperatures[setpoint_sensor_idx])
+
+            self.report_timing_stats()
 
-            # if the buffer is completely filled, we continue to calculating the PID with every new sample (overkill?)
-            FIFO_counter += 1
-            if FIFO_counter<PID_npts: continue
+            # if the window is completely filled, we calculate the PID with every new sample (O(1) per sample)
+            if not self.PID_controller.is_ready(): continue
             
             # PID is calculated using the buffer values (not passed as arguments)
             PID_result = self.PID()
@@ -341,9 +384,10 @@ class MCP9808:
     
         return
 
-    def acquire_MCP9808_temperatures(self,listener=None):
+    def acquire_MCP9808_temperatures(self,listener=None,rcvbuf=None):
         '''
         read the MCP9808 temperature sensors on socket and write to file
+        rcvbuf is the socket receive buffer size in bytes (default is the system default)
         '''
         print_fmt = '%8i: 0x%X %s %8.4fs %10.2fK %10.2fK %10.2fK %10.2fK'
     
@@ -354,11 +398,13 @@ class MCP9808:
             return None
               
     
-        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        client.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        timeout = 3*self.broadcast_buffer_npts/self.acquisition_rate
-        client.settimeout(timeout)
-        client.bind((listener,PORT))
+        packet_period = self.broadcast_buffer_npts/self.acquisition_rate
+        timeout = 3*packet_period
+        client = udp_receiver('MCP9808',listener,PORT,packetsize,
+                              period=packet_period,
+                              rcvbuf=rcvbuf,
+                              timeout=timeout,
+                              verbosity=self.verbosity_threshold)
         h = open('calbox_temperatures.dat','ab')
 
         counter = 0
@@ -366,13 +412,14 @@ class MCP9808:
             counter += 1
             now_tstamp = dt.datetime.now().timestamp()
             try:
-                dat = client.recv(packetsize)
+                dat,addr = client.recv()
             except socket.timeout:
                 now_str = utcnow().strftime('%Y-%m-%d %H:%M:%S')
                 self.log('%8i: %s timeout error on socket' % (counter,now_str),verbosity=0)
                 continue
             except KeyboardInterrupt:
                 h.close()
+                client.close()
                 now_str = utcnow().strftime('%Y-%m-%d %H:%M:%S')
                 self.log('%8i: %s exit using ctrl-c' % (counter,now_str),verbosity=0)
                 return
@@ -16,10 +16,11 @@ manual:  simpleRTK2B-SBC-CNRS_APC_ICD_01.pdf
          https://box.in2p3.fr/index.php/s/JZ5JKEe8iDYF5Rt
 
 '''
-import serial, socket, time, struct
+import serial, socket, time, struct, re
 import datetime as dt
 import numpy as np
 from qubichk.utilities import get_myip, get_receiver_list
+from qubichk.udp_receiver import udp_receiver
 from mpl_toolkits.mplot3d import Axes3D
 from matplotlib import pyplot as plt
 from satorchipy.datefunctions import utcnow
@@ -40,72 +41,176 @@ chunksize = 4096 # size of ASCII chunk read from the GPS device
 
 PORT = 31337
 
-def read_gps_chunk(chunk,sock,verbosity=0):
+# GPAPS sentence: $GPAPS,hhmmss.ss,rpN,rpE,rpD,roll,yaw,pitchIMU,rollIMU,temperature*CS
+gpaps_pattern = re.compile(rb'\$?GPAPS,([^*$]*)\*([0-9A-Fa-f]{2})')
+n_values = len(keys)
+rate_report_interval = 60 # seconds between reports of the number of sentences per second
+
+class gpaps_parser:
     '''
-    read the lines of SimpleRTK info and broadcast
+    parse the GPAPS sentences from the SimpleRTK and broadcast the records
+
+    lines split across serial reads are kept in a carry-over buffer
+    and completed with the next chunk
     '''
 
-    lines = chunk.decode().split('\n')
-    for line in lines:
-        skipline = False
-        if line.find('GPAPS')<0:continue
-    
-        data = line.split('GPAPS,')
-        if len(data)<2: continue
-    
-        data_line = data[1]
-        col = data_line.split(',')
-        data_list = col[:-1] + col[-1].split('*')
-        if len(data_list)<n_names:
-            if verbosity>0: print('INCOMPLETE LINE %i columns: %s' % (len(data_list),data_line))
-            continue
+    def __init__(self,sock,verbosity=0):
+        self.sock = sock
+        self.verbosity = verbosity
+        self.carryover = b''
+        self.day_start = None
+        self.day_end = None
+        self.nsentences = 0
+        self.nrejected = 0
+        self.report_tstamp = time.time()
+        return None
 
-        now = utcnow()
-        date_str = '%s%s000' % (now.strftime('%Y%m%d'),data_list[0].strip())
-        try:
-            date = dt.datetime.strptime(date_str,'%Y%m%d%H%M%S.%f')
-        except:
-            if verbosity>0: print('DATE ERROR: %s' % date_str)
-            continue
+    def assign_day(self,now_tstamp):
+        '''
+        timestamp of the start of the current UT day
+        the GPAPS sentence only gives the time of day
+        '''
+        self.day_start = now_tstamp - (now_tstamp % 86400)
+        self.day_end = self.day_start + 86400
+        return
+
+    def checksum_ok(self,sentence,checksum):
+        '''
+        NMEA checksum: XOR of all the bytes between $ and *
+        '''
+        if sentence[0:1]==b'$':
+            body = sentence[1:]
+        else:
+            body = sentence
+        body = body.split(b'*')[0]
+        xor = 0
+        for b in body:
+            xor ^= b
+        return xor==checksum
+
+    def parse(self,chunk):
+        '''
+        parse a chunk read from the serial device and return a recarray with the valid sentences
+        '''
+        buf = self.carryover + chunk
+        lines = buf.split(b'\n')
+        # the last element is incomplete (or empty if the chunk ended with a newline)
+        self.carryover = lines[-1][-1024:]
+
+        now_tstamp = time.time()
+        if self.day_start is None or now_tstamp>=self.day_end:
+            self.assign_day(now_tstamp)
+
+        tod_list = []
+        values_list = []
+        checksum_list = []
+        for line in lines[:-1]:
+            match = gpaps_pattern.search(line)
+            if match is None: continue
+            checksum = int(match.group(2),16)
+            if not self.checksum_ok(match.group(0),checksum):
+                self.nrejected += 1
+                if self.verbosity>0: print('CHECKSUM ERROR: %s' % line)
+                continue
+
+            col = match.group(1).split(b',')
+            if len(col)!=n_values+1:
+                self.nrejected += 1
+                if self.verbosity>0: print('INCOMPLETE LINE %i columns: %s' % (len(col),line))
+                continue
+
+            time_str = col[0]
+            try:
+                tod = 3600*int(time_str[0:2]) + 60*int(time_str[2:4]) + float(time_str[4:])
+            except:
+                self.nrejected += 1
+                if self.verbosity>0: print('DATE ERROR: %s' % time_str)
+                continue
 
+            tod_list.append(tod)
+            values_list.append(col[1:])
+            checksum_list.append(checksum)
+            if self.verbosity==2: print(line)
+
+        npts = len(tod_list)
+        records = np.recarray(shape=(npts),dtype=rec.dtype)
+        if npts==0: return records
         
-        rec[0].timestamp = date.timestamp()
+        # convert all the values at once
+        values = np.array(values_list,dtype='S32')
+        values[(values==b'NONE') | (values==b'FFFF')] = b'65535'
         try:
-            rec[0].checksum = eval('0x%s' % data_list[-1])
-        except:
-            if verbosity>0: print('CHECKSUM ERROR: %s' % data_list[-1])
-            continue
-        for idx,key in enumerate(keys):
-            data_idx = idx + 1
-            val_str = data_list[data_idx]
-            if val_str=='NONE' or val_str=='FFFF':
-                val = 65535
-            else:
+            values = values.astype(float)
+        except ValueError:
+            # fall back to line by line to eliminate the bad ones
+            good = np.ones(npts,dtype=bool)
+            for idx,vals in enumerate(values):
                 try:
-                    val = eval(val_str)
-                except:
-                    if verbosity>0: print('ERROR DATA INTERPRETATION: %s' % (val_str))
-                    skipline = True
-                    continue
-
-            fmt_idx = idx + 2
-            data_type = rec_formats_list[fmt_idx]
-            if data_type.find('int')>=0:
-                cmd = 'rec[0].%s = %i' % (key,val)
-            else:
-                cmd = 'rec[0].%s = %f' % (key,val)
-            if verbosity>3: print('"%10s" %16.6f | %16s | executing: %s' % (val_str,val,data_type,cmd))
-            exec(cmd)
-            
-        if skipline: continue
+                    vals.astype(float)
+                except ValueError:
+                    if self.verbosity>0: print('ERROR DATA INTERPRETATION: %s' % vals)
+                    good[idx] = False
+            self.nrejected += npts - good.sum()
+            records = records[good]
+            values = values[good].astype(float)
+            tod_list = np.array(tod_list)[good]
+            checksum_list = np.array(checksum_list)[good]
+
+        tstamps = self.day_start + np.array(tod_list)
+        # a sentence from just before midnight arriving just after midnight
+        tstamps[tstamps>now_tstamp+43200] -= 86400
         
-        # broadcast the data
-        for rx in receivers:
-            if verbosity==1: print('%s %s %s' % (date_str,rx,rec))
-            if verbosity==2: print(line)
-            if verbosity==3: print(data_list)
-            else: time.sleep(0.05) # need a delay before reading GPS data again
-            sock.sendto(rec,(rx,PORT))
+        records.STX = 0xAA
+        records.timestamp = tstamps
+        for idx,key in enumerate(keys):
+            records[key] = values[:,idx]
+        records.checksum = checksum_list
+        self.nsentences += len(records)
+        return records
+
+    def broadcast(self,records):
+        '''
+        send the records to all the receivers
+        '''
+        for idx in range(len(records)):
+            packet = records[idx:idx+1]
+            for rx in receivers:
+                if self.verbosity==1: print('%s %s' % (rx,packet))
+                self.sock.sendto(packet,(rx,PORT))
+        return
+
+    def report_rate(self):
+        '''
+        report the number of sentences handled per second
+        '''
+        now_tstamp = time.time()
+        delta = now_tstamp - self.report_tstamp
+        if delta<rate_report_interval: return
+        date_str = utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        print('%s | GPAPS: %.2f sentences per second, %i rejected' % (date_str,self.nsentences/delta,self.nrejected))
+        self.nsentences = 0
+        self.nrejected = 0
+        self.report_tstamp = now_tstamp
+        return
+
+    def read_chunk(self,chunk):
+        '''
+        parse and broadcast a chunk of data from the SimpleRTK
+        '''
+        records = self.parse(chunk)
+        self.broadcast(records)
+        self.report_rate()
+        return records
+
+parser = None
+def read_gps_chunk(chunk,sock,verbosity=0):
+    '''
+    read the lines of SimpleRTK info and broadcast
+    '''
+    global parser
+    if parser is None or parser.sock is not sock:
+        parser = gpaps_parser(sock,verbosity=verbosity)
+    parser.read_chunk(chunk)
     return True
 
         
@@ -120,9 +225,8 @@ def broadcast_gps(verbosity=0):
 
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    parser = gpaps_parser(sock,verbosity=verbosity)
 
-    date_now = utcnow()
-    old_date = date_now
     trycount = 0
 
     while True:
@@ -139,7 +243,7 @@ def broadcast_gps(verbosity=0):
                 quit()
             time.sleep(0.1)
             continue
-        status = read_gps_chunk(chunk,sock,verbosity=verbosity)
+        parser.read_chunk(chunk)
 
     return
 
@@ -196,9 +300,10 @@ def plot_orientation(dat,ax,curve=None,dateobj=None,scale=None):
     return curve,dateobj
 
 
-def acquire_gps(listener=None,verbosity=0,monitor=False):
+def acquire_gps(listener=None,verbosity=0,monitor=False,rcvbuf=None):
     '''
     read the SimpleRTK data on socket and write to file
+    rcvbuf is the socket receive buffer size in bytes (default is the system default)
     '''
     if monitor:
         ax = setup_plot_orientation()
@@ -213,18 +318,15 @@ def acquire_gps(listener=None,verbosity=0,monitor=False):
         return None
               
     
-    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    client.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    client.settimeout(0.2)
-    client.bind((listener,PORT))
+    packet_period = 1/8
+    client = udp_receiver('gps',listener,PORT,packetsize,period=packet_period,rcvbuf=rcvbuf,timeout=0.2,verbosity=verbosity)
     h = open('calsource_orientation.dat','ab')
 
-    packet_period = 1/8
     counter = 0
     while True:
         counter += 1
         try:
-            dat = client.recv(packetsize)
+            dat,addr = client.recv()
             h.write(dat)
             h.flush()
             dat_list = struct.unpack(fmt,dat)
@@ -252,6 +354,7 @@ def acquire_gps(listener=None,verbosity=0,monitor=False):
             continue
         except KeyboardInterrupt:
             h.close()
+            client.close()
             now_str = utcnow().strftime('%Y-%m-%d %H:%M:%S')
             print('%8i: %s exit using ctrl-c' % (counter,now_str))
             return
@@ -131,6 +131,8 @@ scripts = ['qubichk/scripts/calsource_commander.py',
            'qubichk/scripts/central_command.py',
            'qubichk/scripts/ups_alarm.py',
            'qubichk/scripts/ups_log.py',
+           'qubichk/scripts/network_probe.py',
+           'qubichk/scripts/update_hk_pyramid.py',
            'qubichk/scripts/calsource_on',
            'qubichk/scripts/calsource_off',
            'qubichk/scripts/show_hk.py',